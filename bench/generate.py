@@ -0,0 +1,106 @@
+import os
+import random
+import sqlite3
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "kennel.sql")
+
+STATUSES = ("Kennel", "Treatment", "Recreation", "Adopted")
+BREEDS = ("Poodle", "Beagle", "Boxer", "Dalmation", "Siamese", "Labrador", "Pug", "Collie")
+FIRST_NAMES = ("Mo", "Bryan", "Jenna", "Emily", "Madi", "Kristen", "Meg", "Hannah", "Leah", "Sam")
+LAST_NAMES = ("Silvera", "Nilsen", "Solis", "Lemmon", "Peper", "Norris", "Ducharme", "Hall")
+PET_NAMES = ("Snickers", "Jax", "Falafel", "Doodles", "Daps", "Cleo", "Popcorn", "Curly", "Rocco")
+STREETS = ("Main St", "Penn Ave", "Madison Ave", "Mulberry Way", "Success Way", "Redirect Ave")
+
+
+def schema_statements():
+    """Returns the CREATE TABLE statements from kennel.sql, without its
+    sample rows and trailing example query
+    """
+    with open(SCHEMA_PATH) as schema_file:
+        statements = schema_file.read().split(";")
+    return [
+        statement.strip()
+        for statement in statements
+        if statement.strip().upper().startswith("CREATE TABLE")
+    ]
+
+
+def generate_database(path, animals, seed=1):
+    """Builds a kennel database with `animals` synthetic animals
+
+    The other tables are sized from the animal count (one location per 1,000
+    animals, a customer per 4 and an employee per 20) so lookups by location,
+    status and email have realistic selectivity at any scale. The same seed
+    always produces the same database.
+
+    Args:
+        path (string): where to write the database. Replaced if it exists.
+        animals (number): how many Animal rows to create
+        seed (number): seed for the random number generator
+
+    Returns:
+        dict: the number of rows in each table
+    """
+    rng = random.Random(seed)
+    counts = {
+        "Location": max(2, animals // 1000),
+        "Customer": max(4, animals // 4),
+        "Employee": max(5, animals // 20),
+        "Animal": animals,
+    }
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    with sqlite3.connect(path) as conn:
+        for statement in schema_statements():
+            conn.execute(statement)
+
+        conn.executemany(
+            "INSERT INTO Location (name, address) VALUES (?, ?)",
+            (
+                (f"Kennel #{n}", _address(rng))
+                for n in range(1, counts["Location"] + 1)
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO Customer (name, address, email, password) VALUES (?, ?, ?, ?)",
+            (
+                (_person(rng), _address(rng), f"customer{n}@example.com", "password")
+                for n in range(1, counts["Customer"] + 1)
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO Employee (name, address, location_id) VALUES (?, ?, ?)",
+            (
+                (_person(rng), _address(rng), rng.randint(1, counts["Location"]))
+                for _ in range(counts["Employee"])
+            ),
+        )
+        conn.executemany(
+            """
+            INSERT INTO Animal (name, status, breed, customer_id, location_id)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (
+                (
+                    rng.choice(PET_NAMES),
+                    rng.choice(STATUSES),
+                    rng.choice(BREEDS),
+                    rng.randint(1, counts["Customer"]),
+                    rng.randint(1, counts["Location"]),
+                )
+                for _ in range(animals)
+            ),
+        )
+
+    return counts
+
+
+def _person(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _address(rng):
+    return f"{rng.randint(1, 9999)} {rng.choice(STREETS)}"
@@ -0,0 +1,274 @@
+"""Runs a load test against an in-process kennel server and prints the
+results as JSON. For example:
+
+    python -m bench.run --scale 100000 --duration 30 --clients 16
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from db import STORAGE_ENGINES, configure_storage, entity_cache
+from request_handler import HandleRequests
+import response_cache
+from server import SERVER_MODES, build_server
+from .generate import generate_database
+from .workload import FALLBACKS, OPERATIONS, WORKLOADS, ClientState, remember_created
+
+
+class QuietHandler(HandleRequests):
+    """HandleRequests without a log line per request, which would otherwise
+    dominate the benchmark's own output and timing
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_benchmark(database, counts, mode="threaded", workers=8, clients=8, duration=10.0, warmup=2.0, workload="mixed", seed=1, storage="sqlite"):
+    """Serves `database` in-process and drives it with `clients` threads
+
+    Args:
+        database (string): path to a database made by generate_database()
+        counts (dict): the row counts generate_database() returned
+        mode (string): the server mode, one of SERVER_MODES
+        workers (number): server worker threads
+        clients (number): concurrent client threads
+        duration (number): seconds to measure for
+        warmup (number): seconds to run before measuring starts
+        workload (string): a key of WORKLOADS
+        seed (number): seed for the clients' random choices
+        storage (string): the storage engine, one of STORAGE_ENGINES
+
+    Returns:
+        dict: the report described in summarize()
+    """
+    configure_storage(storage, database, size=max(5, workers))
+    entity_cache.clear()
+    response_cache.cache.clear()
+
+    port = _free_port()
+    httpd = build_server(QuietHandler, mode=mode, host="127.0.0.1", port=port, workers=workers)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    _wait_for_port(port)
+
+    weights = WORKLOADS[workload]
+    names = list(weights)
+    cumulative_weights = [sum(list(weights.values())[: index + 1]) for index in range(len(names))]
+
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+    results = [[] for _ in range(clients)]
+
+    def client(index):
+        state = ClientState(random.Random(seed * 1000 + index), counts)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+
+            name = state.rng.choices(names, cum_weights=cumulative_weights)[0]
+            request = OPERATIONS[name](state)
+            if request is None:
+                name = FALLBACKS[name]
+                request = OPERATIONS[name](state)
+            (method, path, body, expected) = request
+
+            request_started = time.perf_counter()
+            try:
+                status, payload = _send(conn, method, path, body)
+                ok = status in expected
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                status, payload, ok = None, b"", False
+            elapsed = time.perf_counter() - request_started
+
+            if ok:
+                remember_created(state, method, path, payload)
+            if request_started >= measure_from:
+                results[index].append((name, elapsed, ok))
+
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if hasattr(httpd, "shutdown"):
+        httpd.shutdown()
+        httpd.server_close()
+
+    return summarize([sample for samples in results for sample in samples], duration)
+
+
+def summarize(samples, duration):
+    """Turns (operation, seconds, ok) samples into throughput and latency
+    percentiles, overall and per operation. Latencies are in milliseconds.
+    """
+    by_operation = {}
+    for name, elapsed, ok in samples:
+        by_operation.setdefault(name, []).append((elapsed, ok))
+
+    report = {"overall": _stats([(elapsed, ok) for _, elapsed, ok in samples], duration)}
+    report["operations"] = {
+        name: _stats(operation_samples, duration)
+        for name, operation_samples in sorted(by_operation.items())
+    }
+    return report
+
+
+def _stats(samples, duration):
+    latencies = sorted(elapsed for elapsed, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / duration, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else None,
+    }
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list, in milliseconds"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return round(sorted_values[int(rank) - 1] * 1000, 3)
+
+
+def _send(conn, method, path, body):
+    headers = {}
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+
+    conn.request(method, path, body=data, headers=headers)
+    response = conn.getresponse()
+    payload = response.read()
+    if response.will_close:
+        conn.close()
+    return (response.status, payload)
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"The server never started listening on port {port}")
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kennels API load test")
+    parser.add_argument("--scale", type=int, default=1000, help="number of animals to generate")
+    parser.add_argument("--database", help="where to build the database (default: a temp file)")
+    parser.add_argument("--reuse", action="store_true", help="use --database as is if it exists")
+    parser.add_argument("--mode", choices=SERVER_MODES, default="threaded")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--storage", choices=STORAGE_ENGINES, default="sqlite")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.mkdtemp(prefix="kennel-bench-"), "kennel.sqlite3")
+
+    generate_started = time.perf_counter()
+    if args.reuse and os.path.exists(database):
+        counts = _count_rows(database)
+    else:
+        counts = generate_database(database, args.scale, args.seed)
+    generate_seconds = time.perf_counter() - generate_started
+
+    report = {
+        "revision": _git_revision(),
+        "config": {
+            "scale": args.scale,
+            "rows": counts,
+            "mode": args.mode,
+            "workers": args.workers,
+            "clients": args.clients,
+            "duration": args.duration,
+            "workload": args.workload,
+            "storage": args.storage,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+        },
+        "generate_seconds": round(generate_seconds, 2),
+    }
+    report.update(
+        run_benchmark(
+            database,
+            counts,
+            mode=args.mode,
+            workers=args.workers,
+            clients=args.clients,
+            duration=args.duration,
+            warmup=args.warmup,
+            workload=args.workload,
+            seed=args.seed,
+            storage=args.storage,
+        )
+    )
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+
+
+def _count_rows(database):
+    import sqlite3
+
+    with sqlite3.connect(database) as conn:
+        return {
+            table: conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+            for table in ("Location", "Customer", "Employee", "Animal")
+        }
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import json
+
+# Every operation the benchmark can send. Each one maps to a function that
+# picks its target and returns (method, path, body) plus the status codes
+# that count as success. Together they cover every HandleRequests route.
+OPERATIONS = {}
+
+# How often each operation is picked, relative to the others, per workload
+WORKLOADS = {
+    "mixed": {
+        "list_animals": 1,
+        "page_animals": 8,
+        "page_animals_expanded": 4,
+        "get_animal": 20,
+        "get_animal_expanded": 6,
+        "animals_by_location": 4,
+        "animals_by_status": 4,
+        "animals_filtered": 2,
+        "list_locations": 4,
+        "get_location": 6,
+        "page_customers": 3,
+        "get_customer": 8,
+        "customers_by_email": 4,
+        "page_employees": 3,
+        "get_employee": 6,
+        "employees_by_location": 4,
+        "create_animal": 4,
+        "create_animals_bulk": 1,
+        "update_animal": 4,
+        "delete_animal": 2,
+        "create_customer": 1,
+        "update_customer": 1,
+        "delete_customer": 1,
+        "create_employee": 1,
+        "update_employee": 1,
+        "delete_employee": 1,
+        "create_location": 1,
+        "update_location": 1,
+    },
+    "read": {
+        "page_animals": 10,
+        "page_animals_expanded": 5,
+        "get_animal": 30,
+        "get_animal_expanded": 10,
+        "animals_by_location": 5,
+        "animals_by_status": 5,
+        "animals_filtered": 3,
+        "list_locations": 5,
+        "get_location": 10,
+        "get_customer": 10,
+        "customers_by_email": 5,
+        "get_employee": 10,
+        "employees_by_location": 5,
+    },
+    "write": {
+        "create_animal": 10,
+        "create_animals_bulk": 2,
+        "update_animal": 10,
+        "delete_animal": 5,
+        "update_customer": 3,
+        "update_employee": 3,
+        "update_location": 1,
+        "get_animal": 10,
+    },
+}
+
+OK = (200, 201, 204)
+
+# Deletes only remove rows their client created. Until it has created one,
+# the operation on the right runs instead.
+FALLBACKS = {
+    "delete_animal": "create_animal",
+    "delete_employee": "create_employee",
+}
+
+
+class ClientState():
+    """What one benchmark client knows about the database it is driving"""
+
+    def __init__(self, rng, counts):
+        self.rng = rng
+        self.counts = counts
+        # Rows this client created, so deletes never run out of targets and
+        # never remove the generated data other clients are reading
+        self.created = {"animals": [], "employees": []}
+
+    def random_id(self, table):
+        return self.rng.randint(1, self.counts[table])
+
+
+def operation(name):
+    def register(function):
+        OPERATIONS[name] = function
+        return function
+
+    return register
+
+
+def _animal(state):
+    return {
+        "name": "Bench",
+        "status": state.rng.choice(("Kennel", "Treatment", "Recreation")),
+        "breed": "Poodle",
+        "customer_id": state.random_id("Customer"),
+        "location_id": state.random_id("Location"),
+    }
+
+
+@operation("list_animals")
+def list_animals(state):
+    return ("GET", "/animals", None, OK)
+
+
+@operation("page_animals")
+def page_animals(state):
+    after_id = state.rng.randint(0, state.counts["Animal"])
+    return ("GET", f"/animals?limit=50&after_id={after_id}", None, OK)
+
+
+@operation("page_animals_expanded")
+def page_animals_expanded(state):
+    after_id = state.rng.randint(0, state.counts["Animal"])
+    return ("GET", f"/animals?limit=50&after_id={after_id}&_expand=location,customer", None, OK)
+
+
+@operation("get_animal")
+def get_animal(state):
+    return ("GET", f"/animals/{state.random_id('Animal')}", None, OK)
+
+
+@operation("get_animal_expanded")
+def get_animal_expanded(state):
+    return ("GET", f"/animals/{state.random_id('Animal')}?_expand=location,customer", None, OK)
+
+
+@operation("animals_by_location")
+def animals_by_location(state):
+    return ("GET", f"/animals?location_id={state.random_id('Location')}", None, OK)
+
+
+@operation("animals_by_status")
+def animals_by_status(state):
+    status = state.rng.choice(("Kennel", "Treatment", "Recreation", "Adopted"))
+    return ("GET", f"/animals?status={status}", None, OK)
+
+
+@operation("animals_filtered")
+def animals_filtered(state):
+    statuses = ",".join(state.rng.sample(("Kennel", "Treatment", "Recreation", "Adopted"), 2))
+    location_id = state.random_id("Location")
+    return (
+        "GET",
+        f"/animals?location_id={location_id}&status__in={statuses}&order_by=name&limit=50",
+        None,
+        OK,
+    )
+
+
+@operation("list_locations")
+def list_locations(state):
+    return ("GET", "/locations", None, OK)
+
+
+@operation("get_location")
+def get_location(state):
+    return ("GET", f"/locations/{state.random_id('Location')}", None, OK)
+
+
+@operation("page_customers")
+def page_customers(state):
+    after_id = state.rng.randint(0, state.counts["Customer"])
+    return ("GET", f"/customers?limit=50&after_id={after_id}&fields=id,name,email", None, OK)
+
+
+@operation("get_customer")
+def get_customer(state):
+    return ("GET", f"/customers/{state.random_id('Customer')}", None, OK)
+
+
+@operation("customers_by_email")
+def customers_by_email(state):
+    return ("GET", f"/customers?email=customer{state.random_id('Customer')}@example.com", None, OK)
+
+
+@operation("page_employees")
+def page_employees(state):
+    after_id = state.rng.randint(0, state.counts["Employee"])
+    return ("GET", f"/employees?limit=50&after_id={after_id}", None, OK)
+
+
+@operation("get_employee")
+def get_employee(state):
+    return ("GET", f"/employees/{state.random_id('Employee')}", None, OK)
+
+
+@operation("employees_by_location")
+def employees_by_location(state):
+    return ("GET", f"/employees?location_id={state.random_id('Location')}", None, OK)
+
+
+@operation("create_animal")
+def create_animal(state):
+    return ("POST", "/animals", _animal(state), OK)
+
+
+@operation("create_animals_bulk")
+def create_animals_bulk(state):
+    return ("POST", "/animals", [_animal(state) for _ in range(25)], OK)
+
+
+@operation("update_animal")
+def update_animal(state):
+    return ("PUT", f"/animals/{state.random_id('Animal')}", _animal(state), OK)
+
+
+@operation("delete_animal")
+def delete_animal(state):
+    if not state.created["animals"]:
+        return None
+    return ("DELETE", f"/animals/{state.created['animals'].pop()}", None, OK)
+
+
+@operation("create_customer")
+def create_customer(state):
+    customer = {
+        "name": "Bench Customer",
+        "address": "1 Bench Way",
+        "email": f"bench{state.rng.getrandbits(32)}@example.com",
+        "password": "password",
+    }
+    return ("POST", "/customers", customer, OK)
+
+
+@operation("update_customer")
+def update_customer(state):
+    id = state.random_id("Customer")
+    customer = {
+        "name": "Bench Customer",
+        "address": "1 Bench Way",
+        "email": f"customer{id}@example.com",
+        "password": "password",
+    }
+    return ("PUT", f"/customers/{id}", customer, OK)
+
+
+@operation("delete_customer")
+def delete_customer(state):
+    # Deleting customers isn't supported, the 405 is the expected answer
+    return ("DELETE", f"/customers/{state.random_id('Customer')}", None, (405,))
+
+
+@operation("create_employee")
+def create_employee(state):
+    employee = {
+        "name": "Bench Employee",
+        "address": "1 Bench Way",
+        "location_id": state.random_id("Location"),
+    }
+    return ("POST", "/employees", employee, OK)
+
+
+@operation("update_employee")
+def update_employee(state):
+    employee = {
+        "name": "Bench Employee",
+        "address": "1 Bench Way",
+        "location_id": state.random_id("Location"),
+    }
+    return ("PUT", f"/employees/{state.random_id('Employee')}", employee, OK)
+
+
+@operation("delete_employee")
+def delete_employee(state):
+    if not state.created["employees"]:
+        return None
+    return ("DELETE", f"/employees/{state.created['employees'].pop()}", None, OK)
+
+
+@operation("create_location")
+def create_location(state):
+    return ("POST", "/locations", {"name": "Bench Kennel", "address": "1 Bench Way"}, OK)
+
+
+@operation("update_location")
+def update_location(state):
+    location = {"name": "Bench Kennel", "address": "1 Bench Way"}
+    return ("PUT", f"/locations/{state.random_id('Location')}", location, OK)
+
+
+def remember_created(state, method, path, body):
+    """Keeps the ids of created animals and employees for later deletes"""
+    if method != "POST" or path not in ("/animals", "/employees"):
+        return
+
+    created = json.loads(body)
+    for row in created if isinstance(created, list) else [created]:
+        state.created[path.strip("/")].append(row["id"])
@@ -0,0 +1,341 @@
+import threading
+from router import HTTPError, Response
+
+# Whether identical concurrent GETs share one response. See SingleFlight.
+enabled = True
+
+
+class _Call():
+    """One response being worked out, that identical requests wait for"""
+
+    __slots__ = ("ready", "response", "error", "streamed", "changed", "chunks", "size", "ended", "complete", "keep", "followers")
+
+    def __init__(self):
+        # Set once the route has returned or raised
+        self.ready = threading.Event()
+        # The finished response, or for a streamed one its status and headers
+        self.response = None
+        # The HTTPError the route raised instead, which is shared too
+        self.error = None
+
+        # Whether the body is a stream, whose chunks the followers read
+        # from `chunks` as the leader sends them
+        self.streamed = False
+        # Notified whenever a chunk is added or the stream ends
+        self.changed = threading.Condition()
+        self.chunks = []
+        self.size = 0
+        # Whether the leader's stream has stopped, and whether it got to the end
+        self.ended = False
+        self.complete = False
+        # Whether chunks are still being kept. They are dropped from a body
+        # too big to share that nobody is following.
+        self.keep = True
+        # Requests that joined this call and haven't finished with it
+        self.followers = 0
+
+
+class SingleFlight():
+    """Lets identical requests that arrive together share one response
+
+    The first request for a key (the leader) runs the route. Any request
+    for the same key that arrives before it finishes (a follower) waits
+    and gets a copy of the leader's response, body bytes and all, instead
+    of running the same queries again.
+
+    A streamed body is still streamed to the leader's client as it's read.
+    Each chunk is kept for the followers too, who send the chunks from the
+    start and then each new one as the leader gets it. Once a body is
+    bigger than `max_body_bytes` no more followers can join, and unless
+    some already have, the chunks stop being kept.
+    """
+
+    def __init__(self, max_body_bytes=8 * 1024 * 1024, wait_timeout=30.0):
+        """
+        Args:
+            max_body_bytes (number): the biggest body that is shared
+            wait_timeout (number): seconds a follower waits for the leader
+                before giving up, running the route itself if it hasn't
+                started sending yet
+        """
+        self.max_body_bytes = max_body_bytes
+        self.wait_timeout = wait_timeout
+
+        # key -> _Call for every response being worked out right now
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self._stats = {
+            "leaders": 0,
+            "coalesced": 0,
+            "fallbacks": 0,
+            "oversized": 0,
+        }
+
+    def run(self, key, compute):
+        """Returns compute()'s response, or the one an identical request
+        already in flight gets
+
+        Args:
+            key (tuple): what makes two requests identical
+            compute (function): runs the route and returns its Response
+
+        Returns:
+            Response: the leader's response, a copy of it with a bytes
+            body, or one streaming the leader's chunks
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+            else:
+                call.followers += 1
+
+        if not leader:
+            return self._follow(call, compute)
+
+        try:
+            response = compute()
+        except HTTPError as ex:
+            # e.g. a 404, which every follower would have got as well
+            call.error = ex
+            self._end(key, call, False)
+            raise
+        except BaseException:
+            self._end(key, call, False)
+            raise
+
+        if response.stream is None:
+            response.body = response.encode()
+            # The leader adds its own headers to the one it sends
+            call.response = response.copy()
+            self._end(key, call, True)
+            return response
+
+        # The call stays open to followers until the stream ends, see _Tee
+        call.streamed = True
+        call.response = Response(
+            response.status, None, dict(response.headers), content_type=response.content_type
+        )
+        response.stream = _Tee(self, key, call, response.stream)
+        call.ready.set()
+        return response
+
+    def _follow(self, call, compute):
+        """Waits for the leader's response and returns a copy of it"""
+        if not call.ready.wait(self.wait_timeout):
+            # The leader is taking too long to even start
+            self._leave(call)
+            with self._lock:
+                self._stats["fallbacks"] += 1
+            return compute()
+
+        if call.error is None and call.response is None:
+            # The leader's route failed with something other than an
+            # HTTPError, which its own request logs and answers with a 500.
+            # Nothing to share, so run the route here instead.
+            self._leave(call)
+            with self._lock:
+                self._stats["fallbacks"] += 1
+            return compute()
+
+        with self._lock:
+            self._stats["coalesced"] += 1
+
+        if call.error is not None:
+            self._leave(call)
+            raise HTTPError(
+                call.error.status, call.error.message, dict(call.error.headers), call.error.errors
+            )
+
+        if not call.streamed:
+            self._leave(call)
+            return call.response.copy()
+
+        shared = call.response
+        return Response(
+            shared.status,
+            None,
+            dict(shared.headers),
+            stream=_FollowerStream(self, call),
+            content_type=shared.content_type,
+        )
+
+    def _read_chunks(self, call):
+        """Yields a streamed response's chunks, waiting for the leader to
+        read each one that hasn't arrived yet
+        """
+        index = 0
+        while True:
+            with call.changed:
+                while index == len(call.chunks) and not call.ended:
+                    if not call.changed.wait(self.wait_timeout):
+                        raise ConnectionAbortedError("The shared response stalled")
+                chunks = call.chunks[index:]
+                ended = call.ended
+                complete = call.complete
+
+            index += len(chunks)
+            yield from chunks
+
+            if ended:
+                if not complete:
+                    # The leader's route failed mid-stream, so this
+                    # response can't be finished either
+                    raise ConnectionAbortedError("The shared response broke off")
+                return
+
+    def _share(self, key, call, chunk):
+        """Keeps a chunk the leader read, for the followers"""
+        with call.changed:
+            if not call.keep:
+                return
+            call.chunks.append(chunk)
+            call.size += len(chunk)
+            call.changed.notify_all()
+            oversized = call.size > self.max_body_bytes
+
+        if not oversized:
+            return
+
+        with self._lock:
+            if self._calls.get(key) is call:
+                # Too big to share with anyone else
+                del self._calls[key]
+                self._stats["oversized"] += 1
+            if call.followers == 0:
+                with call.changed:
+                    call.keep = False
+                    call.chunks = []
+
+    def _end(self, key, call, complete):
+        """Closes a call to new followers and tells the waiting ones it's over"""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        with call.changed:
+            call.ended = True
+            call.complete = complete
+            call.changed.notify_all()
+        call.ready.set()
+
+    def _leave(self, call):
+        with self._lock:
+            call.followers -= 1
+
+    def stats(self):
+        """Returns a snapshot of the counters"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["in_flight"] = len(self._calls)
+        return snapshot
+
+
+class _FollowerStream():
+    """A follower's copy of a streamed response, see SingleFlight._read_chunks()
+
+    A class rather than a generator so that close() stops the call counting
+    this follower even if the stream was never iterated, e.g. because the
+    client hung up before the headers went out.
+    """
+
+    def __init__(self, flight, call):
+        self._flight = flight
+        self._call = call
+        self._chunks = flight._read_chunks(call)
+        self._left = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """Ends the stream. Safe to call more than once."""
+        self._chunks.close()
+        if not self._left:
+            self._left = True
+            self._flight._leave(self._call)
+
+
+class _Tee():
+    """The leader's stream, handing each chunk to the followers as the
+    leader reads it
+    """
+
+    def __init__(self, flight, key, call, stream):
+        self._flight = flight
+        self._key = key
+        self._call = call
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._ended = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self._end(True)
+            raise
+        except BaseException:
+            self._end(False)
+            raise
+
+        self._flight._share(self._key, self._call, chunk)
+        return chunk
+
+    def close(self):
+        """Releases the stream. If the leader stopped early, e.g. because its
+        client hung up, the rest is read for any followers first.
+        """
+        if not self._ended:
+            flight = self._flight
+            with flight._lock:
+                # Nobody new can join a response that won't be finished
+                if flight._calls.get(self._key) is self._call:
+                    del flight._calls[self._key]
+                followed = self._call.followers > 0
+            complete = False
+            if followed:
+                try:
+                    for chunk in self._iterator:
+                        flight._share(self._key, self._call, chunk)
+                    complete = True
+                except Exception:
+                    pass
+            self._end(complete)
+
+        # Releases the cursor's pooled connection
+        if hasattr(self._stream, "close"):
+            self._stream.close()
+
+    def _end(self, complete):
+        if not self._ended:
+            self._ended = True
+            self._flight._end(self._key, self._call, complete)
+
+
+# The one shared by every request handler thread
+single_flight = SingleFlight()
+
+
+def coalesce_metrics():
+    """Samples of the single-flight counters, for metrics.add_collector()"""
+    stats = single_flight.stats()
+    return [
+        ("kennel_coalesce_leaders_total", "counter", "GETs that ran their route for any identical GETs arriving meanwhile", [({}, stats["leaders"])]),
+        ("kennel_coalesced_requests_total", "counter", "GETs answered with an identical in-flight GET's response", [({}, stats["coalesced"])]),
+        ("kennel_coalesce_fallbacks_total", "counter", "GETs that waited for an identical GET but had to run their route anyway", [({}, stats["fallbacks"])]),
+        ("kennel_coalesce_oversized_total", "counter", "Responses too big to share with identical GETs", [({}, stats["oversized"])]),
+        ("kennel_coalesce_in_flight", "gauge", "GETs being answered that identical GETs can join", [({}, stats["in_flight"])]),
+    ]
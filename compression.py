@@ -0,0 +1,191 @@
+import threading
+import time
+import zlib
+
+# zstd and brotli are only offered when their packages are installed.
+# gzip comes with Python, so it is always available.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses with smaller bodies than this many bytes are sent as they are.
+# Streamed responses are always compressed, since their size isn't known
+# up front and they are only used for whole collections.
+minimum_size = 1024
+
+_lock = threading.Lock()
+# encoding -> {"responses", "bytes_in", "bytes_out", "seconds"}
+_totals = {}
+
+
+class _GzipCompressor():
+    """Incremental gzip, with the header and trailer browsers expect"""
+
+    def __init__(self):
+        # wbits=31 writes a gzip container instead of a bare zlib stream.
+        # Level 6 is zlib's default balance of speed and size.
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class _ZstdCompressor():
+    """Incremental zstd, when the zstandard package is installed"""
+
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor():
+    """Incremental brotli, when the brotli package is installed"""
+
+    def __init__(self):
+        # Brotli's default quality (11) is far too slow for dynamic responses
+        self._compressor = brotli.Compressor(quality=4)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+# Every encoding this server can produce, most preferred first
+ENCODINGS = {}
+if zstandard is not None:
+    ENCODINGS["zstd"] = _ZstdCompressor
+if brotli is not None:
+    ENCODINGS["br"] = _BrotliCompressor
+ENCODINGS["gzip"] = _GzipCompressor
+
+
+def negotiate(accept_encoding):
+    """Picks the encoding to send for an Accept-Encoding header
+
+    Args:
+        accept_encoding (string): the header, e.g. "gzip, br;q=0.5", or None
+
+    Returns:
+        string: one of the ENCODINGS keys, or None to send the body as is
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    # Take the client's favourite, breaking ties with the server's order
+    best = None
+    best_quality = 0.0
+    for name in ENCODINGS:
+        quality = accepted.get(name, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def compress(encoding, body):
+    """Compresses a whole response body
+
+    Args:
+        encoding (string): one of the ENCODINGS keys
+        body (bytes): the uncompressed body
+
+    Returns:
+        bytes: the compressed body
+    """
+    started = time.perf_counter()
+    compressor = ENCODINGS[encoding]()
+    compressed = compressor.compress(body) + compressor.flush()
+    _record(encoding, len(body), len(compressed), time.perf_counter() - started)
+    return compressed
+
+
+def compress_stream(encoding, chunks):
+    """Compresses a streamed body chunk by chunk, so a large collection is
+    never held in memory, compressed or not
+
+    Args:
+        encoding (string): one of the ENCODINGS keys
+        chunks (iterable): the body as a sequence of bytes objects
+
+    Yields:
+        bytes: pieces of the compressed body. Some chunks compress to
+            nothing until the compressor has buffered enough input.
+    """
+    compressor = ENCODINGS[encoding]()
+    bytes_in = 0
+    bytes_out = 0
+    seconds = 0.0
+
+    try:
+        for chunk in chunks:
+            started = time.perf_counter()
+            compressed = compressor.compress(chunk)
+            seconds += time.perf_counter() - started
+            bytes_in += len(chunk)
+            bytes_out += len(compressed)
+            yield compressed
+
+        started = time.perf_counter()
+        compressed = compressor.flush()
+        seconds += time.perf_counter() - started
+        bytes_out += len(compressed)
+        yield compressed
+    finally:
+        # Release the underlying cursor even if the client hung up
+        if hasattr(chunks, "close"):
+            chunks.close()
+        _record(encoding, bytes_in, bytes_out, seconds)
+
+
+def _record(encoding, bytes_in, bytes_out, seconds):
+    with _lock:
+        totals = _totals.get(encoding)
+        if totals is None:
+            totals = _totals[encoding] = {"responses": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+        totals["responses"] += 1
+        totals["bytes_in"] += bytes_in
+        totals["bytes_out"] += bytes_out
+        totals["seconds"] += seconds
+
+
+def compression_metrics():
+    """Samples of the compression totals, for metrics.add_collector()"""
+    with _lock:
+        totals = {encoding: dict(values) for encoding, values in _totals.items()}
+
+    def samples(key):
+        return [({"encoding": encoding}, values[key]) for encoding, values in sorted(totals.items())]
+
+    return [
+        ("kennel_compressed_responses_total", "counter", "Responses sent compressed", samples("responses")),
+        ("kennel_compression_input_bytes_total", "counter", "Bytes fed to the compressors", samples("bytes_in")),
+        ("kennel_compression_output_bytes_total", "counter", "Compressed bytes produced", samples("bytes_out")),
+        ("kennel_compression_seconds_total", "counter", "CPU time spent compressing", samples("seconds")),
+    ]
@@ -0,0 +1,27 @@
+from .connection_pool import (
+    ConnectionPool,
+    DATABASE_PATH,
+    DEFAULT_CACHED_STATEMENTS,
+    PoolTimeout,
+    configure_pool,
+    get_pool,
+    get_connection,
+    pool_metrics,
+)
+from .migrations import MIGRATIONS, TABLES, run_migrations, schema_version
+from .table_versions import get_table_versions
+from .queries import (
+    QUERIES,
+    QueryError,
+    register_query,
+    execute,
+    executemany,
+    validate_queries,
+    query_stats,
+    query_metrics,
+)
+from .entity_cache import EntityCache, cached_entity, entity_cache, cache_metrics
+from .storage import TABLE_COLUMNS, Storage, uses_keyset
+from .sqlite_storage import SqliteStorage, filter_metrics, register_scan, register_update
+from .memory_storage import MemoryStorage
+from .engine import STORAGE_ENGINES, configure_storage, get_storage
@@ -0,0 +1,347 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from .instrumented import InstrumentedConnection
+
+# Where the kennel database lives unless configure_pool() says otherwise
+DATABASE_PATH = "./kennel.sqlite3"
+
+# Pragmas applied to every connection the pool opens. These are per-connection
+# settings, so they have to be re-applied each time a new connection is made.
+# journal_mode is the exception: run_migrations() sets WAL once on the file.
+DEFAULT_PRAGMAS = {
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    # In WAL mode NORMAL only fsyncs at checkpoints. A power cut can lose the
+    # last few commits but never corrupts the database.
+    "synchronous": "NORMAL",
+    # Negative sizes are in KiB, so this is an 8 MiB page cache per connection
+    "cache_size": -8000,
+    # Read pages straight out of a 128 MiB memory map instead of read() calls
+    "mmap_size": 128 * 1024 * 1024,
+}
+
+# Prepared statements each connection keeps, see queries.py. Big enough for
+# the whole query catalog plus the filtered page shapes compile_select()
+# caches, so a statement is only prepared once per connection.
+DEFAULT_CACHED_STATEMENTS = 512
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up before the checkout timeout"""
+
+
+class ConnectionPool():
+    """A bounded pool of SQLite connections shared by all of the views modules.
+
+    Opening a connection means re-reading and re-parsing the schema, so the
+    pool keeps up to `size` connections open and hands them out one thread
+    at a time. A thread that already holds a connection gets the same one
+    back on a nested checkout, which keeps calls like get_all_animals ->
+    get_single_location inside one connection.
+    """
+
+    def __init__(
+        self,
+        path=DATABASE_PATH,
+        size=5,
+        timeout=10.0,
+        pragmas=None,
+        health_check_interval=30.0,
+        cached_statements=DEFAULT_CACHED_STATEMENTS,
+    ):
+        """
+        Args:
+            path (string): the SQLite database file to connect to
+            size (number): the most connections the pool will ever open
+            timeout (number): seconds to wait for a free connection before
+                raising PoolTimeout
+            pragmas (dict): extra pragmas merged over DEFAULT_PRAGMAS
+            health_check_interval (number): seconds a connection may sit idle
+                before it is pinged with `SELECT 1` on checkout
+            cached_statements (number): prepared statements each connection
+                keeps for reuse, least recently used dropped first
+        """
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self.health_check_interval = health_check_interval
+        self.cached_statements = cached_statements
+
+        # Idle connections are kept as [connection, last_used] pairs and used
+        # as a stack, so the most recently used (warmest) one goes out first
+        self._idle = []
+        self._opened = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._local = threading.local()
+
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "checkout_seconds_total": 0.0,
+            "checkout_seconds_max": 0.0,
+            "timeouts": 0,
+            "opened": 0,
+            "discarded": 0,
+            "health_check_failures": 0,
+        }
+
+    @contextmanager
+    def connection(self):
+        """Checks a connection out of the pool for the length of a `with` block.
+
+        Behaves like `with sqlite3.connect(...) as conn:` did: the transaction
+        is committed when the block finishes and rolled back if it raises.
+        """
+        held = getattr(self._local, "held", None)
+        if held is not None:
+            # Nested checkout on this thread. The outer block owns the
+            # transaction, so just share the connection.
+            yield held
+            return
+
+        conn = self._acquire()
+        self._local.held = conn
+        checked_out = time.perf_counter()
+        healthy = True
+
+        try:
+            with conn:
+                yield conn
+        except (sqlite3.OperationalError, sqlite3.InterfaceError, sqlite3.ProgrammingError):
+            # The connection itself may be in a bad state (closed, locked
+            # file handle, ...). Don't hand it to the next caller.
+            healthy = False
+            raise
+        finally:
+            self._local.held = None
+            self._release(conn, healthy, time.perf_counter() - checked_out)
+
+    def stats(self):
+        """Returns a snapshot of the pool counters for sizing the pool"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["size"] = self.size
+            snapshot["cached_statements"] = self.cached_statements
+            snapshot["open"] = self._opened
+            snapshot["idle"] = len(self._idle)
+            snapshot["in_use"] = self._opened - len(self._idle)
+        return snapshot
+
+    def close(self):
+        """Closes every idle connection and stops handing out new ones"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._released.notify_all()
+
+        for conn, _ in idle:
+            conn.close()
+
+    def _acquire(self):
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        waited = False
+
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("The connection pool has been closed")
+
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+
+                if self._opened < self.size:
+                    # Reserve the slot now and open the connection outside
+                    # the lock so other threads aren't held up by it
+                    self._opened += 1
+                    conn = None
+                    break
+
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {self.timeout}s"
+                    )
+
+                waited = True
+                self._released.wait(remaining)
+
+        if conn is None:
+            conn = self._open()
+        elif time.perf_counter() - last_used > self.health_check_interval:
+            conn = self._check_health(conn)
+
+        wait_seconds = time.perf_counter() - started
+        with self._lock:
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["wait_seconds_total"] += wait_seconds
+            self._stats["wait_seconds_max"] = max(
+                self._stats["wait_seconds_max"], wait_seconds
+            )
+
+        return conn
+
+    def _release(self, conn, healthy, held_seconds):
+        # Views set their own row_factory, so start every checkout clean
+        conn.row_factory = None
+
+        with self._lock:
+            self._stats["checkout_seconds_total"] += held_seconds
+            self._stats["checkout_seconds_max"] = max(
+                self._stats["checkout_seconds_max"], held_seconds
+            )
+
+            if healthy and not self._closed:
+                self._idle.append([conn, time.perf_counter()])
+                conn = None
+            else:
+                self._opened -= 1
+                self._stats["discarded"] += 1
+
+            self._released.notify()
+
+        if conn is not None:
+            conn.close()
+
+    def _open(self):
+        try:
+            # Connections move between threads as they are checked in and
+            # out, but only one thread ever uses a connection at a time
+            conn = sqlite3.connect(
+                self.path,
+                check_same_thread=False,
+                factory=InstrumentedConnection,
+                cached_statements=self.cached_statements,
+            )
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+                self._released.notify()
+            raise
+
+        with self._lock:
+            self._stats["opened"] += 1
+
+        return conn
+
+    def _check_health(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._stats["health_check_failures"] += 1
+                self._stats["discarded"] += 1
+            # The slot is still reserved for us, so open a replacement in it
+            return self._open()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_pool(**options):
+    """Replaces the shared pool with one built from the given options
+
+    Args:
+        options: any ConnectionPool keyword argument (path, size, timeout,
+            pragmas, health_check_interval, cached_statements)
+
+    Returns:
+        ConnectionPool: the new shared pool
+    """
+    global _pool
+
+    with _pool_lock:
+        old_pool, _pool = _pool, ConnectionPool(**options)
+
+    if old_pool is not None:
+        old_pool.close()
+
+    return _pool
+
+
+def get_pool():
+    """Returns the shared pool, creating a default one on first use"""
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+
+    return _pool
+
+
+def pool_metrics():
+    """Samples of the shared pool's counters, for metrics.add_collector()"""
+    stats = get_pool().stats()
+    return [
+        ("kennel_pool_connections", "gauge", "Pooled connections by state", [
+            ({"state": "idle"}, stats["idle"]),
+            ({"state": "in_use"}, stats["in_use"]),
+        ]),
+        ("kennel_pool_size", "gauge", "Most connections the pool may open", [({}, stats["size"])]),
+        ("kennel_pool_cached_statements", "gauge", "Prepared statements each connection keeps", [({}, stats["cached_statements"])]),
+        ("kennel_pool_checkouts_total", "counter", "Connections checked out", [({}, stats["checkouts"])]),
+        ("kennel_pool_waits_total", "counter", "Checkouts that had to wait for a connection", [({}, stats["waits"])]),
+        ("kennel_pool_wait_seconds_total", "counter", "Time spent waiting for a connection", [({}, stats["wait_seconds_total"])]),
+        ("kennel_pool_checkout_seconds_total", "counter", "Time connections spent checked out", [({}, stats["checkout_seconds_total"])]),
+        ("kennel_pool_timeouts_total", "counter", "Checkouts that gave up waiting", [({}, stats["timeouts"])]),
+    ]
+
+
+def get_connection():
+    """Shortcut for `get_pool().connection()` used by the views modules"""
+    return get_pool().connection()
+
+
+# Pools inherited from the parent process by a forked child. See below.
+_inherited_pools = []
+
+
+def _reset_after_fork():
+    """Gives a forked child process a pool of its own
+
+    SQLite connections must never be used on both sides of a fork, and that
+    includes closing them: a child closing the last connection it knows of
+    may checkpoint and delete the WAL file the parent is still using. So the
+    child keeps its copies of the parent's connections referenced, and never
+    touched, and opens fresh ones with the same settings.
+    """
+    global _pool, _pool_lock
+
+    _pool_lock = threading.Lock()
+    if _pool is None:
+        return
+
+    old_pool = _pool
+    _inherited_pools.append(old_pool)
+    # By keyword, so an option added to the pool can't be silently dropped
+    _pool = ConnectionPool(
+        path=old_pool.path,
+        size=old_pool.size,
+        timeout=old_pool.timeout,
+        pragmas=old_pool.pragmas,
+        health_check_interval=old_pool.health_check_interval,
+        cached_statements=old_pool.cached_statements,
+    )
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
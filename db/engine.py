@@ -0,0 +1,68 @@
+import threading
+from .connection_pool import DATABASE_PATH, configure_pool
+from .memory_storage import MemoryStorage
+from .migrations import run_migrations
+from .queries import validate_queries
+from .sqlite_storage import SqliteStorage
+
+# The engines configure_storage() accepts
+STORAGE_ENGINES = ("sqlite", "memory")
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def configure_storage(engine="sqlite", path=DATABASE_PATH, **pool_options):
+    """Picks the storage engine every view uses, and the database file
+
+    The connection pool is pointed at the file either way and the file's
+    migrations are run, since the memory engine loads its snapshot from it
+    and saves back to it. Then every statement in the query catalog is
+    checked against the schema.
+
+    Args:
+        engine (string): one of STORAGE_ENGINES
+        path (string): the SQLite database file
+        pool_options: any other ConnectionPool keyword argument
+
+    Returns:
+        Storage: the new shared storage
+
+    Raises:
+        QueryError: if a catalog statement doesn't match the schema
+    """
+    global _storage
+
+    if engine not in STORAGE_ENGINES:
+        raise ValueError(f"Unknown storage engine {engine!r}, expected one of {STORAGE_ENGINES}")
+
+    configure_pool(path=path, **pool_options)
+    # Make sure the indexes and WAL journaling are in place before serving
+    run_migrations()
+    validate_queries()
+
+    if engine == "memory":
+        storage = MemoryStorage()
+        storage.load_snapshot(path)
+    else:
+        storage = SqliteStorage()
+
+    with _storage_lock:
+        old_storage, _storage = _storage, storage
+
+    if old_storage is not None:
+        old_storage.close()
+
+    return _storage
+
+
+def get_storage():
+    """Returns the shared storage, SQLite in the pool's file by default"""
+    global _storage
+
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = SqliteStorage()
+
+    return _storage
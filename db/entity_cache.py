@@ -0,0 +1,218 @@
+import functools
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# How long (in seconds) a cached row is trusted, per table. Locations and
+# customers almost never change, animals move between statuses all day.
+DEFAULT_TTLS = {
+    "Animal": 30,
+    "Customer": 600,
+    "Employee": 120,
+    "Location": 600,
+}
+
+
+class EntityCache():
+    """An in-process LRU cache of single rows, keyed by (table, id).
+
+    Entries expire after their table's TTL and the least recently used ones
+    are evicted once the cache holds more than `max_entries` rows or roughly
+    `max_bytes` of data. Writes call invalidate() so readers never see a row
+    older than the last write made through this process.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=16 * 1024 * 1024, ttls=None, default_ttl=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.default_ttl = default_ttl
+
+        # (table, id) -> (value, expires_at, size)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Bumped on every invalidation of a table. A reader that started
+        # before a write must not store what it read after that write.
+        self._generations = {}
+        self._lock = threading.Lock()
+
+        # When set, a function returning a table's TableVersion counter. The
+        # pre-fork server sets it, since each worker process has its own
+        # cache and writes made by other workers never invalidate it.
+        self.version_source = None
+        # table -> the version_source() counter last seen
+        self._versions = {}
+
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def generation(self, table):
+        """Returns the table's invalidation counter, to pass back to set()"""
+        with self._lock:
+            return self._generations.get(table, 0)
+
+    def sync(self, table):
+        """Drops the table's rows if it has been written to, by any
+        process, since the last sync. Does nothing without a version_source.
+        """
+        if self.version_source is None:
+            return
+
+        version = self.version_source(table)
+        with self._lock:
+            known = self._versions.get(table)
+            self._versions[table] = version
+
+        if known is not None and known != version:
+            self.invalidate(table)
+
+    def get(self, table, id):
+        """Returns the cached row, or None on a miss"""
+        key = (table, id)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            value, expires_at, size = entry
+            if expires_at < time.monotonic():
+                self._remove(key, size)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, table, id, value, generation):
+        """Stores a row unless the table was written to since `generation`"""
+        key = (table, id)
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        expires_at = time.monotonic() + self.ttls.get(table, self.default_ttl)
+
+        with self._lock:
+            if self._generations.get(table, 0) != generation:
+                return
+
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest_key, (_, _, oldest_size) = next(iter(self._entries.items()))
+                self._remove(oldest_key, oldest_size)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, table, id=None):
+        """Drops one cached row, or every row of the table when id is None"""
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            self._stats["invalidations"] += 1
+
+            if id is not None:
+                entry = self._entries.get((table, id))
+                if entry is not None:
+                    self._remove((table, id), entry[2])
+                return
+
+            for key in [key for key in self._entries if key[0] == table]:
+                self._remove(key, self._entries[key][2])
+
+    def clear(self):
+        """Empties the cache, e.g. after pointing the pool at another file"""
+        with self._lock:
+            for table in {key[0] for key in self._entries}:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Returns a snapshot of the hit/miss/eviction counters"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["entries"] = len(self._entries)
+            snapshot["bytes"] = self._bytes
+        return snapshot
+
+    def _remove(self, key, size):
+        del self._entries[key]
+        self._bytes -= size
+
+
+def _estimate_size(value):
+    """A cheap, shallow estimate of how much memory a cached row holds"""
+    if not isinstance(value, dict):
+        return sys.getsizeof(value)
+
+    return sys.getsizeof(value) + sum(
+        sys.getsizeof(key) + sys.getsizeof(item) for key, item in value.items()
+    )
+
+
+# The cache shared by every views module
+entity_cache = EntityCache()
+
+
+def cache_metrics():
+    """Samples of the entity cache's counters, for metrics.add_collector()"""
+    stats = entity_cache.stats()
+    return [
+        ("kennel_entity_cache_lookups_total", "counter", "Entity cache lookups by result", [
+            ({"result": "hit"}, stats["hits"]),
+            ({"result": "miss"}, stats["misses"]),
+        ]),
+        ("kennel_entity_cache_evictions_total", "counter", "Rows evicted to stay under the size caps", [({}, stats["evictions"])]),
+        ("kennel_entity_cache_entries", "gauge", "Rows currently cached", [({}, stats["entries"])]),
+        ("kennel_entity_cache_bytes", "gauge", "Approximate size of the cached rows", [({}, stats["bytes"])]),
+    ]
+
+
+def cached_entity(table):
+    """Decorates a get_single_* view so repeat lookups skip SQLite
+
+    Args:
+        table (string): the table the view reads, used to invalidate it
+
+    Callers get their own copy of the row, so changing the returned
+    dictionary never changes what is cached.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(id):
+            try:
+                id = int(id)
+            except (TypeError, ValueError):
+                return function(id)
+
+            entity_cache.sync(table)
+            row = entity_cache.get(table, id)
+            if row is not None:
+                return dict(row)
+
+            generation = entity_cache.generation(table)
+            row = function(id)
+            if row is None:
+                return None
+
+            entity_cache.set(table, id, dict(row), generation)
+            return row
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,39 @@
+import sqlite3
+from metrics import timed
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """A cursor that counts and times each statement against the current
+    request (see metrics.py).
+
+    Only the execute call is timed. SQLite hands rows back lazily, so the
+    time spent stepping through a big result set while it is iterated or
+    streamed shows up in the request's latency, not its SQL time.
+    """
+
+    def execute(self, sql, parameters=()):
+        return timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return timed(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return timed(super().executescript, sql_script)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """A connection whose cursors, including the ones `conn.execute()` makes
+    behind the scenes, are InstrumentedCursors
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
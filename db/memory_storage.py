@@ -0,0 +1,456 @@
+import json
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from .storage import TABLE_COLUMNS, Storage, uses_keyset
+
+# The columns each table gets a secondary index on: {value: set of ids}.
+# They answer the by-location, by-status, by-customer and by-email lookups
+# and narrow filtered pages down before any row is looked at.
+INDEXED_COLUMNS = {
+    "Animal": ("location_id", "status", "customer_id"),
+    "Customer": ("email",),
+    "Employee": ("location_id",),
+    "Location": (),
+}
+
+
+class _Table():
+    """One table's rows, kept as tuples in TABLE_COLUMNS order"""
+
+    __slots__ = (
+        "name",
+        "columns",
+        "positions",
+        "rows",
+        "ids",
+        "indexes",
+        "next_id",
+        "version",
+        "modified_at",
+        "dirty",
+        "deleted",
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self.columns = TABLE_COLUMNS[name]
+        self.positions = {column: position for position, column in enumerate(self.columns)}
+        # id -> row tuple
+        self.rows = {}
+        # Every id, sorted, to seek keyset pages with bisect
+        self.ids = []
+        # column -> value -> set of ids
+        self.indexes = {column: {} for column in INDEXED_COLUMNS[name]}
+        self.next_id = 1
+        self.version = 0
+        self.modified_at = 0
+        # Ids written or deleted since the last snapshot
+        self.dirty = set()
+        self.deleted = set()
+
+    def add(self, row):
+        id = row[0]
+        self.rows[id] = row
+        if not self.ids or id > self.ids[-1]:
+            self.ids.append(id)
+        else:
+            self.ids.insert(bisect_left(self.ids, id), id)
+        for column, index in self.indexes.items():
+            index.setdefault(row[self.positions[column]], set()).add(id)
+        self.next_id = max(self.next_id, id + 1)
+
+    def remove(self, id):
+        row = self.rows.pop(id)
+        del self.ids[bisect_left(self.ids, id)]
+        for column, index in self.indexes.items():
+            value = row[self.positions[column]]
+            ids = index[value]
+            ids.discard(id)
+            if not ids:
+                del index[value]
+        return row
+
+    def replace(self, id, row):
+        old = self.rows[id]
+        self.rows[id] = row
+        for column, index in self.indexes.items():
+            position = self.positions[column]
+            if old[position] != row[position]:
+                ids = index[old[position]]
+                ids.discard(id)
+                if not ids:
+                    del index[old[position]]
+                index.setdefault(row[position], set()).add(id)
+
+    def touch(self, ids=(), deleted=()):
+        self.dirty.update(ids)
+        self.dirty.difference_update(deleted)
+        self.deleted.update(deleted)
+        self.version += 1
+        self.modified_at = int(time.time())
+
+    def pick(self, row, columns):
+        return {column: row[self.positions[column]] for column in columns}
+
+
+class MemoryStorage(Storage):
+    """Keeps every row in dictionaries, with secondary indexes
+
+    Reads never leave Python, which suits benchmark runs and read-mostly
+    edge nodes. The rows are loaded from a SQLite file with
+    load_snapshot() and written back with save_snapshot(), which only
+    writes the rows that changed since the last load or save.
+
+    One lock guards everything, so a write is seen whole or not at all.
+    Only one process can use an instance: forked workers would each get
+    their own copy and drift apart.
+    """
+
+    def __init__(self):
+        self._tables = {name: _Table(name) for name in TABLE_COLUMNS}
+        self._lock = threading.Lock()
+        # The file the rows were loaded from
+        self.path = None
+
+    def get(self, table, id, columns):
+        data = self._tables[table]
+        with self._lock:
+            row = data.rows.get(id)
+            return data.pick(row, columns) if row is not None else None
+
+    def get_many(self, table, ids, columns):
+        data = self._tables[table]
+        with self._lock:
+            return {
+                id: data.pick(data.rows[id], columns) for id in ids if id in data.rows
+            }
+
+    def find(self, table, column, value, columns):
+        data = self._tables[table]
+        with self._lock:
+            if column in data.indexes:
+                ids = sorted(data.indexes[column].get(value, ()))
+            else:
+                position = data.positions[column]
+                ids = [id for id in data.ids if data.rows[id][position] == value]
+            return [data.pick(data.rows[id], columns) for id in ids]
+
+    def scan(self, table, columns, joins=()):
+        data = self._tables[table]
+        pick = [data.positions[column] for column in columns]
+
+        with self._lock:
+            rows = [data.rows[id] for id in data.ids]
+            related = [
+                (
+                    data.positions[foreign_key],
+                    self._tables[name].rows,
+                    [self._tables[name].positions[column] for column in related_columns],
+                )
+                for (foreign_key, name, related_columns) in joins
+            ]
+
+            # Build the tuples under the lock, so a row and the rows it
+            # joins to are read at the same moment
+            joined = []
+            for row in rows:
+                values = [row[position] for position in pick]
+                for (foreign_key, related_rows, related_pick) in related:
+                    related_row = related_rows.get(row[foreign_key])
+                    if related_row is None:
+                        break
+                    values += [related_row[position] for position in related_pick]
+                else:
+                    joined.append(tuple(values))
+
+        # A generator, like the SQLite engine's, so callers can close() it
+        yield from joined
+
+    def page(self, table, columns, limit, after_id=0, filters=(), order=(), offset=0):
+        data = self._tables[table]
+        matches = _compile_filters(data, filters)
+
+        with self._lock:
+            candidates = self._candidates(data, filters)
+
+            if uses_keyset(order):
+                descending = bool(order) and order[0][1]
+                if candidates is None:
+                    candidates = data.ids
+                # Walk positions rather than slicing, so a page never copies
+                # the whole id list
+                if descending:
+                    end = bisect_left(candidates, after_id) if after_id else len(candidates)
+                    positions = range(end - 1, -1, -1)
+                else:
+                    positions = range(bisect_right(candidates, after_id), len(candidates))
+
+                page = []
+                for position in positions:
+                    row = data.rows[candidates[position]]
+                    if matches(row):
+                        page.append(row)
+                        if len(page) == limit:
+                            break
+            else:
+                if candidates is None:
+                    candidates = data.ids
+                rows = [data.rows[id] for id in candidates]
+                rows = [row for row in rows if matches(row)]
+                _sort(data, rows, order)
+                page = rows[offset:offset + limit]
+
+            return [data.pick(row, columns) for row in page]
+
+    def insert(self, table, values):
+        data = self._tables[table]
+        with self._lock:
+            id = data.next_id
+            data.add(_row(data, id, values))
+            data.touch((id,))
+        return id
+
+    def insert_many(self, table, columns, rows):
+        data = self._tables[table]
+        with self._lock:
+            ids = []
+            for values in rows:
+                id = data.next_id
+                data.add(_row(data, id, dict(zip(columns, values))))
+                ids.append(id)
+            data.touch(ids)
+        return ids
+
+    def update(self, table, id, values):
+        data = self._tables[table]
+        with self._lock:
+            row = data.rows.get(id)
+            if row is None:
+                return False
+            data.replace(id, _row(data, id, {**data.pick(row, data.columns), **values}))
+            data.touch((id,))
+        return True
+
+    def update_many(self, table, rows):
+        data = self._tables[table]
+        with self._lock:
+            missing = [id for (id, values) in rows if id not in data.rows]
+            if missing:
+                return missing
+
+            for (id, values) in rows:
+                old = data.pick(data.rows[id], data.columns)
+                data.replace(id, _row(data, id, {**old, **values}))
+            data.touch([id for (id, values) in rows])
+        return []
+
+    def delete(self, table, id):
+        data = self._tables[table]
+        with self._lock:
+            if id not in data.rows:
+                return False
+            data.remove(id)
+            data.touch(deleted=(id,))
+        return True
+
+    def delete_many(self, table, ids):
+        data = self._tables[table]
+        with self._lock:
+            missing = [id for id in ids if id not in data.rows]
+            if missing:
+                return missing
+
+            for id in set(ids):
+                data.remove(id)
+            data.touch(deleted=ids)
+        return []
+
+    def table_versions(self, tables):
+        with self._lock:
+            return {
+                table: (self._tables[table].version, self._tables[table].modified_at)
+                for table in tables
+            }
+
+    def load_snapshot(self, path):
+        """Replaces every row with the ones in a SQLite file
+
+        The AUTOINCREMENT counters and TableVersion versions come along too,
+        so new ids carry on where the file left off and ETags handed out
+        before stay meaningful.
+
+        Args:
+            path (string): a kennel database, with its migrations run
+        """
+        tables = {name: _Table(name) for name in TABLE_COLUMNS}
+
+        conn = sqlite3.connect(path)
+        try:
+            for name, data in tables.items():
+                for row in conn.execute(f"SELECT {', '.join(data.columns)} FROM {name} ORDER BY id"):
+                    data.add(row)
+
+            for name, seq in conn.execute("SELECT name, seq FROM sqlite_sequence"):
+                if name in tables:
+                    tables[name].next_id = max(tables[name].next_id, seq + 1)
+
+            for name, version, modified_at in conn.execute(
+                "SELECT name, version, modified_at FROM TableVersion"
+            ):
+                if name in tables:
+                    tables[name].version = version
+                    tables[name].modified_at = modified_at
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._tables = tables
+            self.path = path
+
+    def save_snapshot(self, path=None):
+        """Writes the rows back to a SQLite file in one transaction
+
+        Saved to the file they were loaded from, only the rows written or
+        deleted since the last load or save are touched. Any other file
+        gets every row, and loses the rows that aren't here.
+
+        The file's own triggers run for each row written, so its search
+        index, summaries and change log stay in step.
+
+        Args:
+            path (string): the file to write, the loaded one by default
+
+        Returns:
+            number: how many rows were written or deleted
+        """
+        path = path or self.path
+        incremental = path == self.path
+
+        with self._lock:
+            changes = []
+            for data in self._tables.values():
+                if incremental:
+                    ids = data.dirty
+                    deleted = data.deleted
+                else:
+                    ids = data.ids
+                    deleted = None
+                changes.append(
+                    (data, [data.rows[id] for id in ids if id in data.rows], list(deleted or ()), data.next_id)
+                )
+                if incremental:
+                    data.dirty = set()
+                    data.deleted = set()
+
+        try:
+            return _write_snapshot(path, changes, incremental)
+        except BaseException:
+            if incremental:
+                # Try these rows again next time
+                with self._lock:
+                    for (data, rows, deleted, next_id) in changes:
+                        data.dirty.update(row[0] for row in rows)
+                        data.deleted.update(deleted)
+            raise
+
+    def _candidates(self, data, filters):
+        """The sorted ids an indexed eq or in filter narrows a page down to,
+        or None when no filter is on an indexed column
+        """
+        best = None
+        for (field, operator, value) in filters:
+            index = data.indexes.get(field)
+            if index is None or operator not in ("eq", "in"):
+                continue
+            if operator == "eq":
+                ids = index.get(value, set())
+            else:
+                ids = set().union(*(index.get(item, ()) for item in value))
+            if best is None or len(ids) < len(best):
+                best = ids
+        return sorted(best) if best is not None else None
+
+
+def _row(data, id, values):
+    return (id,) + tuple(values.get(column) for column in data.columns[1:])
+
+
+def _compile_filters(data, filters):
+    """Turns (field, operator, value) filters into one row predicate, with
+    SQL's rules: a NULL column matches no comparison
+    """
+    tests = []
+    for (field, operator, value) in filters:
+        position = data.positions[field]
+        if operator == "eq":
+            tests.append(lambda row, position=position, value=value: row[position] == value)
+        elif operator == "in":
+            values = frozenset(value)
+            tests.append(lambda row, position=position, values=values: row[position] in values)
+        elif operator == "lt":
+            tests.append(
+                lambda row, position=position, value=value: row[position] is not None and row[position] < value
+            )
+        elif operator == "gt":
+            tests.append(
+                lambda row, position=position, value=value: row[position] is not None and row[position] > value
+            )
+
+    return lambda row: all(test(row) for test in tests)
+
+
+def _sort(data, rows, order):
+    """Sorts rows in place like ORDER BY, NULLs first, ties broken by id"""
+    if not any(field == "id" for (field, descending) in order):
+        order = order + (("id", bool(order) and order[-1][1]),)
+
+    # Python's sort is stable, so sorting by each key from the last to the
+    # first leaves the rows ordered by all of them
+    for (field, descending) in reversed(order):
+        position = data.positions[field]
+        rows.sort(
+            key=lambda row: (row[position] is not None, row[position]),
+            reverse=descending,
+        )
+
+
+def _write_snapshot(path, changes, incremental):
+    conn = sqlite3.connect(path, timeout=30)
+    written = 0
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for (data, rows, deleted, next_id) in changes:
+                columns = data.columns
+                if not incremental:
+                    # Every row is written below, so only the file's extra
+                    # rows need deleting
+                    conn.execute(
+                        f"DELETE FROM {data.name} WHERE id NOT IN (SELECT value FROM json_each(?))",
+                        (json.dumps([row[0] for row in rows]),),
+                    )
+
+                conn.executemany(f"DELETE FROM {data.name} WHERE id = ?", [(id,) for id in deleted])
+                conn.executemany(
+                    f"""
+                INSERT INTO {data.name} ({", ".join(columns)})
+                VALUES ({", ".join("?" * len(columns))})
+                ON CONFLICT (id) DO UPDATE SET
+                    {", ".join(f"{column} = excluded.{column}" for column in columns[1:])}
+                """,
+                    rows,
+                )
+                written += len(deleted) + len(rows)
+
+                # Keep the file's AUTOINCREMENT counter past ids handed out
+                # here, even ones whose rows were deleted again
+                conn.execute(
+                    "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?",
+                    (next_id - 1, data.name),
+                )
+    finally:
+        conn.close()
+
+    return written
@@ -0,0 +1,303 @@
+from .connection_pool import get_connection
+
+# The tables the API serves
+TABLES = ("Animal", "Customer", "Employee", "Location")
+
+
+def _version_triggers(table):
+    """SQL for triggers that bump the table's TableVersion row on any write"""
+    return "".join(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table.lower()}_version_after_{event.lower()}
+        AFTER {event} ON {table}
+        BEGIN
+            UPDATE TableVersion
+            SET version = version + 1,
+                modified_at = CAST(strftime('%s', 'now') AS INTEGER)
+            WHERE name = '{table}';
+        END;
+        """
+        for event in ("INSERT", "UPDATE", "DELETE")
+    )
+
+
+def _search_index(table, index, columns):
+    """SQL for an FTS5 index over some of a table's text columns, the
+    triggers that keep it in sync and the statement that fills it
+
+    The index is an external content table: it stores only the search
+    terms and reads the column values back out of `table` by rowid.
+    """
+    column_list = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    prefix = table.lower()
+
+    return f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+            {column_list},
+            content = '{table}',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS {prefix}_search_after_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO {index} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {prefix}_search_after_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO {index} ({index}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {prefix}_search_after_update
+        AFTER UPDATE OF {column_list} ON {table}
+        BEGIN
+            INSERT INTO {index} ({index}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {index} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END;
+
+        INSERT INTO {index} ({index}) VALUES ('rebuild');
+        """
+
+
+def _summary_triggers(table, summary, keys):
+    """SQL for triggers that keep `summary`'s row count per `keys` in step
+    with `table`, one row at a time, so reading the counts never has to
+    scan `table`
+
+    Rows whose keys are NULL aren't counted, and a count that drops to
+    zero is deleted rather than kept around.
+    """
+    key_list = ", ".join(keys)
+    prefix = f"{summary.lower()}_after"
+
+    def add(row):
+        return f"""
+            INSERT INTO {summary} ({key_list}, count)
+            SELECT {", ".join(f"{row}.{key}" for key in keys)}, 1
+            WHERE {" AND ".join(f"{row}.{key} IS NOT NULL" for key in keys)}
+            ON CONFLICT ({key_list}) DO UPDATE SET count = count + 1;
+        """
+
+    def remove(row):
+        match = " AND ".join(f"{key} = {row}.{key}" for key in keys)
+        return f"""
+            UPDATE {summary} SET count = count - 1 WHERE {match};
+            DELETE FROM {summary} WHERE {match} AND count <= 0;
+        """
+
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS {prefix}_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            {add("new")}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {prefix}_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            {remove("old")}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {prefix}_update
+        AFTER UPDATE OF {key_list} ON {table}
+        BEGIN
+            {remove("old")}
+            {add("new")}
+        END;
+        """
+
+
+def _change_triggers(table, columns):
+    """SQL for triggers that append a row to ChangeLog for every insert,
+    update and delete on `table`, with a JSON copy of `columns`
+
+    The copy is the row as it is after the write, or as it was before a
+    delete. Updates that leave every copied column as it was are skipped.
+    """
+
+    def row_json(row):
+        return "json_object(" + ", ".join(f"'{column}', {row}.{column}" for column in columns) + ")"
+
+    def log(action, row):
+        return f"""
+            INSERT INTO ChangeLog (entity, entity_id, action, data)
+            VALUES ('{table}', {row}.id, '{action}', {row_json(row)});
+        """
+
+    prefix = f"{table.lower()}_changelog_after"
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS {prefix}_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            {log("create", "new")}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {prefix}_update
+        AFTER UPDATE ON {table}
+        WHEN {row_json("old")} IS NOT {row_json("new")}
+        BEGIN
+            {log("update", "new")}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS {prefix}_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            {log("delete", "old")}
+        END;
+        """
+
+
+# Every schema change the server knows how to apply, oldest first. Each entry
+# is (version, description, sql). The database remembers the last version it
+# got in `PRAGMA user_version`, so each migration runs exactly once per file.
+# Never edit a migration that has shipped; add a new one instead.
+MIGRATIONS = [
+    (
+        1,
+        "Index the columns the by-location, by-status and by-email lookups filter on",
+        """
+        CREATE INDEX IF NOT EXISTS idx_animal_location_id ON Animal (location_id);
+        CREATE INDEX IF NOT EXISTS idx_animal_customer_id ON Animal (customer_id);
+        CREATE INDEX IF NOT EXISTS idx_animal_status ON Animal (status);
+        CREATE INDEX IF NOT EXISTS idx_employee_location_id ON Employee (location_id);
+        CREATE INDEX IF NOT EXISTS idx_customer_email ON Customer (email);
+        """,
+    ),
+    (
+        2,
+        "Count writes to each table, for ETags and cache invalidation",
+        """
+        CREATE TABLE IF NOT EXISTS TableVersion (
+            `name` TEXT NOT NULL PRIMARY KEY,
+            `version` INTEGER NOT NULL DEFAULT 0,
+            `modified_at` INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        );
+        """
+        + "".join(
+            f"INSERT OR IGNORE INTO TableVersion (name) VALUES ('{table}');" for table in TABLES
+        )
+        + "".join(_version_triggers(table) for table in TABLES),
+    ),
+    (
+        3,
+        "Full-text search over animals, customers and employees",
+        _search_index("Animal", "AnimalSearch", ("name", "breed"))
+        + _search_index("Customer", "CustomerSearch", ("name", "address", "email"))
+        + _search_index("Employee", "EmployeeSearch", ("name", "address")),
+    ),
+    (
+        4,
+        "Summary counts for the /stats endpoints, kept up to date by triggers",
+        """
+        CREATE TABLE IF NOT EXISTS AnimalCountByLocationStatus (
+            `location_id` INTEGER NOT NULL,
+            `status` TEXT NOT NULL,
+            `count` INTEGER NOT NULL,
+            PRIMARY KEY (location_id, status)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS AnimalCountByCustomer (
+            `customer_id` INTEGER NOT NULL PRIMARY KEY,
+            `count` INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_animal_count_by_customer_count
+            ON AnimalCountByCustomer (count DESC, customer_id);
+
+        CREATE TABLE IF NOT EXISTS EmployeeCountByLocation (
+            `location_id` INTEGER NOT NULL PRIMARY KEY,
+            `count` INTEGER NOT NULL
+        );
+
+        INSERT OR REPLACE INTO AnimalCountByLocationStatus (location_id, status, count)
+        SELECT location_id, status, COUNT(*) FROM Animal
+        WHERE location_id IS NOT NULL AND status IS NOT NULL
+        GROUP BY location_id, status;
+
+        INSERT OR REPLACE INTO AnimalCountByCustomer (customer_id, count)
+        SELECT customer_id, COUNT(*) FROM Animal
+        WHERE customer_id IS NOT NULL
+        GROUP BY customer_id;
+
+        INSERT OR REPLACE INTO EmployeeCountByLocation (location_id, count)
+        SELECT location_id, COUNT(*) FROM Employee
+        WHERE location_id IS NOT NULL
+        GROUP BY location_id;
+        """
+        + _summary_triggers(
+            "Animal",
+            "AnimalCountByLocationStatus",
+            ("location_id", "status"),
+        )
+        + _summary_triggers("Animal", "AnimalCountByCustomer", ("customer_id",))
+        + _summary_triggers("Employee", "EmployeeCountByLocation", ("location_id",)),
+    ),
+    (
+        5,
+        "Log every write, numbered in order, for the /events change feed",
+        """
+        CREATE TABLE IF NOT EXISTS ChangeLog (
+            `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            `entity` TEXT NOT NULL,
+            `entity_id` INTEGER NOT NULL,
+            `action` TEXT NOT NULL,
+            `data` TEXT NOT NULL,
+            `changed_at` INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        );
+
+        -- Keep the last 10000 changes. AUTOINCREMENT makes sure the ids of
+        -- deleted rows are never handed out again, so they only go up.
+        CREATE TRIGGER IF NOT EXISTS changelog_after_insert_trim
+        AFTER INSERT ON ChangeLog
+        BEGIN
+            DELETE FROM ChangeLog WHERE id <= new.id - 10000;
+        END;
+        """
+        # Customer passwords stay out of the log
+        + _change_triggers("Animal", ("id", "name", "status", "breed", "customer_id", "location_id"))
+        + _change_triggers("Customer", ("id", "name", "address", "email"))
+        + _change_triggers("Employee", ("id", "name", "address", "location_id"))
+        + _change_triggers("Location", ("id", "name", "address")),
+    ),
+]
+
+
+def schema_version(conn):
+    """Returns the last migration version applied to the database"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations():
+    """Brings the database up to date. Called once when the server starts.
+
+    Also switches the file to WAL journaling, which lets readers keep reading
+    while a writer commits. Unlike the pool's other pragmas, journal_mode is
+    stored in the database file, so it only needs setting once.
+
+    Returns:
+        list: the versions that were applied by this call
+    """
+    applied = []
+
+    with get_connection() as conn:
+        conn.execute("PRAGMA journal_mode = WAL")
+
+        current = schema_version(conn)
+        for version, description, sql in MIGRATIONS:
+            if version <= current:
+                continue
+
+            # executescript() commits anything pending and runs in autocommit
+            # mode, so wrap the migration and its version bump in one explicit
+            # transaction to make each step all-or-nothing.
+            conn.executescript(
+                f"BEGIN;\n{sql}\nPRAGMA user_version = {version};\nCOMMIT;"
+            )
+            applied.append(version)
+
+    return applied
@@ -0,0 +1,145 @@
+import sqlite3
+import threading
+import time
+from .connection_pool import get_connection
+
+# Every statement the server runs more than once, by name. The SQL text
+# for a name never changes, so each pooled connection's statement cache
+# (see ConnectionPool's cached_statements) prepares it once and reuses it.
+QUERIES = {}
+
+_stats = {}
+_lock = threading.Lock()
+
+
+class QueryError(Exception):
+    """Raised by validate_queries() when statements don't compile against
+    the database's schema
+
+    Attributes:
+        failures (dict): {name: the SQLite error message}
+    """
+
+    def __init__(self, failures):
+        super().__init__(
+            "Queries that don't match the schema: "
+            + "; ".join(f"{name}: {message}" for name, message in failures.items())
+        )
+        self.failures = failures
+
+
+def register_query(name, sql):
+    """Adds a statement to the catalog
+
+    Registering the same SQL under a name again does nothing, so modules can
+    register their statements when they're imported or the first time
+    they're needed.
+
+    Args:
+        name (string): a dotted name for metrics and logs, e.g. "Animal.get"
+        sql (string): the statement, with ? placeholders
+
+    Returns:
+        string: the name, to pass to execute()
+    """
+    with _lock:
+        existing = QUERIES.get(name)
+        if existing is not None and existing != sql:
+            raise ValueError(f"Query {name!r} is already registered with different SQL")
+        QUERIES[name] = sql
+    return name
+
+
+def execute(db_cursor, name, params=(), sql=None):
+    """Runs a catalog statement on a cursor, counting and timing it by name
+
+    Args:
+        db_cursor: the cursor to run it on
+        name (string): a name given to register_query()
+        params: the values for the statement's placeholders
+        sql (string): for statements built per request, like filtered
+            pages, the SQL to run instead. It is counted under `name`
+            without being added to the catalog.
+
+    Returns:
+        the cursor, ready to fetch from
+    """
+    started = time.perf_counter()
+    try:
+        return db_cursor.execute(sql or QUERIES[name], params)
+    finally:
+        _record(name, time.perf_counter() - started)
+
+
+def executemany(db_cursor, name, seq_of_params):
+    """Like execute(), with executemany() for a batch of parameter tuples"""
+    started = time.perf_counter()
+    try:
+        return db_cursor.executemany(QUERIES[name], seq_of_params)
+    finally:
+        _record(name, time.perf_counter() - started)
+
+
+def _record(name, seconds):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+
+def validate_queries():
+    """Compiles every catalog statement against the database's schema
+
+    EXPLAIN prepares a statement without running it, so a statement naming
+    a table or column that doesn't exist fails here, when the server
+    starts, instead of on the first request that needs it.
+
+    Raises:
+        QueryError: naming each statement that failed
+    """
+    failures = {}
+    with get_connection() as conn:
+        for name, sql in sorted(QUERIES.items()):
+            try:
+                # NULL for every placeholder, since nothing is actually run
+                conn.execute("EXPLAIN " + sql, (None,) * sql.count("?")).fetchall()
+            except sqlite3.Error as ex:
+                failures[name] = str(ex)
+
+    if failures:
+        raise QueryError(failures)
+
+
+def query_stats():
+    """Returns {name: (executions, total seconds, slowest seconds)}"""
+    with _lock:
+        return {name: tuple(stats) for name, stats in _stats.items()}
+
+
+def query_metrics():
+    """Samples of the catalog and per-statement timings, for metrics.add_collector()"""
+    stats = query_stats()
+    return [
+        ("kennel_query_catalog_statements", "gauge", "Statements in the query catalog", [({}, len(QUERIES))]),
+        (
+            "kennel_query_executions_total",
+            "counter",
+            "Executions of each catalog statement",
+            [({"query": name}, count) for name, (count, total, slowest) in sorted(stats.items())],
+        ),
+        (
+            "kennel_query_seconds_total",
+            "counter",
+            "Seconds spent executing each catalog statement",
+            [({"query": name}, total) for name, (count, total, slowest) in sorted(stats.items())],
+        ),
+        (
+            "kennel_query_max_seconds",
+            "gauge",
+            "Slowest execution of each catalog statement",
+            [({"query": name}, slowest) for name, (count, total, slowest) in sorted(stats.items())],
+        ),
+    ]
@@ -0,0 +1,368 @@
+import json
+import sqlite3
+from functools import lru_cache
+from .connection_pool import get_connection
+from .queries import execute, executemany, register_query
+from .storage import TABLE_COLUMNS, Storage, uses_keyset
+from .table_versions import get_table_versions
+
+# The SQL for each filter operator, see views/filters.py
+FILTER_SQL = {
+    "eq": "{column} = ?",
+    # One JSON array parameter, however many values there are, so a list of
+    # any length compiles to the same statement
+    "in": "{column} IN (SELECT value FROM json_each(?))",
+    "lt": "{column} < ?",
+    "gt": "{column} > ?",
+}
+
+
+class SqliteStorage(Storage):
+    """Storage in the SQLite file the connection pool is configured with
+
+    Every call checks a connection out of the shared pool (see
+    connection_pool.py), so calls nested inside one another on a thread
+    share a connection and its transaction. The statements come from the
+    query catalog (see queries.py), which _register_statements() fills in
+    for every table.
+    """
+
+    supports_sql = True
+
+    def get(self, table, id, columns):
+        with get_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            db_cursor = conn.cursor()
+
+            # Use a ? parameter to inject a variable's value
+            # into the SQL statement.
+            execute(db_cursor, f"{table}.get", (id,))
+
+            data = db_cursor.fetchone()
+            return _pick(table, data, columns) if data is not None else None
+
+    def get_many(self, table, ids, columns):
+        if not ids:
+            return {}
+
+        with get_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            db_cursor = conn.cursor()
+
+            # All of the ids go in as one JSON array, so any number of them
+            # runs the same statement
+            execute(db_cursor, f"{table}.get_many", (json.dumps(ids),))
+
+            return {row["id"]: _pick(table, row, columns) for row in db_cursor}
+
+    def find(self, table, column, value, columns):
+        with get_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            db_cursor = conn.cursor()
+
+            execute(db_cursor, f"{table}.find.{column}", (value,))
+
+            return [_pick(table, row, columns) for row in db_cursor.fetchall()]
+
+    def scan(self, table, columns, joins=()):
+        with get_connection() as conn:
+            db_cursor = conn.cursor()
+
+            execute(db_cursor, _scan_statement(table, tuple(columns), tuple(joins)))
+
+            # Iterate the cursor itself rather than fetchall() so only one
+            # row is in memory at a time
+            yield from db_cursor
+
+    def page(self, table, columns, limit, after_id=0, filters=(), order=(), offset=0):
+        params = _filter_params(filters)
+
+        if uses_keyset(order):
+            descending = bool(order) and order[0][1]
+            keyset = "<" if descending else ">"
+            if descending and not after_id:
+                # The first page of a descending order starts past any id
+                after_id = 2 ** 63 - 1
+            params.append(after_id)
+        else:
+            keyset = None
+
+        sql = compile_select(table, tuple(columns), _filter_shape(filters), order, keyset)
+
+        params.append(limit)
+        if keyset is None:
+            params.append(offset)
+
+        with get_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            db_cursor = conn.cursor()
+            # There is a statement per filter shape, so they're counted
+            # together rather than each added to the catalog
+            execute(db_cursor, f"{table}.page", params, sql)
+            return [dict(row) for row in db_cursor.fetchall()]
+
+    def insert(self, table, values):
+        with get_connection() as conn:
+            db_cursor = conn.cursor()
+
+            execute(db_cursor, _write_statement("insert", table, tuple(values)), tuple(values.values()))
+
+            # The `lastrowid` property on the cursor will return
+            # the primary key of the last thing that got added to
+            # the database.
+            return db_cursor.lastrowid
+
+    def insert_many(self, table, columns, rows):
+        with get_connection() as conn:
+            # Take the write lock up front so the ids below can't interleave
+            # with another writer's inserts
+            conn.execute("BEGIN IMMEDIATE")
+            db_cursor = conn.cursor()
+
+            executemany(db_cursor, _write_statement("insert", table, tuple(columns)), rows)
+
+            # AUTOINCREMENT hands out consecutive ids while we hold the write
+            # lock, so the batch ends at last_insert_rowid()
+            last_id = db_cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+        first_id = last_id - len(rows) + 1
+        return list(range(first_id, last_id + 1))
+
+    def update(self, table, id, values):
+        with get_connection() as conn:
+            db_cursor = conn.cursor()
+
+            execute(
+                db_cursor,
+                _write_statement("update", table, tuple(values)),
+                tuple(values.values()) + (id,),
+            )
+
+            # Were any rows affected?
+            # Did the client send an `id` that exists?
+            return db_cursor.rowcount > 0
+
+    def update_many(self, table, rows):
+        ids = [id for (id, values) in rows]
+        with get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            db_cursor = conn.cursor()
+
+            missing = _missing_ids(db_cursor, table, ids)
+            if missing:
+                conn.rollback()
+                return missing
+
+            # Rows that set the same columns share a statement
+            batches = {}
+            for (id, values) in rows:
+                batches.setdefault(tuple(values), []).append(tuple(values.values()) + (id,))
+            for columns, params in batches.items():
+                executemany(db_cursor, _write_statement("update", table, columns), params)
+
+        return []
+
+    def delete(self, table, id):
+        with get_connection() as conn:
+            db_cursor = conn.cursor()
+            execute(db_cursor, f"{table}.delete", (id,))
+            return db_cursor.rowcount > 0
+
+    def delete_many(self, table, ids):
+        with get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            db_cursor = conn.cursor()
+
+            missing = _missing_ids(db_cursor, table, ids)
+            if missing:
+                conn.rollback()
+                return missing
+
+            executemany(db_cursor, f"{table}.delete", [(id,) for id in ids])
+
+        return []
+
+    def table_versions(self, tables):
+        return get_table_versions(tables)
+
+
+def _pick(table, row, columns):
+    """The `columns` of a row read with every column of its table"""
+    if len(columns) == len(TABLE_COLUMNS[table]):
+        return dict(row)
+    return {column: row[column] for column in columns}
+
+
+def _missing_ids(db_cursor, table, ids):
+    """Returns the ids that aren't in the table"""
+    execute(db_cursor, f"{table}.existing", (json.dumps(ids),))
+    found = {row[0] for row in db_cursor}
+
+    return [id for id in ids if id not in found]
+
+
+def _register_statements(table):
+    """Adds the statements SqliteStorage runs on a table to the catalog
+
+    Reads always select every column and _pick() narrows them down, so a
+    table has one statement per operation however many column lists the
+    views ask for.
+    """
+    columns = TABLE_COLUMNS[table]
+    selected = ", ".join(columns)
+
+    register_query(f"{table}.get", f"SELECT {selected} FROM {table} WHERE id = ?")
+    register_query(
+        f"{table}.get_many",
+        f"SELECT {selected} FROM {table} WHERE id IN (SELECT value FROM json_each(?))",
+    )
+    register_query(
+        f"{table}.existing",
+        f"SELECT id FROM {table} WHERE id IN (SELECT value FROM json_each(?))",
+    )
+    for column in columns[1:]:
+        register_query(
+            f"{table}.find.{column}",
+            f"SELECT {selected} FROM {table} WHERE {column} = ? ORDER BY id",
+        )
+    register_query(f"{table}.delete", f"DELETE FROM {table} WHERE id = ?")
+
+    # Scans are registered by the views that run them, see register_scan()
+    _write_statement("insert", table, columns[1:])
+    _write_statement("update", table, columns[1:])
+
+
+def register_update(table, columns):
+    """Adds the statement update() runs to set just these columns to the
+    catalog, for views that leave some columns out, like a customer update
+    without a password
+
+    Returns:
+        string: the statement's name in the catalog
+    """
+    return _write_statement("update", table, tuple(columns))
+
+
+def register_scan(table, columns, joins=()):
+    """Adds the statement scan() runs for these arguments to the catalog
+
+    The views call this when they're imported, for each column list and
+    join they scan with, so validate_queries() checks those statements when
+    the server starts rather than the first request finding them broken.
+
+    Args:
+        table (string): the table scanned
+        columns (tuple): its columns to select
+        joins (tuple): (foreign key, related table, related columns) triples
+
+    Returns:
+        string: the statement's name in the catalog
+    """
+    return _scan_statement(table, tuple(columns), tuple(joins))
+
+
+@lru_cache(maxsize=None)
+def _scan_statement(table, columns, joins):
+    """Registers the statement scan() runs for these arguments, and
+    returns its name
+    """
+    selected = [f"t.{column}" for column in columns]
+    joined = []
+    for position, (foreign_key, related, related_columns) in enumerate(joins):
+        alias = f"j{position}"
+        selected += [f"{alias}.{column}" for column in related_columns]
+        joined.append(f"JOIN {related} {alias} ON {alias}.id = t.{foreign_key}")
+
+    # e.g. "Employee.scan+Location", with the columns added if they
+    # aren't all of the table's
+    name = f"{table}.scan" + "".join(f"+{related}" for (_, related, _) in joins)
+    if columns != TABLE_COLUMNS[table]:
+        name += "(" + ", ".join(columns) + ")"
+
+    return register_query(
+        name,
+        " ".join([f"SELECT {', '.join(selected)} FROM {table} t"] + joined + ["ORDER BY t.id"]),
+    )
+
+
+@lru_cache(maxsize=None)
+def _write_statement(operation, table, columns):
+    """Registers the "insert" or "update" statement for writing these
+    columns, and returns its name. Writes of every column are named
+    "Animal.insert" and so on, and any others get their columns added.
+    """
+    name = f"{table}.{operation}"
+    if columns != TABLE_COLUMNS[table][1:]:
+        name += "(" + ", ".join(columns) + ")"
+
+    if operation == "insert":
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    else:
+        sql = f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?"
+
+    return register_query(name, sql)
+
+
+def _filter_shape(filters):
+    """The part of the filters that decides the SQL, without their values"""
+    return tuple((field, operator) for (field, operator, value) in filters)
+
+
+def _filter_params(filters):
+    """The parameters for compile_select()'s placeholders, in order"""
+    return [
+        json.dumps(value) if operator == "in" else value
+        for (field, operator, value) in filters
+    ]
+
+
+@lru_cache(maxsize=256)
+def compile_select(table, columns, shape, order, keyset):
+    """Builds the SQL for one shape of filtered, sorted page
+
+    Only the shape goes into the statement, never the values, so every
+    request with the same filters compiles (and is prepared by SQLite)
+    once and reuses the statement after that.
+
+    Args:
+        table (string): the table to read
+        columns (tuple): the columns to select
+        shape (tuple): (field, operator) pairs from _filter_shape()
+        order (tuple): (field, descending) pairs. The id is added as the
+            last sort key, so rows that tie still come back in one order.
+        keyset (string): ">" or "<" to seek past an id, or None to page
+            with OFFSET
+
+    Returns:
+        string: SQL taking the _filter_params(), then the after id when
+        there is a keyset, then the limit and the offset when there isn't
+    """
+    conditions = [FILTER_SQL[operator].format(column=field) for (field, operator) in shape]
+    if keyset is not None:
+        conditions.append(f"id {keyset} ?")
+
+    if not any(field == "id" for (field, descending) in order):
+        order = order + (("id", bool(order) and order[-1][1]),)
+    order_by = ", ".join(f"{field} DESC" if descending else field for (field, descending) in order)
+
+    return f"""
+        SELECT {", ".join(columns)}
+        FROM {table}
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY {order_by}
+        LIMIT ?{"" if keyset is not None else " OFFSET ?"}
+        """
+
+
+def filter_metrics():
+    """Samples of the compiled statement cache, for metrics.add_collector()"""
+    info = compile_select.cache_info()
+    return [
+        ("kennel_filter_statements", "gauge", "Compiled filter statements cached", [({}, info.currsize)]),
+        ("kennel_filter_compile_hits_total", "counter", "Filter queries that reused a compiled statement", [({}, info.hits)]),
+        ("kennel_filter_compile_misses_total", "counter", "Filter queries that had to compile a statement", [({}, info.misses)]),
+    ]
+
+
+for _table in TABLE_COLUMNS:
+    _register_statements(_table)
@@ -0,0 +1,140 @@
+# The columns of each table the API serves, id first. Engines that don't
+# read the schema out of a database file, like the in-memory one, go by this.
+TABLE_COLUMNS = {
+    "Animal": ("id", "name", "status", "breed", "customer_id", "location_id"),
+    "Customer": ("id", "name", "address", "email", "password"),
+    "Employee": ("id", "name", "address", "location_id"),
+    "Location": ("id", "name", "address"),
+}
+
+
+def uses_keyset(order):
+    """Whether pages in this order are taken with ?after_id= (sorted by id
+    alone) or with ?offset= (sorted by anything else)
+    """
+    return not order or (len(order) == 1 and order[0][0] == "id")
+
+
+class Storage():
+    """The operations the views need from a database
+
+    The views only ever call these, so the engine behind them can be
+    swapped (see engine.configure_storage()). Rows go in and out as
+    dictionaries, except from scan(), which yields tuples so the stream
+    serializers can skip building dictionaries.
+
+    Every method takes table and column names from the views' own
+    constants, never from a client, so engines may put them in SQL.
+    """
+
+    # Whether the data can also be queried with SQL through
+    # get_connection(). Search, the /stats summaries and the /events change
+    # feed are built on SQLite features and need it.
+    supports_sql = False
+
+    def get(self, table, id, columns):
+        """Returns one row as a dictionary of `columns`, or None"""
+        raise NotImplementedError
+
+    def get_many(self, table, ids, columns):
+        """Returns {id: row dictionary} for each of the ids that exists"""
+        raise NotImplementedError
+
+    def find(self, table, column, value, columns):
+        """Returns every row whose `column` equals `value`, in id order"""
+        raise NotImplementedError
+
+    def scan(self, table, columns, joins=()):
+        """Yields every row as a tuple, in id order
+
+        Args:
+            table (string): the table to read
+            columns (tuple): the table's columns to include
+            joins (tuple): (foreign key column, related table, related
+                columns) for each related row to add. The related columns
+                follow the table's in each tuple, and rows without a
+                related row are skipped, like an inner join.
+        """
+        raise NotImplementedError
+
+    def page(self, table, columns, limit, after_id=0, filters=(), order=(), offset=0):
+        """Returns up to `limit` filtered and sorted rows as dictionaries
+
+        Args:
+            table (string): the table to read
+            columns (tuple): the columns to include
+            limit (number): the most rows to return
+            after_id (number): with an order by id alone (or no order), the
+                id to start after. Descending orders start below it, and
+                from the top when it is 0.
+            filters (tuple): (field, operator, value) from parse_filters()
+            order (tuple): (field, descending) pairs. Rows that tie are
+                sorted by id, in the direction of the last pair.
+            offset (number): rows to skip, for any other order
+        """
+        raise NotImplementedError
+
+    def insert(self, table, values):
+        """Adds a row and returns its new id
+
+        Args:
+            values (dict): every column but the id
+        """
+        raise NotImplementedError
+
+    def insert_many(self, table, columns, rows):
+        """Adds rows in one transaction
+
+        Args:
+            columns (tuple): the columns each row holds, without the id
+            rows (list): a tuple of values per row
+
+        Returns:
+            list: the new ids, in the order of the rows
+        """
+        raise NotImplementedError
+
+    def update(self, table, id, values):
+        """Changes the given columns of a row
+
+        Returns:
+            bool: False if there is no row with that id
+        """
+        raise NotImplementedError
+
+    def update_many(self, table, rows):
+        """Changes rows in one transaction, unless any of them is missing
+
+        Args:
+            rows (list): (id, values) pairs, where values is a dictionary of
+                the columns to set, which can differ from row to row
+
+        Returns:
+            list: the ids that don't exist. Nothing was written if any.
+        """
+        raise NotImplementedError
+
+    def delete(self, table, id):
+        """Removes a row
+
+        Returns:
+            bool: False if there was no row with that id
+        """
+        raise NotImplementedError
+
+    def delete_many(self, table, ids):
+        """Removes rows in one transaction, unless any of them is missing
+
+        Returns:
+            list: the ids that don't exist. Nothing was deleted if any.
+        """
+        raise NotImplementedError
+
+    def table_versions(self, tables):
+        """Returns {table: (version, modified_at)} where version goes up on
+        every write to the table, for ETags and cache invalidation
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Releases whatever the engine holds on to"""
@@ -0,0 +1,39 @@
+import json
+import sqlite3
+from .connection_pool import get_connection
+from .queries import execute, register_query
+
+# Every GET that can be validated runs this, so it is one statement however
+# many tables the route reads, with their names as a JSON array
+TABLE_VERSIONS = register_query(
+    "TableVersion.get_many",
+    """
+    SELECT
+        v.name,
+        v.version,
+        v.modified_at
+    FROM TableVersion v
+    WHERE v.name IN (SELECT value FROM json_each(?))
+    """,
+)
+
+
+def get_table_versions(tables):
+    """Returns how many times each table has been written to, and when
+
+    The counters live in the TableVersion table and are bumped by triggers
+    (see migration 2), so they see writes from every process and connection.
+
+    Args:
+        tables (tuple): table names, e.g. ("Animal", "Location")
+
+    Returns:
+        dict: {table: (version, modified_at unix timestamp)}
+    """
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        db_cursor = conn.cursor()
+
+        execute(db_cursor, TABLE_VERSIONS, (json.dumps(tables),))
+
+        return {row["name"]: (row["version"], row["modified_at"]) for row in db_cursor}
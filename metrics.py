@@ -0,0 +1,422 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (in seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Requests slower than this many seconds are written to the slow request
+# log. None turns the log off.
+slow_request_threshold = None
+
+slow_log = logging.getLogger("kennel.slow_requests")
+
+_local = threading.local()
+_lock = threading.Lock()
+
+# route -> {"count", "sum", "buckets", "sql_statements", "sql_seconds", "rows", "bytes"}
+_routes = {}
+# (route, status) -> count
+_statuses = {}
+# Functions that add their own samples to /_metrics, see add_collector()
+_collectors = []
+# Collected metrics combined across worker processes by taking the
+# biggest value rather than the sum, see merge_with_max()
+_max_merged = set()
+
+# The snapshot file in shared_directory holding the totals of workers that
+# have exited, see retire_snapshot()
+RETIRED_SNAPSHOT = "retired.json"
+
+# Set in each worker process of the pre-fork server. Workers write their
+# totals here (see write_snapshot()) and /_metrics adds up every file, so
+# whichever worker answers the scrape reports for all of them.
+shared_directory = None
+
+
+class RequestMetrics():
+    """What one request cost: its SQL statements, rows and response bytes"""
+
+    __slots__ = ("sql_statements", "sql_seconds", "rows", "bytes")
+
+    def __init__(self):
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+
+def current():
+    """Returns the RequestMetrics of the request this thread is handling, or
+    None when it isn't handling one (e.g. running migrations at startup)
+    """
+    return getattr(_local, "request", None)
+
+
+@contextmanager
+def track_request():
+    """Collects a RequestMetrics for everything run inside the `with` block"""
+    request = RequestMetrics()
+    _local.request = request
+    try:
+        yield request
+    finally:
+        _local.request = None
+
+
+def record_sql(seconds):
+    """Counts one SQL statement against the current request"""
+    request = getattr(_local, "request", None)
+    if request is not None:
+        request.sql_statements += 1
+        request.sql_seconds += seconds
+
+
+def record_rows(count):
+    """Counts rows sent back to the client by the current request"""
+    request = getattr(_local, "request", None)
+    if request is not None:
+        request.rows += count
+
+
+def count_rows(rows):
+    """Passes rows through unchanged, counting them as they are streamed"""
+    request = getattr(_local, "request", None)
+    for row in rows:
+        if request is not None:
+            request.rows += 1
+        yield row
+
+
+def observe_request(route, status, seconds, request):
+    """Adds a finished request to the per-route totals
+
+    Args:
+        route (string): a low-cardinality label like "GET /animals/:id"
+        status (number): the response status code
+        seconds (number): how long the request took
+        request (RequestMetrics): what it cost, from track_request()
+    """
+    with _lock:
+        totals = _routes.get(route)
+        if totals is None:
+            totals = _routes[route] = {
+                "count": 0,
+                "sum": 0.0,
+                "buckets": [0] * len(LATENCY_BUCKETS),
+                "sql_statements": 0,
+                "sql_seconds": 0.0,
+                "rows": 0,
+                "bytes": 0,
+            }
+
+        totals["count"] += 1
+        totals["sum"] += seconds
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                totals["buckets"][index] += 1
+                break
+        totals["sql_statements"] += request.sql_statements
+        totals["sql_seconds"] += request.sql_seconds
+        totals["rows"] += request.rows
+        totals["bytes"] += request.bytes
+
+        _statuses[(route, status)] = _statuses.get((route, status), 0) + 1
+
+    if slow_request_threshold is not None and seconds >= slow_request_threshold:
+        slow_log.warning(
+            "%s -> %s took %.1fms (%d SQL statements, %.1fms in SQL, %d rows, %d bytes)",
+            route,
+            status,
+            seconds * 1000,
+            request.sql_statements,
+            request.sql_seconds * 1000,
+            request.rows,
+            request.bytes,
+        )
+
+
+def add_collector(collector):
+    """Registers a function whose samples are added to /_metrics
+
+    The function is called on every scrape and returns a list of
+    (name, type, help, samples) tuples, where samples is a list of
+    (labels dictionary, value) pairs.
+    """
+    _collectors.append(collector)
+
+
+def merge_with_max(*names):
+    """Marks collected gauges, like the slowest time anything took, whose
+    value across the pre-fork workers is the biggest one rather than the
+    sum of them all
+    """
+    _max_merged.update(names)
+
+
+def snapshot():
+    """Returns a copy of the per-route and per-status totals"""
+    with _lock:
+        routes = {
+            route: dict(totals, buckets=list(totals["buckets"]))
+            for route, totals in _routes.items()
+        }
+        statuses = dict(_statuses)
+    return (routes, statuses)
+
+
+def requests_observed():
+    """Returns how many requests this process has finished"""
+    with _lock:
+        return sum(totals["count"] for totals in _routes.values())
+
+
+def write_snapshot(final=False):
+    """Saves this process's totals to its file in shared_directory
+
+    Args:
+        final (bool): whether the process is exiting. Its counters are kept
+            so the totals never go backwards, but its gauges are dropped
+            since they no longer describe anything.
+    """
+    if shared_directory is None:
+        return
+
+    (routes, statuses) = snapshot()
+    collected = [
+        (name, type, help, samples)
+        for name, type, help, samples in _collect()
+        if not final or type == "counter"
+    ]
+    path = os.path.join(shared_directory, f"worker-{os.getpid()}.json")
+    _write_document(path, _document(os.getpid(), routes, statuses, collected))
+
+
+def retire_snapshot(directory, pid):
+    """Folds an exited worker's counters into the directory's one retired
+    snapshot and deletes the worker's own file
+
+    Without this, every recycled worker (see --max-requests) would leave a
+    file and a worker label behind for good. The counters still count
+    towards the totals, under worker="retired".
+
+    Args:
+        directory (string): the shared_directory the workers write to
+        pid (number): the exited worker's process id
+    """
+    path = os.path.join(directory, f"worker-{pid}.json")
+    document = _read_document(path)
+
+    if document is not None:
+        retired_path = os.path.join(directory, RETIRED_SNAPSHOT)
+        routes = {}
+        statuses = {}
+        collected = {}
+        for previous in (_read_document(retired_path), document):
+            if previous is not None:
+                _add_document(previous, routes, statuses, collected, counters_only=True)
+        _write_document(
+            retired_path,
+            _document("retired", routes, statuses, _collected_list(collected)),
+        )
+
+    # The .tmp one is left if the worker died mid-write
+    for leftover in (path, path + ".tmp"):
+        try:
+            os.remove(leftover)
+        except FileNotFoundError:
+            pass
+
+
+def _document(pid, routes, statuses, collected):
+    """The JSON document a snapshot file holds"""
+    return {
+        "pid": pid,
+        "routes": routes,
+        "statuses": [[route, status, count] for (route, status), count in statuses.items()],
+        "collected": collected,
+    }
+
+
+def _write_document(path, document):
+    # Write to a temporary file and rename it, so a scrape never reads half
+    # a file
+    with open(path + ".tmp", "w") as snapshot_file:
+        json.dump(document, snapshot_file)
+    os.replace(path + ".tmp", path)
+
+
+def _read_document(path):
+    """Returns a snapshot file's document, or None if it can't be read"""
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        # The file went away or is being replaced
+        return None
+
+
+def _collect():
+    return [sample for collector in _collectors for sample in collector()]
+
+
+def _add_document(document, routes, statuses, collected, counters_only=False):
+    """Adds a snapshot document's totals to the merged dictionaries"""
+    for route, totals in document["routes"].items():
+        merged = routes.get(route)
+        if merged is None:
+            routes[route] = dict(totals, buckets=list(totals["buckets"]))
+            continue
+        for key in ("count", "sum", "sql_statements", "sql_seconds", "rows", "bytes"):
+            merged[key] += totals[key]
+        merged["buckets"] = [a + b for a, b in zip(merged["buckets"], totals["buckets"])]
+
+    for route, status, count in document["statuses"]:
+        statuses[(route, status)] = statuses.get((route, status), 0) + count
+
+    for metric, type, help, samples in document["collected"]:
+        if counters_only and type != "counter":
+            continue
+        (_, _, values) = collected.setdefault(metric, (type, help, {}))
+        combine = max if metric in _max_merged else sum
+        for labels, value in samples:
+            key = tuple(sorted(labels.items()))
+            values[key] = combine((values.get(key, 0), value))
+
+
+def _collected_list(collected):
+    """Turns _add_document()'s merged samples back into collector tuples"""
+    return [
+        (metric, type, help, [(dict(key), value) for key, value in values.items()])
+        for metric, (type, help, values) in collected.items()
+    ]
+
+
+def _merged_snapshots():
+    """Adds up every worker's snapshot file, and the retired snapshot
+
+    Returns:
+        tuple: (routes, statuses, collected, per-worker request counts)
+    """
+    write_snapshot()
+
+    routes = {}
+    statuses = {}
+    collected = {}
+    workers = {}
+
+    for name in sorted(os.listdir(shared_directory)):
+        if not name.endswith(".json"):
+            continue
+        document = _read_document(os.path.join(shared_directory, name))
+        if document is None:
+            # Skip it this time
+            continue
+
+        _add_document(document, routes, statuses, collected)
+        workers[document["pid"]] = sum(totals["count"] for totals in document["routes"].values())
+
+    return (routes, statuses, _collected_list(collected), workers)
+
+
+def render_prometheus():
+    """Renders every metric in the Prometheus text exposition format
+
+    Returns:
+        string: the body for GET /_metrics
+    """
+    if shared_directory is not None:
+        (routes, statuses, collected, workers) = _merged_snapshots()
+    else:
+        (routes, statuses) = snapshot()
+        collected = _collect()
+        workers = None
+
+    lines = []
+
+    lines.append("# HELP kennel_request_duration_seconds Time spent handling requests")
+    lines.append("# TYPE kennel_request_duration_seconds histogram")
+    for route, totals in sorted(routes.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, totals["buckets"]):
+            cumulative += count
+            lines.append(_sample("kennel_request_duration_seconds_bucket", {"route": route, "le": bound}, cumulative))
+        lines.append(_sample("kennel_request_duration_seconds_bucket", {"route": route, "le": "+Inf"}, totals["count"]))
+        lines.append(_sample("kennel_request_duration_seconds_sum", {"route": route}, totals["sum"]))
+        lines.append(_sample("kennel_request_duration_seconds_count", {"route": route}, totals["count"]))
+
+    lines.append("# HELP kennel_responses_total Responses sent, by route and status code")
+    lines.append("# TYPE kennel_responses_total counter")
+    for (route, status), count in sorted(statuses.items()):
+        lines.append(_sample("kennel_responses_total", {"route": route, "status": status}, count))
+
+    per_route = (
+        ("sql_statements", "kennel_sql_statements_total", "SQL statements executed"),
+        ("sql_seconds", "kennel_sql_duration_seconds_total", "Time spent executing SQL"),
+        ("rows", "kennel_response_rows_total", "Rows serialized into responses"),
+        ("bytes", "kennel_response_bytes_total", "Bytes written to clients"),
+    )
+    for key, name, help in per_route:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} counter")
+        for route, totals in sorted(routes.items()):
+            lines.append(_sample(name, {"route": route}, totals[key]))
+
+    for name, type, help, samples in collected:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {type}")
+        for labels, value in samples:
+            lines.append(_sample(name, labels, value))
+
+    if workers is not None:
+        lines.append("# HELP kennel_worker_requests_total Requests handled by each worker process")
+        lines.append("# TYPE kennel_worker_requests_total counter")
+        # Process ids, and "retired"
+        for pid, count in sorted(workers.items(), key=lambda item: str(item[0])):
+            lines.append(_sample("kennel_worker_requests_total", {"worker": pid}, count))
+
+    return "\n".join(lines) + "\n"
+
+
+def _sample(name, labels, value):
+    if labels:
+        label_text = ",".join(
+            f'{key}="{_escape(str(label))}"' for key, label in labels.items()
+        )
+        return f"{name}{{{label_text}}} {value}"
+    return f"{name} {value}"
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class CountingWriter():
+    """Wraps a handler's wfile to count the bytes written to the client"""
+
+    def __init__(self, wfile):
+        self.wrapped = wfile
+
+    def write(self, data):
+        request = getattr(_local, "request", None)
+        if request is not None:
+            request.bytes += len(data)
+        return self.wrapped.write(data)
+
+    def flush(self):
+        return self.wrapped.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+def timed(function, *args):
+    """Runs function(*args), counting it as one SQL statement"""
+    started = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        record_sql(time.perf_counter() - started)
@@ -1,4 +1,6 @@
-from .animal import Animal
-from .customer import Customer
-from .employee import Employee
-from .location import Location
\ No newline at end of file
+from .animal import Animal, ANIMAL_SCHEMA
+from .customer import Customer, CUSTOMER_SCHEMA, CUSTOMER_UPDATE_SCHEMA
+from .employee import Employee, EMPLOYEE_SCHEMA
+from .location import Location, LOCATION_SCHEMA
+from .serializer import JSON_ENCODERS, RowSerializer, dumps, loads, use_json_encoder
+from .schema import MAX_INTEGER, MAX_TEXT_LENGTH, Schema, ValidationError, is_whole_number
@@ -1,4 +1,14 @@
+from .schema import Schema
+
+
 class Animal():
+    """An animal boarded at one of the kennels
+
+    __slots__ gives every instance a fixed set of attributes instead of its
+    own __dict__, so a big list of animals costs a lot less memory.
+    """
+
+    __slots__ = ("id", "name", "status", "breed", "customer_id", "location_id", "location", "customer")
 
     # Class initializer. It has 5 custom parameters, with the
     # special `self` parameter that every method on a class
@@ -13,4 +23,25 @@ class Animal():
         self.location = None
         self.customer = None
 
-        
\ No newline at end of file
+    def to_dict(self):
+        """Returns the animal as a JSON-serializable dictionary"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "breed": self.breed,
+            "customer_id": self.customer_id,
+            "location_id": self.location_id,
+            "location": self.location,
+            "customer": self.customer,
+        }
+
+
+# What a client sends to create or update an animal
+ANIMAL_SCHEMA = Schema(
+    ("name", str),
+    ("status", str),
+    ("breed", str),
+    ("customer_id", int),
+    ("location_id", int),
+)
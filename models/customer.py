@@ -1,8 +1,38 @@
+from .schema import Schema
+
+
 class Customer():
+    """A customer who boards their animals at the kennels"""
+
+    __slots__ = ("id", "name", "address", "email", "password")
 
     def __init__(self, id, name, address, email = "", password = ""):
         self.id = id
         self.name = name
         self.address = address
         self.email = email
-        self.password = password
\ No newline at end of file
+        self.password = password
+
+    def to_dict(self):
+        """Returns the customer as a JSON-serializable dictionary, without
+        the password, which is never sent to clients
+        """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "address": self.address,
+            "email": self.email,
+        }
+
+
+# What a client sends to create a customer
+CUSTOMER_SCHEMA = Schema(
+    ("name", str),
+    ("address", str),
+    ("email", str),
+    ("password", str),
+)
+
+# What a client sends to update one. GET never sends the password back, so
+# a customer read with GET and sent back with PUT keeps the stored one.
+CUSTOMER_UPDATE_SCHEMA = CUSTOMER_SCHEMA.with_optional("password")
@@ -1,8 +1,32 @@
+from .schema import Schema
+
+
 class Employee():
+    """Someone who works at one of the kennel locations"""
+
+    __slots__ = ("id", "name", "address", "location_id", "location")
 
     def __init__(self, id, name, address, location_id):
         self.id = id
         self.name = name
         self.address = address
         self.location_id = location_id
-        self.location = None
\ No newline at end of file
+        self.location = None
+
+    def to_dict(self):
+        """Returns the employee as a JSON-serializable dictionary"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "address": self.address,
+            "location_id": self.location_id,
+            "location": self.location,
+        }
+
+
+# What a client sends to create or update an employee
+EMPLOYEE_SCHEMA = Schema(
+    ("name", str),
+    ("address", str),
+    ("location_id", int),
+)
@@ -1,6 +1,23 @@
+from .schema import Schema
+
+
 class Location():
+    """One of the kennel's locations"""
+
+    __slots__ = ("id", "name", "address")
 
     def __init__(self, id, name, address):
         self.id = id
         self.name = name
-        self.address = address
\ No newline at end of file
+        self.address = address
+
+    def to_dict(self):
+        """Returns the location as a JSON-serializable dictionary"""
+        return {"id": self.id, "name": self.name, "address": self.address}
+
+
+# What a client sends to create or update a location
+LOCATION_SCHEMA = Schema(
+    ("name", str),
+    ("address", str),
+)
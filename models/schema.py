@@ -0,0 +1,114 @@
+# Text longer than this many characters is rejected
+MAX_TEXT_LENGTH = 255
+
+# SQLite stores integers in 64 bits. Anything bigger would fail in the
+# driver rather than come back as a 400.
+MAX_INTEGER = 2 ** 63 - 1
+
+
+class ValidationError(Exception):
+    """Raised by Schema.validate() when a body doesn't fit the model
+
+    Attributes:
+        errors (list): one {"field": name, "message": "..."} per problem
+    """
+
+    def __init__(self, errors):
+        super().__init__(", ".join(error["message"] for error in errors))
+        self.errors = errors
+
+
+def is_whole_number(value):
+    """Whether a decoded JSON value is an integer SQLite can store. JSON
+    true and false decode to bools, which Python counts as integers.
+    """
+    return type(value) is int and -MAX_INTEGER <= value <= MAX_INTEGER
+
+
+def _check_text(value):
+    return type(value) is str and len(value) <= MAX_TEXT_LENGTH
+
+
+# What each field type accepts, and the message for a value it doesn't
+CHECKS = {
+    str: (_check_text, f"must be text of at most {MAX_TEXT_LENGTH} characters"),
+    int: (is_whole_number, "must be a whole number"),
+}
+
+
+def _camel_case(name):
+    """customer_id -> customerId"""
+    (first, *rest) = name.split("_")
+    return first + "".join(part.title() for part in rest)
+
+
+class Schema():
+    """Checks a decoded request body against a model's writable fields and
+    returns just those fields, in column order
+
+    Everything a field needs is worked out once, when the schema is made,
+    so validating a body is one pass over a tuple with no lookups by type.
+
+    Fields are read by their snake_case names, the way responses send them,
+    or by their camelCase names (customerId), which some clients send.
+    Keys that aren't fields, like "id" or an expanded "location", are
+    ignored, so a row read with GET can be sent back with PUT. Fields GET
+    never sends, like a customer's password, are made optional for updates
+    with with_optional().
+    """
+
+    __slots__ = ("fields", "optional", "_definition", "_compiled")
+
+    def __init__(self, *fields, optional=()):
+        """
+        Args:
+            fields: a (name, type) pair per field in column order, where
+                the type is str or int
+            optional (tuple): names of fields a body may leave out
+        """
+        self.fields = tuple(name for (name, kind) in fields)
+        self.optional = frozenset(optional)
+        self._definition = fields
+
+        compiled = []
+        for (name, kind) in fields:
+            (check, problem) = CHECKS[kind]
+            alias = _camel_case(name)
+            compiled.append(
+                (name, alias if alias != name else None, check, f"{name} {problem}", name in self.optional)
+            )
+        self._compiled = tuple(compiled)
+
+    def with_optional(self, *names):
+        """Returns a copy of the schema where these fields may be left out"""
+        return Schema(*self._definition, optional=self.optional | set(names))
+
+    def validate(self, body):
+        """Returns the body's fields as {name: value}. Optional fields the
+        body leaves out are left out of it too.
+
+        Raises:
+            ValidationError: listing every missing or invalid field
+        """
+        values = {}
+        errors = []
+
+        for (name, alias, check, problem, optional) in self._compiled:
+            if name in body:
+                value = body[name]
+            elif alias is not None and alias in body:
+                value = body[alias]
+            elif optional:
+                continue
+            else:
+                errors.append({"field": name, "message": f"{name} is required"})
+                continue
+
+            if check(value):
+                values[name] = value
+            else:
+                errors.append({"field": name, "message": problem})
+
+        if errors:
+            raise ValidationError(errors)
+        return values
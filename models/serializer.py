@@ -0,0 +1,167 @@
+import json
+from json.encoder import encode_basestring_ascii
+from operator import itemgetter
+
+# orjson is several times faster than the json module at encoding
+# dictionaries. It is used when it is installed, see use_json_encoder().
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The encoders use_json_encoder() accepts
+JSON_ENCODERS = ("auto", "orjson", "json")
+
+# Compact, like orjson, so both encoders send the same bytes
+_stdlib_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def _orjson_encode(value):
+    return orjson.dumps(value).decode()
+
+
+_encode = _orjson_encode if orjson is not None else _stdlib_encode
+_decode = orjson.loads if orjson is not None else json.loads
+
+
+def use_json_encoder(name):
+    """Picks the encoder dumps() uses, and the decoder loads() uses
+
+    Args:
+        name (string): "orjson", "json", or "auto" for orjson when it is
+            installed and the json module otherwise
+
+    Raises:
+        ValueError: for an unknown name, or "orjson" when it isn't installed
+    """
+    global _encode, _decode
+
+    if name not in JSON_ENCODERS:
+        raise ValueError(f"Unknown JSON encoder {name!r}, expected one of {JSON_ENCODERS}")
+    if name == "orjson" and orjson is None:
+        raise ValueError("The orjson package is not installed")
+
+    if name == "json" or orjson is None:
+        _encode = _stdlib_encode
+        _decode = json.loads
+    else:
+        _encode = _orjson_encode
+        _decode = orjson.loads
+
+
+def dumps(value):
+    """Encodes a value as a JSON string with the chosen encoder"""
+    return _encode(value)
+
+
+def loads(body):
+    """Decodes a JSON document (str or bytes) with the chosen decoder
+
+    Raises:
+        ValueError: if it isn't valid JSON, or is nested too deeply to
+            decode
+    """
+    try:
+        return _decode(body)
+    except RecursionError:
+        # The json module recurses once per nested array or object
+        raise ValueError("The JSON is nested too deeply") from None
+
+
+def _encode_value(value):
+    """Encodes one column value. Rows are mostly strings and integers, so
+    those are checked first and the json module handles anything else.
+    """
+    if type(value) is str:
+        return encode_basestring_ascii(value)
+    if type(value) is int:
+        return str(value)
+    if value is None:
+        return "null"
+    return _stdlib_encode(value)
+
+
+class RowSerializer():
+    """Turns cursor row tuples straight into JSON objects
+
+    Building a model, then a dictionary, then walking that dictionary with
+    the json module costs several allocations per row. A RowSerializer
+    instead fills in a template made once from the row's layout, e.g.
+
+        '{"id": %s, "name": %s, "location": {"id": %s, ...}}'
+
+    so encoding a row is one pass over its values and a string format.
+    """
+
+    __slots__ = ("columns", "layout", "_template", "_pick", "_keys")
+
+    def __init__(self, columns, layout):
+        """
+        Args:
+            columns (tuple): the names of the selected columns, in order
+            layout (tuple): the keys of the JSON object, in order. Each one
+                is a column name, a (key, column name) pair to rename a
+                column, or a (key, layout) pair for a nested object.
+        """
+        self.columns = tuple(columns)
+        self.layout = tuple(layout)
+
+        positions = []
+        # Escape any % in the keys before turning the placeholders into %s
+        self._template = (
+            self._compile(self.layout, positions).replace("%", "%%").replace("\0", "%s")
+        )
+
+        # itemgetter picks the encoded values into template order in one
+        # call. With a single position it returns the value, not a tuple.
+        if len(positions) == 1:
+            position = positions[0]
+            self._pick = lambda values: (values[position],)
+        else:
+            self._pick = itemgetter(*positions)
+        self._keys = self._key_tree(self.layout)
+
+    def encode(self, row):
+        """Returns the row as a JSON object string"""
+        return self._template % self._pick([_encode_value(value) for value in row])
+
+    def to_dict(self, row):
+        """Returns the row as a (possibly nested) dictionary"""
+        return self._build(self._keys, row)
+
+    def _compile(self, layout, positions):
+        members = []
+        for entry in layout:
+            if isinstance(entry, str):
+                (key, source) = (entry, entry)
+            else:
+                (key, source) = entry
+
+            if isinstance(source, str):
+                positions.append(self.columns.index(source))
+                # \0 marks a placeholder until the literal text is escaped
+                value = "\0"
+            else:
+                value = self._compile(source, positions)
+            members.append(f"{encode_basestring_ascii(key)}:{value}")
+        return "{" + ",".join(members) + "}"
+
+    def _key_tree(self, layout):
+        keys = []
+        for entry in layout:
+            if isinstance(entry, str):
+                (key, source) = (entry, entry)
+            else:
+                (key, source) = entry
+
+            if isinstance(source, str):
+                keys.append((key, self.columns.index(source)))
+            else:
+                keys.append((key, self._key_tree(source)))
+        return keys
+
+    def _build(self, keys, row):
+        return {
+            key: row[source] if type(source) is int else self._build(source, row)
+            for key, source in keys
+        }
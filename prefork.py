@@ -0,0 +1,275 @@
+import logging
+import os
+import random
+import select
+import shutil
+import signal
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import metrics
+from server import listening_socket
+
+log = logging.getLogger("kennel.prefork")
+
+# How often (in seconds) the master checks on its workers, and each worker
+# saves its metrics and checks its request count
+POLL_INTERVAL = 0.5
+
+# Seconds a worker gets to finish its requests after SIGTERM before the
+# master kills it
+GRACEFUL_TIMEOUT = 30
+
+# Workers that die sooner than this after starting are respawned only after
+# a pause, so a worker that can't start doesn't fork in a tight loop
+MIN_WORKER_LIFETIME = 1.0
+
+
+class PreforkServer():
+    """Runs the server in several worker processes that share one port.
+
+    The GIL lets one process use one core however many threads it has, so
+    building JSON for big collections tops out at a core. Forking `processes`
+    workers spreads requests over that many cores.
+
+    Either every worker listens on its own SO_REUSEPORT socket, and the
+    kernel balances new connections between them, or the master opens the
+    socket once and the workers inherit it.
+
+    The master only supervises:
+        * a worker that exits is replaced
+        * SIGHUP starts a fresh set of workers, then gracefully stops the
+          old ones, so a reload never refuses a connection
+        * SIGTERM or SIGINT stops every worker gracefully and exits
+    """
+
+    def __init__(
+        self,
+        build_server,
+        address,
+        processes=2,
+        max_requests=0,
+        reuse_port=True,
+        on_worker_start=None,
+        on_worker_stop=None,
+    ):
+        """
+        Args:
+            build_server (function): called in each worker with a listening
+                socket, returns a server with serve_forever(), shutdown()
+                and server_close(), e.g. a server.build_server() partial
+            address (tuple): (host, port) to listen on
+            processes (number): how many workers to run
+            max_requests (number): recycle a worker after roughly this many
+                requests, 0 to never recycle
+            reuse_port (bool): give every worker its own SO_REUSEPORT socket
+                instead of sharing one inherited socket
+            on_worker_start (function): called in each worker right after it
+                is forked
+            on_worker_stop (function): called in a worker when it starts
+                stopping, to end any long-running responses
+        """
+        self.build_server = build_server
+        self.address = address
+        self.processes = processes
+        self.max_requests = max_requests
+        self.reuse_port = reuse_port
+        self.on_worker_start = on_worker_start
+        self.on_worker_stop = on_worker_stop
+
+        # pid -> start time of the current workers
+        self._workers = {}
+        # pids of old workers being stopped after a reload
+        self._retiring = set()
+        self._socket = None
+        self._metrics_directory = None
+        self._reload = False
+        self._stopping = False
+
+    def serve_forever(self):
+        self._metrics_directory = tempfile.mkdtemp(prefix="kennel-metrics-")
+        if not self.reuse_port:
+            self._socket = listening_socket(*self.address)
+
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        log.info("Starting %d workers on port %s", self.processes, self.address[1])
+        try:
+            for _ in range(self.processes):
+                self._spawn()
+
+            while not self._stopping:
+                time.sleep(POLL_INTERVAL)
+                self._reap()
+                if self._reload:
+                    self._reload = False
+                    self._replace_workers()
+                if not self._stopping:
+                    while len(self._workers) < self.processes:
+                        self._spawn()
+        finally:
+            self._stop_workers(list(self._workers) + list(self._retiring))
+            if self._socket is not None:
+                self._socket.close()
+            shutil.rmtree(self._metrics_directory, ignore_errors=True)
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # os._exit() so the child never runs the master's cleanup
+            try:
+                self._run_worker()
+                code = 0
+            except BaseException:
+                log.exception("Worker %d failed", os.getpid())
+                code = 1
+            os._exit(code)
+
+        self._workers[pid] = time.monotonic()
+
+    def _reap(self):
+        """Collects exited workers. The main loop replaces current ones."""
+        while True:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            metrics.retire_snapshot(self._metrics_directory, pid)
+
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+                continue
+
+            started = self._workers.pop(pid, None)
+            if started is None:
+                continue
+
+            if not self._stopping:
+                log.info("Worker %d exited with status %d, replacing it", pid, os.waitstatus_to_exitcode(status))
+                if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                    time.sleep(MIN_WORKER_LIFETIME)
+
+    def _replace_workers(self):
+        """Graceful reload: start new workers first, then retire the old"""
+        old = list(self._workers)
+        self._workers = {}
+        log.info("Reloading: replacing workers %s", old)
+
+        for _ in range(self.processes):
+            self._spawn()
+
+        for pid in old:
+            self._retiring.add(pid)
+            _signal(pid, signal.SIGTERM)
+
+    def _stop_workers(self, pids):
+        for pid in pids:
+            _signal(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    (done, _) = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    remaining.discard(pid)
+            if remaining:
+                time.sleep(0.1)
+
+        for pid in remaining:
+            log.warning("Worker %d didn't stop in %ss, killing it", pid, GRACEFUL_TIMEOUT)
+            _signal(pid, signal.SIGKILL)
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+    def _run_worker(self):
+        # The master's signal handlers only make sense in the master
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        metrics.shared_directory = self._metrics_directory
+
+        if self.on_worker_start is not None:
+            self.on_worker_start()
+
+        sock = self._socket
+        if sock is None:
+            sock = listening_socket(*self.address, reuse_port=True)
+        server = self.build_server(sock)
+
+        stopped = threading.Event()
+
+        def stop(signum=None, frame=None):
+            # shutdown() waits for serve_forever() to return, which runs on
+            # this (the main) thread, so it has to be called from another
+            if not stopped.is_set():
+                stopped.set()
+                if self.on_worker_stop is not None:
+                    self.on_worker_stop()
+                threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        # Spread recycling out so the workers don't all restart together
+        limit = 0
+        if self.max_requests:
+            limit = self.max_requests + random.randint(0, self.max_requests // 10)
+
+        def watch():
+            while not stopped.wait(POLL_INTERVAL):
+                metrics.write_snapshot()
+                if limit and metrics.requests_observed() >= limit:
+                    log.info("Worker %d handled %d requests, recycling it", os.getpid(), limit)
+                    stop()
+
+        threading.Thread(target=watch, name="kennel-worker-watch", daemon=True).start()
+
+        try:
+            server.serve_forever()
+            if self._socket is None and isinstance(server, socketserver.BaseServer):
+                _drain(server, sock)
+        finally:
+            stopped.set()
+            server.server_close()
+            metrics.write_snapshot(final=True)
+
+
+def _drain(server, sock):
+    """Answers the connections still queued on a worker's own socket
+
+    Each SO_REUSEPORT socket has its own queue of connections, and closing
+    the socket resets whatever is in it rather than handing it to the other
+    workers, so a stopping worker serves its queue first.
+    """
+    server.timeout = 0
+    while select.select([sock], [], [], 0)[0]:
+        server.handle_request()
+
+
+def _signal(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def reuse_port_supported():
+    """Whether this platform can share a port between sockets"""
+    return hasattr(socket, "SO_REUSEPORT")
@@ -1,40 +1,44 @@
-import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib import response
-from views import (
-    get_all_animals,
-    get_single_animal,
-    create_animal,
-    delete_animal,
-    update_animal,
-)
-from views import (
-    get_all_locations,
-    get_single_location,
-    create_location,
-    delete_location,
-    update_location,
-)
-from views import (
-    get_all_customers,
-    get_single_customer,
-    create_customer,
-    delete_customer,
-    update_customer,
-)
-from views import (
-    get_all_employees,
-    get_single_employee,
-    create_employee,
-    delete_employee,
-    update_employee,
-)
-
-from models import Animal
-from models import Customer
-from models import Employee
-from models import Location
+import argparse
+import functools
+import logging
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
+from server import SERVER_MODES, build_server
+from models import JSON_ENCODERS, loads, use_json_encoder
+from db import DATABASE_PATH, DEFAULT_CACHED_STATEMENTS, STORAGE_ENGINES, QueryError
+from db import configure_storage, get_storage
+from db import pool_metrics, cache_metrics, entity_cache, filter_metrics, query_metrics
+from router import HTTPError, Request, Response
+from routes import ROUTES
+from views import event_metrics, close_event_streams
+from views import change_feed
+from prefork import PreforkServer, reuse_port_supported
+import coalesce
+import compression
+import metrics
+import response_cache
+
+log = logging.getLogger("kennel")
+
+metrics.add_collector(pool_metrics)
+metrics.add_collector(cache_metrics)
+metrics.add_collector(compression.compression_metrics)
+metrics.add_collector(filter_metrics)
+metrics.add_collector(query_metrics)
+# Every worker builds the same catalog and statement caches, so adding
+# them up would count each statement once per worker
+metrics.merge_with_max(
+    "kennel_query_max_seconds",
+    "kennel_pool_cached_statements",
+    "kennel_query_catalog_statements",
+    "kennel_filter_statements",
+)
+metrics.add_collector(coalesce.coalesce_metrics)
+metrics.add_collector(response_cache.response_cache_metrics)
+metrics.add_collector(event_metrics)
 
 # Here's a class. It inherits from another class.
 # For now, think of a class as a container for functions that
@@ -43,225 +47,635 @@ from urllib.parse import urlparse, parse_qs
 
 
 class HandleRequests(BaseHTTPRequestHandler):
-    """Controls the functionality of any GET, PUT, POST, DELETE requests to the server"""
-
-    def parse_url(self, path):
-        """Parse the url into the resource and id"""
-        parsed_url = urlparse(path)
-        path_params = parsed_url.path.split("/")  # ['', 'animals', 1]
-        resource = path_params[1]
-
-        if parsed_url.query:
-            query = parse_qs(parsed_url.query)
-            return (resource, query)
-
-        pk = None
-        try:
-            pk = int(path_params[2])
-        except (IndexError, ValueError):
-            pass
-        return (resource, pk)  # This is a tuple
+    """Controls the functionality of any GET, PUT, POST, DELETE requests to the server
 
-    # This is a Docstring it should be at the beginning of all classes and functions
-    # It gives a description of the class or function
+    Which view function answers a request is looked up in the route table
+    in routes.py, by method, path and query string keys.
+    """
 
-    # Here's a class function
+    # Chunked transfer encoding, used to stream collections, needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
 
-    # Here's a method on the class that overrides the parent's method.
-    # It handles any GET request.
-    def do_GET(self):
-        self._set_headers(200)
+    # Seconds a kept-alive connection may sit idle before it is closed, so an
+    # idle client can't hold on to a worker forever
+    timeout = 5
 
-        response = {}
+    # Whether this connection may stay open for another request. The async
+    # front end waits for requests on its event loop rather than a worker,
+    # so its connections always may. See handle() for the other servers.
+    _may_keep_alive = True
 
-        # Parse URL and store entire tuple in a variable
-        parsed = self.parse_url(self.path)
+    # Headers and body go out in separate writes. On a kept-alive connection
+    # Nagle's algorithm would hold the body back until the client ACKs the
+    # headers, which delayed ACKs can stall for ~40ms.
+    disable_nagle_algorithm = True
 
-        # If the path does not include a query parameter, continue with the original if block
-        if "?" not in self.path:
-            (resource, id) = parsed
-
-            if resource == "animals":
-                if id is not None:
-                    response = f"{get_single_animal(id)}"
-                else:
-                    response = f"{get_all_animals()}"
-            elif resource == "customers":
-                if id is not None:
-                    response = f"{get_single_customer(id)}"
-                else:
-                    response = f"{get_all_customers()}"
-            elif resource == "employees":
-                if id is not None:
-                    response = f"{get_single_employee(id)}"
-                else:
-                    response = f"{get_all_employees()}" 
-            elif resource == "locations":
-                if id is not None:
-                    response = f"{get_single_location(id)}"
-                else:
-                    response = f"{get_all_locations()}"              
+    # The biggest request body accepted, in bytes. Bulk writes send the
+    # biggest ones, and 1 MiB holds thousands of rows.
+    max_body_bytes = 1024 * 1024
 
-        else:  # There is a ? in the path, run the query param functions
-            (resource, query) = parsed
+    def handle(self):
+        """Answers a connection's requests, keeping it open between them only
+        while the server has a keep-alive slot free
 
-            # see if the query dictionary has an email key
-            if query.get("email") and resource == "customers":
-                response = get_customer_by_email(query["email"][0])
-            if query.get("location_id") and resource == "animals":
-                response = get_animal_by_location(query["location_id"][0])
-            if query.get("location_id") and resource == "employees":
-                response = get_employee_by_location(query["location_id"][0])
-            if query.get("status") and resource == "animals":
-                response = get_animal_by_status(query["status"][0])
+        An idle kept-alive connection holds a worker until it times out, so
+        the servers hand out fewer slots than they have workers (see
+        server.ThreadPoolHTTPServer). Without a slot the connection is
+        closed after one response.
+        """
+        slots = getattr(self.server, "keep_alive_slots", None)
+        self._may_keep_alive = slots is None or slots.acquire(blocking=False)
+        try:
+            super().handle()
+        finally:
+            if slots is not None and self._may_keep_alive:
+                slots.release()
+
+    def handle_one_request(self):
+        """Handles one request, recording its latency, SQL statements, rows
+        and bytes in the metrics module
+        """
+        if not isinstance(self.wfile, metrics.CountingWriter):
+            self.wfile = metrics.CountingWriter(self.wfile)
+
+        # Left over from the previous request on a kept-alive connection
+        self.command = None
+        self._status = None
+        self._route_label = None
+
+        started = time.perf_counter()
+        with metrics.track_request() as request_metrics:
+            super().handle_one_request()
+
+        if self.command is not None and self._status is not None:
+            metrics.observe_request(
+                self._route_label or f"{self.command} other",
+                self._status,
+                time.perf_counter() - started,
+                request_metrics,
+            )
+
+    def send_response(self, code, message=None):
+        """Remembers the status code for the metrics, then sends it"""
+        self._status = code
+        super().send_response(code, message)
 
-        self.wfile.write(response.encode())
+    # Here's a method on the class that overrides the parent's method.
+    # It handles any GET request.
+    def do_GET(self):
+        """Handles GET requests to the server"""
+        self._dispatch()
 
     # Here's a method on the class that overrides the parent's method.
     # It handles any POST request.
-
     def do_POST(self):
+        """Handles POST requests to the server"""
+        self._dispatch()
 
-        content_len = int(self.headers.get("content-length", 0))
-        post_body = self.rfile.read(content_len)
+    # A method that handles any PUT request.
+    def do_PUT(self):
+        """Handles PUT requests to the server"""
+        self._dispatch()
 
-        # Convert JSON string to a Python dictionary
-        post_body = json.loads(post_body)
+    def do_DELETE(self):
+        """Handles DELETE requests to the server"""
+        self._dispatch()
 
-        # Parse the URL
-        (resource, id) = self.parse_url(self.path)
+    def do_PATCH(self):
+        """Handles PATCH requests to the server. No route takes them, so the
+        router answers with a JSON 405 listing the methods that are allowed.
+        """
+        self._dispatch()
 
-        # Initialize new entry(s)
-        new_entry = None
+    def _dispatch(self):
+        """Finds the route for the request, runs it and sends its response"""
+        parsed_url = urlparse(self.path)
+        query = parse_qs(parsed_url.query)
 
-        # Add a new animal to the list. Don't worry about
-        # the orange squiggle, you'll define the create_animal
-        # function next.
-        if resource == "animals":
-            self._set_headers(201)
-            new_entry = create_animal(post_body)
+        # Read the body even if the request turns out to be an error, or it
+        # would be taken for the next request on a kept-alive connection
+        try:
+            post_body = self._read_body()
+        except HTTPError as ex:
+            # The body is still waiting on the connection, unread, so the
+            # connection can't carry another request
+            self.close_connection = True
+            self._send(ex.response())
+            return
 
-        # Add a new location to the list.
-        if resource == "locations":
-            # Initialize new location: both name and address properties must be present in POST dictionary/body to be posted.
-            if "name" in post_body and "address" in post_body:
-                self._set_headers(201)
-                new_entry = create_location(post_body)
+        try:
+            (route, params) = ROUTES.match(self.command, parsed_url.path, query)
+            self._route_label = route.label
+
+            validators = self._validators(route)
+            if validators is not None and self._not_modified(*validators):
+                # The client's copy is still current, so skip the handler
+                self._send(Response(304, headers=_validator_headers(*validators)))
+                return
+
+            request = Request(
+                self.command,
+                parsed_url.path,
+                params,
+                query,
+                _decode_body(post_body),
+                self.headers,
+            )
+            cached = None
+            if validators is None:
+                response = route.handler(request)
             else:
-                self._set_headers(400)
-                new_entry = {
-                    "message": f'{"name is required" if "name" not in post_body else ""} {"address is required" if "address" not in post_body else ""}'
-                }
-
-        # Add a new employee to the list.
-        if resource == "employees":
-            # Initialize new location
-            new_entry = create_employee(post_body)
-
-        # Add a new customer to the list.
-        if resource == "customers":
-            # Initialize new location
-            new_entry = create_customer(post_body)
-
-        # Encode the new entry(s) and send in response
-        self.wfile.write(json.dumps(new_entry).encode())
-
-    def do_DELETE(self):
-
-        # Parse the URL
-        (resource, id) = self.parse_url(self.path)
-
-        # Delete a single animal from the list
-        if resource == "animals":
-            self._set_headers(204)
-            delete_animal(id)
+                (response, cached) = self._respond(route, request, validators[0])
+                if response.status == 200:
+                    response.headers.update(_validator_headers(*validators))
+        except HTTPError as ex:
+            response = ex.response()
+            cached = None
+        except Exception:
+            # A bug, not the client's fault. Answer it properly so a
+            # kept-alive connection stays usable.
+            log.exception("%s %s failed", self.command, self.path)
+            response = Response(500, {"message": "Internal server error"})
+            cached = None
+
+        self._send(response, cached)
+
+    def _respond(self, route, request, etag):
+        """Runs a GET route that has validators, through the response cache
+        and the single-flight layer
 
-        # Delete a single customer from the list
-        if resource == "customers":
-            self._set_headers(405)
-            response = {"message": f"Ruh, roh: This function is not supported, sorry!"}
-
-        # Delete a single employee from the list
-        if resource == "employees":
-            self._set_headers(204)
-            delete_employee(id)
+        Args:
+            route (Route): the matched route
+            request (Request): the request for it
+            etag (string): from _validators(), built from the versions of
+                the tables the route reads
 
-        # Delete a single location from the list
-        if resource == "locations":
-            self._set_headers(204)
-            delete_location(id)
+        Returns:
+            tuple: (Response, its response_cache.CachedResponse or None)
+        """
+        key = (route.label, tuple(request.params.items()), _query_key(request.query))
+
+        if response_cache.enabled:
+            cached = response_cache.cache.get(key, etag)
+            if cached is not None:
+                return (cached.response.copy(), cached)
+
+        if coalesce.enabled:
+            # Identical GETs that arrive while this one is being answered
+            # wait for it and send the same bytes (see coalesce.py). The ETag
+            # is part of the key, so nobody gets a response older than the
+            # table versions they just read.
+            response = coalesce.single_flight.run(key + (etag,), lambda: route.handler(request))
+        else:
+            response = route.handler(request)
 
-        # Encode the new resource and send in response
-        self.wfile.write(json.dumps(response).encode())
+        cached = None
+        if response_cache.enabled:
+            cached = response_cache.cache.put(key, etag, response)
+        return (response, cached)
 
-    # A method that handles any PUT request.
-    def do_PUT(self):
-        """Handles PUT requests to the server"""
-        content_len = int(self.headers.get('content-length', 0))
-        post_body = self.rfile.read(content_len)
-        post_body = json.loads(post_body)
+    def _read_body(self):
+        """Reads the raw request body, if there is one
 
-        # Parse the URL
-        (resource, id) = self.parse_url(self.path)
+        Raises:
+            HTTPError: 413 for a body over max_body_bytes, which is never
+                read into memory, or 400/411 when its length is unknown
+        """
+        if "Transfer-Encoding" in self.headers:
+            raise HTTPError(411, "Send the request body with a Content-Length header")
+
+        content_len = self.headers.get("Content-Length", "0").strip()
+        # The same check the async front end makes (see server._read_request)
+        if not (content_len.isascii() and content_len.isdigit()):
+            raise HTTPError(400, "Content-Length must be a whole number")
+        content_len = int(content_len)
+        if content_len > self.max_body_bytes:
+            raise HTTPError(413, f"The request body can't be over {self.max_body_bytes} bytes")
+        if not content_len:
+            return None
+
+        return self.rfile.read(content_len)
+
+    def _validators(self, route):
+        """Works out the ETag and Last-Modified of a GET route's response
+        from the versions of the tables it reads
+
+        Returns:
+            tuple: (etag, last modified unix timestamp), or None for routes
+                that can't be validated
+        """
+        if self.command != "GET" or not route.tables:
+            return None
 
-        success = False
+        versions = get_storage().table_versions(route.tables)
+        # Weak, since the same data can be sent with different encodings
+        etag = 'W/"%s"' % "-".join(str(versions[table][0]) for table in route.tables)
+        last_modified = max(versions[table][1] for table in route.tables)
+        return (etag, last_modified)
 
-        # Update dictionary from animals list
-        if resource == "animals":
-            success = update_animal(id, post_body)
+    def _not_modified(self, etag, last_modified):
+        """Checks the conditional request headers against the validators
 
-        # Update dictionary from customers list
-        elif resource == "customers":
-            update_customer(id, post_body)
+        Returns:
+            bool: True when a 304 Not Modified should be sent
+        """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            # If-None-Match wins over If-Modified-Since when both are sent
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            # The weak comparison: W/"1" matches "1"
+            return "*" in tags or any(tag.removeprefix("W/") == etag[2:] for tag in tags)
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                # Unparseable dates are ignored, as the RFC asks
+                return False
+            return last_modified <= since
+
+        return False
+
+    def _send(self, response, cached=None):
+        """Sends a router.Response, streaming it if it has a stream
 
-        # Update dictionary from employees list
-        elif resource == "employees":
-            update_employee(id, post_body)
+        Args:
+            response (Response): what the route returned
+            cached (CachedResponse): the response cache's entry for it, which
+                keeps the compressed body for the next request
+        """
+        headers = dict(response.headers)
+
+        if response.stream is not None:
+            stream = response.stream
+            encoding = compression.negotiate(self.headers.get("Accept-Encoding"))
+            headers["Vary"] = "Accept-Encoding"
+            # Server-sent events have to reach the client as they happen,
+            # and a compressor holds data back until it has enough of it
+            if response.content_type == "text/event-stream":
+                encoding = None
+            if encoding is not None:
+                stream = compression.compress_stream(encoding, stream)
+                headers["Content-Encoding"] = encoding
+
+            try:
+                self._set_headers(
+                    response.status,
+                    chunked=True,
+                    headers=headers,
+                    content_type=response.content_type,
+                )
+                self._write_chunked(stream)
+            finally:
+                # _write_chunked() closes the stream it sends, but not if the
+                # headers already failed (the client hung up), and closing an
+                # unstarted compressor doesn't close the route's stream. An
+                # event stream only gives its place back when closed.
+                if hasattr(response.stream, "close"):
+                    response.stream.close()
+            return
+
+        body = response.encode()
+        if len(body) >= compression.minimum_size:
+            encoding = compression.negotiate(self.headers.get("Accept-Encoding"))
+            # Caches must keep the compressed and plain copies apart
+            headers["Vary"] = "Accept-Encoding"
+            if encoding is not None:
+                if cached is not None:
+                    body = response_cache.cache.compress(cached, encoding)
+                else:
+                    body = compression.compress(encoding, body)
+                headers["Content-Encoding"] = encoding
 
-        # Update dictionary from locations list
-        elif resource == "locations":
-            update_location(id, post_body)
+        if response.status not in (204, 304):
+            headers["Content-Length"] = str(len(body))
 
-        if success:
-            self._set_headers(204)
-        else:
-            self._set_headers(404)
-        
-        # Encode the new resource and send in response
-        self.wfile.write("".encode())
+        self._set_headers(response.status, headers=headers, content_type=response.content_type)
+        if body:
+            self.wfile.write(body)
 
-    def _set_headers(self, status):
+    def _set_headers(self, status, chunked=False, headers=None, content_type="application/json"):
         # Notice this Docstring also includes information about the arguments passed to the function
         """Sets the status code, Content-Type and Access-Control-Allow-Origin
         headers on the response
 
         Args:
             status (number): the status code to return to the front end
+            chunked (bool): whether the body will be sent with _write_chunked()
+            headers (dict): any extra headers to send
+            content_type (string): the body's media type
         """
         self.send_response(status)
-        self.send_header("Content-type", "application/json")
+        self._send_connection_header()
+        self.send_header("Content-type", content_type)
         self.send_header("Access-Control-Allow-Origin", "*")
+        # Let browser code read the pagination headers
+        self.send_header("Access-Control-Expose-Headers", "X-Next-Cursor, Link, ETag")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
         self.end_headers()
 
+    def _send_connection_header(self):
+        """Tells the client the connection closes after this response when
+        it has no keep-alive slot. send_header() sets close_connection too.
+        """
+        if not self._may_keep_alive:
+            self.send_header("Connection", "close")
+
+    def _write_chunked(self, chunks):
+        """Sends each piece of the body as an HTTP/1.1 chunk as it is produced
+
+        Args:
+            chunks (iterable): the body as a sequence of bytes objects
+        """
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        except ConnectionError:
+            # The client went away mid-stream, which is how event streams
+            # usually end. There's nobody left to send the last chunk to.
+            self.close_connection = True
+            return
+        finally:
+            # Release the cursor's pooled connection even if the client hung up
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+        self.wfile.write(b"0\r\n\r\n")
+
     # Another method! This supports requests with the OPTIONS verb.
     def do_OPTIONS(self):
         """Sets the options headers"""
         self.send_response(200)
+        self._send_connection_header()
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE")
         self.send_header(
             "Access-Control-Allow-Headers", "X-Requested-With, Content-Type, Accept"
         )
+        self.send_header("Content-Length", "0")
         self.end_headers()
 
 
+def _decode_body(post_body):
+    """Decodes a JSON request body read by _read_body()"""
+    if post_body is None:
+        return None
+
+    # Convert JSON string to a Python dictionary
+    try:
+        return loads(post_body)
+    except ValueError:
+        raise HTTPError(400, "The request body is not valid JSON") from None
+
+
+def _query_key(query):
+    """A parse_qs() dictionary as a tuple, the same whatever order the
+    client sent the keys in
+    """
+    return tuple(sorted((key, tuple(values)) for key, values in query.items()))
+
+
+def _validator_headers(etag, last_modified):
+    """The caching headers sent with a validated GET response
+
+    no-cache lets clients keep the response but makes them check it is
+    still current, with If-None-Match, before reusing it.
+    """
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(last_modified, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
+
 # This function is not inside the class. It is the starting
 # point of this application.
 def main():
     """Starts the server on port 8088 using the HandleRequests class"""
-    host = ""
-    port = 8088
-    HTTPServer((host, port), HandleRequests).serve_forever()
+    parser = argparse.ArgumentParser(description="Kennels API server")
+    parser.add_argument("--host", default="", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument(
+        "--mode",
+        choices=SERVER_MODES,
+        default="threaded",
+        help="single: one request at a time, threaded: a bounded worker pool, "
+        "async: an asyncio front end that runs requests on a worker pool",
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=64,
+        help="requests allowed to wait for a worker before getting a 503",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=float,
+        default=HandleRequests.timeout,
+        help="seconds an idle kept-alive connection stays open",
+    )
+    parser.add_argument(
+        "--compress-min-bytes",
+        type=int,
+        default=compression.minimum_size,
+        help="compress response bodies at least this big when the client accepts it",
+    )
+    parser.add_argument(
+        "--json-encoder",
+        choices=JSON_ENCODERS,
+        default="auto",
+        help="auto uses orjson when it is installed and the json module otherwise",
+    )
+    parser.add_argument(
+        "--max-body-bytes",
+        type=int,
+        default=HandleRequests.max_body_bytes,
+        help="request bodies bigger than this get a 413 without being read",
+    )
+    parser.add_argument(
+        "--max-event-streams",
+        type=int,
+        default=None,
+        help="GET /events streams allowed at once, each holds a worker until it closes, "
+        f"so it must be below --workers (default {change_feed.max_streams}, or --workers "
+        "minus 1 if that's fewer, and 0 with --mode single). 0 turns /events off",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="worker processes sharing the port, each running --mode with --workers threads",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=0,
+        help="restart a worker process after about this many requests, 0 to never",
+    )
+    parser.add_argument(
+        "--share-socket",
+        choices=("reuseport", "inherit"),
+        default="reuseport" if reuse_port_supported() else "inherit",
+        help="reuseport: every process binds the port with SO_REUSEPORT, "
+        "inherit: the processes share one socket opened before forking",
+    )
+    parser.add_argument("--database", default=DATABASE_PATH, help="the SQLite database file")
+    parser.add_argument(
+        "--storage",
+        choices=STORAGE_ENGINES,
+        default="sqlite",
+        help="sqlite: read and write the database file, memory: load it into "
+        "memory at startup and save the changes back to it",
+    )
+    parser.add_argument(
+        "--snapshot-interval",
+        type=float,
+        default=0,
+        help="with --storage memory, seconds between saves to the database "
+        "file, 0 to only save on exit",
+    )
+    parser.add_argument(
+        "--no-coalesce",
+        dest="coalesce",
+        action="store_false",
+        help="run the route for every GET, even when an identical one is in flight",
+    )
+    parser.add_argument(
+        "--response-cache-mb",
+        type=float,
+        default=response_cache.cache.max_bytes / (1024 * 1024),
+        help="MiB of encoded GET responses to keep until a table they read changes, 0 to turn it off",
+    )
+    parser.add_argument(
+        "--statement-cache",
+        type=int,
+        default=DEFAULT_CACHED_STATEMENTS,
+        help="prepared statements each database connection keeps for reuse",
+    )
+    parser.add_argument(
+        "--slow-ms",
+        type=float,
+        default=None,
+        help="log requests that take at least this many milliseconds",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    if args.slow_ms is not None:
+        metrics.slow_request_threshold = args.slow_ms / 1000
+    HandleRequests.timeout = args.keep_alive
+    HandleRequests.max_body_bytes = args.max_body_bytes
+    compression.minimum_size = args.compress_min_bytes
+    change_feed.max_streams = _event_stream_limit(parser, args)
+    coalesce.enabled = args.coalesce
+    response_cache.enabled = args.response_cache_mb > 0
+    response_cache.cache.max_bytes = int(args.response_cache_mb * 1024 * 1024)
+    try:
+        use_json_encoder(args.json_encoder)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    if args.share_socket == "reuseport" and not reuse_port_supported():
+        parser.error("SO_REUSEPORT isn't available here, use --share-socket inherit")
+
+    if args.storage == "memory" and args.processes > 1:
+        # Each process would have its own copy of the data
+        parser.error("--storage memory only works with --processes 1")
+
+    try:
+        storage = configure_storage(
+            args.storage,
+            args.database,
+            size=max(5, args.workers),
+            cached_statements=args.statement_cache,
+        )
+    except QueryError as ex:
+        parser.exit(1, f"{parser.prog}: {ex}\n")
+
+    serve = functools.partial(
+        build_server,
+        HandleRequests,
+        mode=args.mode,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        queue_size=args.queue_size,
+    )
+
+    if args.processes <= 1:
+        stop_snapshots = threading.Event()
+        if args.storage == "memory" and args.snapshot_interval > 0:
+            threading.Thread(
+                target=_save_snapshots,
+                args=(storage, args.snapshot_interval, stop_snapshots),
+                name="snapshot",
+                daemon=True,
+            ).start()
+
+        try:
+            serve().serve_forever()
+        finally:
+            # Let the worker threads finish so the process can exit
+            close_event_streams()
+            stop_snapshots.set()
+            if args.storage == "memory":
+                storage.save_snapshot()
+        return
+
+    PreforkServer(
+        lambda sock: serve(sock=sock),
+        (args.host, args.port),
+        processes=args.processes,
+        max_requests=args.max_requests,
+        reuse_port=args.share_socket == "reuseport",
+        on_worker_start=_start_worker,
+        on_worker_stop=close_event_streams,
+    ).serve_forever()
+
+
+def _event_stream_limit(parser, args):
+    """Works out --max-event-streams, which has to leave a worker free for
+    everything else, since each open GET /events stream holds one
+    """
+    # The single server has one worker, which a stream would hold
+    workers = 1 if args.mode == "single" else args.workers
+    limit = args.max_event_streams
+    if limit is None:
+        return min(change_feed.max_streams, workers - 1)
+
+    if limit < 0:
+        parser.error("--max-event-streams can't be negative")
+    if limit >= workers:
+        parser.error(
+            f"--max-event-streams must be below the {workers} worker(s) of --mode {args.mode}, "
+            "or event streams could hold every worker"
+        )
+    return limit
+
+
+def _start_worker():
+    """Runs in each forked worker process before it starts serving"""
+    # The other workers write to the database too, and this process's entity
+    # cache only sees its own writes, so check the table's TableVersion
+    # (migration 2) before trusting a cached row
+    entity_cache.version_source = lambda table: get_storage().table_versions((table,))[table][0]
+
+
+def _save_snapshots(storage, interval, stop):
+    """Saves the memory engine's changes every `interval` seconds until
+    `stop` is set, so a crash loses at most that much
+    """
+    while not stop.wait(interval):
+        try:
+            storage.save_snapshot()
+        except Exception:
+            log.exception("Saving the snapshot failed")
 
 
 if __name__ == "__main__":
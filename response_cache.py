@@ -0,0 +1,239 @@
+import threading
+from collections import OrderedDict
+import compression
+
+
+class CachedResponse():
+    """A cached response's body, and its compressed copies as they're asked for"""
+
+    __slots__ = ("key", "etag", "response", "compressed", "size")
+
+    def __init__(self, key, etag, response):
+        self.key = key
+        self.etag = etag
+        self.response = response
+        # encoding -> the compressed body
+        self.compressed = {}
+        self.size = len(response.body) + sum(
+            len(name) + len(value) for name, value in response.headers.items()
+        )
+
+
+class ResponseCache():
+    """An LRU cache of encoded GET responses, keyed by route and query
+
+    Each entry remembers the ETag it was built under, which comes from the
+    TableVersion counters of every table the route reads (see
+    HandleRequests._validators). Writes bump those counters, so an entry is
+    never invalidated directly: a lookup under a newer ETag finds it stale
+    and misses, and the response built instead replaces it. That works
+    across processes too, since the counters live in the database.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024, max_entry_bytes=8 * 1024 * 1024):
+        """
+        Args:
+            max_entries (number): the most responses kept
+            max_bytes (number): the most bytes kept, compressed copies included
+            max_entry_bytes (number): the biggest body cached. A streamed
+                body is kept as it's sent until it passes this.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+
+        # key -> CachedResponse
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "evictions": 0,
+        }
+
+    def get(self, key, etag):
+        """Returns the CachedResponse for a key, or None unless it was built
+        under this ETag
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            if entry.etag != etag:
+                # A table the route reads has been written to since. It is
+                # left for put() to replace, as a request still holding an
+                # older ETag may be the one asking.
+                self._stats["stale"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key, etag, response):
+        """Caches a 200 response, encoding its body to bytes if it isn't yet
+
+        A streamed response is cached once it has been sent: its stream is
+        wrapped to keep the chunks as they go out, see _CollectingStream.
+
+        Returns:
+            CachedResponse: the new entry, or None if it wasn't cached (yet)
+        """
+        if response.status != 200:
+            return None
+
+        if response.stream is not None:
+            # Copies of the headers, since the caller adds its own
+            response.stream = _CollectingStream(self, key, etag, response.copy())
+            return None
+
+        response.body = response.encode()
+        # A copy, since the caller adds headers to the response it sends
+        return self._store(CachedResponse(key, etag, response.copy()))
+
+    def _finish(self, key, etag, response, chunks):
+        """Caches a streamed response once _CollectingStream has all of it"""
+        with self._lock:
+            existing = self._entries.get(key)
+        # Identical requests sharing one stream (see coalesce.py) each
+        # get here. The first to finish caches it.
+        if existing is not None and existing.etag == etag:
+            return
+
+        response.body = b"".join(chunks)
+        response.stream = None
+        self._store(CachedResponse(key, etag, response))
+
+    def _store(self, entry):
+        if entry.size > self.max_bytes or len(entry.response.body) > self.max_entry_bytes:
+            return None
+
+        key = entry.key
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+
+        return entry
+
+    def compress(self, entry, encoding):
+        """Returns an entry's body compressed, compressing it the first time"""
+        compressed = entry.compressed.get(encoding)
+        if compressed is not None:
+            return compressed
+
+        compressed = compression.compress(encoding, entry.response.body)
+
+        with self._lock:
+            # Only count it if the entry is still cached and nobody beat us to it
+            if encoding not in entry.compressed and self._entries.get(entry.key) is entry:
+                entry.compressed[encoding] = compressed
+                entry.size += len(compressed)
+                self._bytes += len(compressed)
+                self._evict()
+
+        return compressed
+
+    def clear(self):
+        """Empties the cache"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Returns a snapshot of the hit/miss/eviction counters"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["entries"] = len(self._entries)
+            snapshot["bytes"] = self._bytes
+        return snapshot
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+
+class _CollectingStream():
+    """A streamed response's chunks, kept as they are sent so the whole body
+    can be cached if the stream gets to the end no bigger than
+    max_entry_bytes
+
+    A class rather than a generator so that close() always closes the
+    wrapped stream, even if it was never iterated, e.g. because the client
+    hung up before the headers went out. A single-flight leader's stream
+    (see coalesce._Tee) has to be closed to let its followers go.
+    """
+
+    def __init__(self, cache, key, etag, response):
+        self._cache = cache
+        self._key = key
+        self._etag = etag
+        self._response = response
+        self._stream = response.stream
+        self._iterator = iter(response.stream)
+        # None once the body is too big to cache
+        self._chunks = []
+        self._size = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self.close()
+            if self._chunks is not None:
+                self._cache._finish(self._key, self._etag, self._response, self._chunks)
+                self._chunks = None
+            raise
+
+        if self._chunks is not None:
+            self._size += len(chunk)
+            if self._size > self._cache.max_entry_bytes:
+                # Too big to cache, so stop holding on to it
+                self._chunks = None
+            else:
+                self._chunks.append(chunk)
+        return chunk
+
+    def close(self):
+        """Releases the wrapped stream. Safe to call more than once."""
+        if hasattr(self._stream, "close"):
+            self._stream.close()
+
+
+# Whether GET responses are cached at all
+enabled = True
+
+# The cache shared by every request handler thread
+cache = ResponseCache()
+
+
+def response_cache_metrics():
+    """Samples of the response cache's counters, for metrics.add_collector()"""
+    stats = cache.stats()
+    return [
+        ("kennel_response_cache_lookups_total", "counter", "Response cache lookups by result", [
+            ({"result": "hit"}, stats["hits"]),
+            ({"result": "miss"}, stats["misses"]),
+        ]),
+        ("kennel_response_cache_stale_total", "counter", "Lookups that found a response built before a write to a table it reads", [({}, stats["stale"])]),
+        ("kennel_response_cache_evictions_total", "counter", "Responses evicted to stay under the size caps", [({}, stats["evictions"])]),
+        ("kennel_response_cache_entries", "gauge", "Responses currently cached", [({}, stats["entries"])]),
+        ("kennel_response_cache_bytes", "gauge", "Size of the cached bodies, compressed copies included", [({}, stats["bytes"])]),
+    ]
@@ -0,0 +1,264 @@
+from models import dumps, is_whole_number
+
+# Stands in for an integer path segment, like the 1 in /animals/1, in a
+# route's shape
+INT_SEGMENT = ":int"
+
+# The most digits an id SQLite can store has
+MAX_ID_DIGITS = 19
+
+
+class HTTPError(Exception):
+    """Raised by a route (or the router) to answer with an error status
+
+    The client gets {"message": message} as the body, plus an "errors"
+    list when there are details, e.g. one entry per invalid field.
+    """
+
+    def __init__(self, status, message, headers=None, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+        self.errors = errors
+
+    def response(self):
+        body = {"message": self.message}
+        if self.errors is not None:
+            body["errors"] = self.errors
+        return Response(self.status, body, headers=self.headers)
+
+
+class Request():
+    """Everything a route needs to know about the request it is handling"""
+
+    __slots__ = ("method", "path", "params", "query", "body", "headers")
+
+    def __init__(self, method, path, params, query, body=None, headers=None):
+        self.method = method
+        self.path = path
+        # Path parameters, e.g. {"id": 1} for /animals/1
+        self.params = params
+        # The parse_qs() dictionary, so every value is a list
+        self.query = query
+        # The decoded JSON body, or None
+        self.body = body
+        self.headers = headers or {}
+
+
+class Response():
+    """What a route sends back
+
+    Either `body` is set, and is JSON encoded (or sent as is if it is
+    already bytes), or `stream` is an iterable of bytes chunks that gets
+    sent with chunked transfer encoding.
+    """
+
+    __slots__ = ("status", "body", "headers", "stream", "content_type")
+
+    def __init__(self, status=200, body=None, headers=None, stream=None, content_type="application/json"):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.stream = stream
+        self.content_type = content_type
+
+    def copy(self):
+        """A response with the same body but headers of its own, for
+        sending one cached or shared response more than once
+        """
+        return Response(self.status, self.body, dict(self.headers), self.stream, self.content_type)
+
+    def encode(self):
+        """Returns the body as bytes"""
+        if self.body is None:
+            return b""
+        if isinstance(self.body, bytes):
+            return self.body
+        return dumps(self.body).encode()
+
+
+class Route():
+    """One entry in the route table"""
+
+    __slots__ = (
+        "method", "pattern", "handler", "query", "options", "filters", "tables", "param_names", "label"
+    )
+
+    def __init__(self, method, pattern, handler, query, options, filters, tables, param_names):
+        self.method = method
+        self.pattern = pattern
+        self.handler = handler
+        # Query keys that select this route, e.g. ("email",)
+        self.query = query
+        # Query keys the route accepts without them changing the routing,
+        # e.g. ("limit", "after_id")
+        self.options = options
+        # Query keys that select this route in any combination, e.g. the
+        # filters of a collection: ("status", "location_id", ...)
+        self.filters = filters
+        # The database tables the response is built from. A GET route that
+        # names its tables gets an ETag and Last-Modified from their versions.
+        self.tables = tables
+        # (position, name) of each path parameter
+        self.param_names = param_names
+        # Names the route in logs and metrics, e.g. "GET /animals?status"
+        self.label = f"{method} {pattern}"
+        if query:
+            self.label += "?" + "&".join(sorted(query))
+
+
+class Router():
+    """A table of routes keyed by path shape, method and query keys
+
+    Routes are registered with patterns like "/animals/{id}". Integer path
+    segments in a request are replaced by a placeholder to get its shape,
+    e.g. ("animals", ":int"), so matching a request is a few dictionary
+    lookups however many routes there are.
+    """
+
+    def __init__(self):
+        # shape -> method -> frozenset of query keys -> Route
+        self._table = {}
+        # Every option key any route accepts. These are set aside before
+        # looking up a route by its query keys.
+        self._options = set()
+
+    def add(self, method, pattern, handler, query=(), options=(), tables=(), filters=()):
+        """Registers a route
+
+        Args:
+            method (string): the HTTP method, e.g. "GET"
+            pattern (string): the path, with integer parameters in braces,
+                e.g. "/locations/{id}/animals"
+            handler (function): called with a Request, returns a Response
+            query (tuple): query keys the request must have, exactly
+            options (tuple): query keys the request may also have
+            tables (tuple): the tables the route reads
+            filters (tuple): query keys that also select this route, in any
+                combination, when no route has exactly the request's keys
+        """
+        shape = []
+        param_names = []
+        for position, segment in enumerate(part for part in pattern.split("/") if part):
+            if segment.startswith("{") and segment.endswith("}"):
+                shape.append(INT_SEGMENT)
+                param_names.append((position, segment[1:-1]))
+            else:
+                shape.append(segment)
+
+        route = Route(
+            method,
+            pattern,
+            handler,
+            tuple(query),
+            tuple(options),
+            frozenset(filters),
+            tuple(tables),
+            tuple(param_names),
+        )
+        methods = self._table.setdefault(tuple(shape), {})
+        variants = methods.setdefault(method, {})
+
+        key = frozenset(query)
+        if key in variants:
+            raise ValueError(f"{method} {pattern} with query {sorted(query)} is already routed")
+        variants[key] = route
+        self._options.update(options)
+
+    def route(self, method, pattern, query=(), options=(), tables=(), filters=()):
+        """Decorator version of add()"""
+
+        def register(handler):
+            self.add(method, pattern, handler, query, options, tables, filters)
+            return handler
+
+        return register
+
+    def match(self, method, path, query):
+        """Finds the route for a request
+
+        Args:
+            method (string): the request method
+            path (string): the URL path, without the query string
+            query (dict): the parse_qs() dictionary
+
+        Returns:
+            tuple: (Route, path parameters dictionary)
+
+        Raises:
+            HTTPError: 404 for an unknown path, 405 for a known path with
+                the wrong method and 400 for unsupported query keys
+        """
+        segments = [segment for segment in path.split("/") if segment]
+        shape = tuple(INT_SEGMENT if _is_id(segment) else segment for segment in segments)
+
+        methods = self._table.get(shape)
+        if methods is None:
+            raise HTTPError(404, f"No route for {path}")
+
+        variants = methods.get(method)
+        if variants is None:
+            allowed = ", ".join(sorted(methods))
+            raise HTTPError(
+                405, f"{method} is not allowed on {path}", {"Allow": allowed}
+            )
+
+        routing_keys = frozenset(key for key in query if key not in self._options)
+        route = variants.get(routing_keys)
+        if route is None:
+            # Any mix of a route's filters selects it, so those can't all
+            # be table keys. They are checked one route at a time instead.
+            route = next(
+                (
+                    variant
+                    for variant in variants.values()
+                    if variant.filters and routing_keys <= variant.filters
+                ),
+                None,
+            )
+        if route is None:
+            supported = sorted(
+                {key for variant in variants for key in variant}
+                | {key for variant in variants.values() for key in variant.filters}
+            )
+            raise HTTPError(
+                400,
+                f"Unsupported query parameters for {method} {path}. "
+                f"Filter by one of: {', '.join(supported) or 'nothing'}",
+            )
+
+        unknown_options = [
+            key for key in query if key not in routing_keys and key not in route.options
+        ]
+        if unknown_options:
+            raise HTTPError(
+                400, f"{', '.join(sorted(unknown_options))} can't be used with {method} {path}"
+            )
+
+        params = {name: int(segments[position]) for position, name in route.param_names}
+        return (route, params)
+
+    def routes(self):
+        """Returns every registered Route"""
+        return [
+            route
+            for methods in self._table.values()
+            for variants in methods.values()
+            for route in variants.values()
+        ]
+
+
+def _is_id(segment):
+    """Whether a path segment is an integer id, like the 1 in /animals/1
+
+    Only ASCII digits count (str.isdigit() also takes the likes of "²"), and
+    only up to the biggest integer SQLite stores. Anything else can't be a
+    row's id, so its path gets a 404.
+    """
+    return (
+        segment.isascii()
+        and segment.isdigit()
+        and len(segment) <= MAX_ID_DIGITS
+        and is_whole_number(int(segment))
+    )
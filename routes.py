@@ -0,0 +1,416 @@
+import metrics
+from db import get_storage
+from models import ANIMAL_SCHEMA, CUSTOMER_SCHEMA, CUSTOMER_UPDATE_SCHEMA, EMPLOYEE_SCHEMA, LOCATION_SCHEMA
+from models import ValidationError
+from router import HTTPError, Response, Router
+from views import (
+    get_single_animal,
+    iter_all_animals_json,
+    get_animals_page,
+    ANIMAL_FIELDS,
+    create_animal,
+    update_animal,
+    delete_animal,
+    get_animals_by_location,
+    get_animals_by_customer,
+)
+from views import (
+    get_single_customer,
+    iter_all_customers_json,
+    get_customers_page,
+    CUSTOMER_FIELDS,
+    create_customer,
+    update_customer,
+)
+from views import (
+    get_single_employee,
+    iter_all_employees_json,
+    get_employees_page,
+    EMPLOYEE_FIELDS,
+    create_employee,
+    update_employee,
+    delete_employee,
+    get_employees_by_location,
+)
+from views import (
+    get_single_location,
+    iter_all_locations_json,
+    get_locations_page,
+    LOCATION_FIELDS,
+    create_location,
+    update_location,
+    delete_location,
+)
+from views import iter_json_array, PAGE_PARAMS, parse_page_params, uses_keyset
+from views import filter_keys, parse_filters
+from views import parse_expand, expand_relations, foreign_keys
+from views import BulkError, bulk_create, bulk_update, bulk_delete
+from views import SEARCH_OPTIONS, parse_search_params, search
+from views import (
+    MAX_TOP_CUSTOMERS,
+    get_animal_counts_by_location,
+    get_top_customers,
+    get_staffing_by_location,
+)
+from views import EVENT_OPTIONS, EventStream, StreamLimitError, parse_event_params
+from urllib.parse import urlencode
+
+# The view functions behind each resource's standard routes
+RESOURCES = {
+    "animals": {
+        "single": get_single_animal,
+        "stream": iter_all_animals_json,
+        "page": get_animals_page,
+        "fields": ANIMAL_FIELDS,
+        # Animals are listed and expanded with their location and customer
+        "tables": ("Animal", "Location", "Customer"),
+        "schema": ANIMAL_SCHEMA,
+        "update_schema": ANIMAL_SCHEMA,
+        "create": create_animal,
+        "update": update_animal,
+        "delete": delete_animal,
+    },
+    "customers": {
+        "single": get_single_customer,
+        "stream": iter_all_customers_json,
+        "page": get_customers_page,
+        "fields": CUSTOMER_FIELDS,
+        "tables": ("Customer",),
+        "schema": CUSTOMER_SCHEMA,
+        # The password can be left out, since GET never sends it
+        "update_schema": CUSTOMER_UPDATE_SCHEMA,
+        "create": create_customer,
+        "update": update_customer,
+        # Customers can't be deleted
+        "delete": None,
+    },
+    "employees": {
+        "single": get_single_employee,
+        "stream": iter_all_employees_json,
+        "page": get_employees_page,
+        "fields": EMPLOYEE_FIELDS,
+        "tables": ("Employee", "Location"),
+        "schema": EMPLOYEE_SCHEMA,
+        "update_schema": EMPLOYEE_SCHEMA,
+        "create": create_employee,
+        "update": update_employee,
+        "delete": delete_employee,
+    },
+    "locations": {
+        "single": get_single_location,
+        "stream": iter_all_locations_json,
+        "page": get_locations_page,
+        "fields": LOCATION_FIELDS,
+        "tables": ("Location",),
+        "schema": LOCATION_SCHEMA,
+        "update_schema": LOCATION_SCHEMA,
+        "create": create_location,
+        "update": update_location,
+        "delete": delete_location,
+    },
+}
+
+# Options that embed related rows
+EXPAND_OPTIONS = ("_expand",)
+
+ANIMAL_TABLES = RESOURCES["animals"]["tables"]
+EMPLOYEE_TABLES = RESOURCES["employees"]["tables"]
+
+ROUTES = Router()
+
+
+def _client_error(parse, *args):
+    """Calls one of the views' query parsers, turning its ValueError into a 400"""
+    try:
+        return parse(*args)
+    except ValueError as ex:
+        raise HTTPError(400, str(ex)) from None
+
+
+def _require_sql(feature):
+    """Answers 501 when the storage engine can't run the SQL a route is
+    built on, e.g. with --storage memory
+    """
+    if not get_storage().supports_sql:
+        raise HTTPError(501, f"{feature} needs the sqlite storage engine")
+
+
+def _validate(resource, body, schema="schema"):
+    """Checks a JSON object body against the resource's schema, so only
+    complete, well typed rows reach the create and update views
+
+    Args:
+        schema (string): "schema" for creates, "update_schema" for updates
+
+    Returns:
+        dict: the writable columns, with snake_case names
+    """
+    try:
+        return RESOURCES[resource][schema].validate(body)
+    except ValidationError as ex:
+        raise HTTPError(400, f"Invalid {resource[:-1]}", errors=ex.errors) from None
+
+
+def _rows_response(resource, request, rows):
+    """Embeds any ?_expand= relations into a list of rows and sends it"""
+    relations = _client_error(parse_expand, resource, request.query)
+    expand_relations(resource, rows, relations)
+    metrics.record_rows(len(rows))
+    return Response(200, rows)
+
+
+def list_collection(resource, request):
+    """GET /animals: streams every row, or sends one page of them when the
+    query string pages, filters (?status=Kennel&location_id__in=1,2),
+    sorts (?order_by=-name), projects (?fields=) or expands (?_expand=)
+    """
+    if not request.query:
+        rows = metrics.count_rows(RESOURCES[resource]["stream"]())
+        return Response(200, stream=iter_json_array(rows, encoded=True))
+
+    get_page = RESOURCES[resource]["page"]
+    (limit, after_id, offset, fields) = _client_error(
+        parse_page_params, request.query, RESOURCES[resource]["fields"]
+    )
+    (filters, order) = _client_error(parse_filters, resource, request.query)
+    relations = _client_error(parse_expand, resource, request.query)
+
+    # A page is found by id or by position depending on the order, see
+    # fetch_page(). Only the matching cursor makes sense.
+    cursor_param = "after_id" if uses_keyset(order) else "offset"
+    if "offset" in request.query and cursor_param != "offset":
+        raise HTTPError(400, "offset only works with an order_by other than id, use after_id")
+    if "after_id" in request.query and cursor_param != "after_id":
+        raise HTTPError(400, "after_id only works when ordering by id, use offset")
+
+    # Relations are joined on their foreign keys, so fetch those even if
+    # the client projected them away, then drop them again afterwards
+    extra_fields = tuple(key for key in foreign_keys(resource, relations) if key not in fields)
+    (rows, next_cursor) = get_page(limit, after_id, fields + extra_fields, filters, order, offset)
+    expand_relations(resource, rows, relations)
+    for row in rows:
+        for key in extra_fields:
+            del row[key]
+    metrics.record_rows(len(rows))
+
+    headers = {}
+    if next_cursor is not None:
+        # Same filters, order and projection, from the next cursor
+        next_query = dict(request.query)
+        next_query.update(limit=[limit], fields=[",".join(fields)])
+        next_query[cursor_param] = [next_cursor]
+        headers["X-Next-Cursor"] = str(next_cursor)
+        headers["Link"] = f'</{resource}?{urlencode(next_query, doseq=True)}>; rel="next"'
+
+    return Response(200, rows, headers=headers)
+
+
+def get_single(resource, request):
+    """GET /animals/1"""
+    row = RESOURCES[resource]["single"](request.params["id"])
+    if row is None:
+        raise HTTPError(404, f"No {resource} with id {request.params['id']}")
+
+    relations = _client_error(parse_expand, resource, request.query)
+    expand_relations(resource, [row], relations)
+    metrics.record_rows(1)
+    return Response(200, row)
+
+
+def create(resource, request):
+    """POST /animals with an object creates one row, with an array creates
+    every item in it, all or nothing
+    """
+    if isinstance(request.body, list):
+        return _bulk(201, bulk_create, resource, request.body)
+    if not isinstance(request.body, dict):
+        raise HTTPError(400, "The body must be a JSON object or array")
+
+    return Response(201, RESOURCES[resource]["create"](_validate(resource, request.body)))
+
+
+def update_collection(resource, request):
+    """PUT /animals with an array of objects that include their ids"""
+    if not isinstance(request.body, list):
+        raise HTTPError(400, "The body must be a JSON array of objects with ids")
+    return _bulk(204, bulk_update, resource, request.body)
+
+
+def update(resource, request):
+    """PUT /animals/1"""
+    if not isinstance(request.body, dict):
+        raise HTTPError(400, "The body must be a JSON object")
+
+    values = _validate(resource, request.body, "update_schema")
+    if RESOURCES[resource]["update"](request.params["id"], values):
+        return Response(204)
+    raise HTTPError(404, f"No {resource} with id {request.params['id']}")
+
+
+def delete_collection(resource, request):
+    """DELETE /animals with a JSON array of ids"""
+    if not isinstance(request.body, list):
+        raise HTTPError(400, "The body must be a JSON array of ids")
+    return _bulk(204, bulk_delete, resource, request.body)
+
+
+def delete(resource, request):
+    """DELETE /animals/1"""
+    RESOURCES[resource]["delete"](request.params["id"])
+    return Response(204)
+
+
+def delete_not_supported(request):
+    raise HTTPError(405, "Ruh, roh: This function is not supported, sorry!", {"Allow": "GET, PUT"})
+
+
+def _bulk(status, bulk_write, resource, items):
+    """Runs a bulk write, sending a 400 that lists every problem with the
+    items that failed, shaped like _validate()'s plus each item's index
+    """
+    try:
+        result = bulk_write(resource, items)
+    except BulkError as ex:
+        raise HTTPError(400, f"Invalid {resource}: {ex}", errors=ex.errors) from None
+
+    return Response(status, result if status != 204 else None)
+
+
+def _bind(function, resource):
+    """Fixes the resource argument of one of the generic routes above"""
+
+    def handler(request):
+        return function(resource, request)
+
+    handler.__name__ = f"{function.__name__}_{resource}"
+    return handler
+
+
+for resource, views in RESOURCES.items():
+    expand = EXPAND_OPTIONS if resource in ("animals", "employees") else ()
+    tables = views["tables"]
+
+    ROUTES.add(
+        "GET",
+        f"/{resource}",
+        _bind(list_collection, resource),
+        options=PAGE_PARAMS + expand,
+        tables=tables,
+        filters=filter_keys(resource),
+    )
+    ROUTES.add("GET", f"/{resource}/{{id}}", _bind(get_single, resource), options=expand, tables=tables)
+    ROUTES.add("POST", f"/{resource}", _bind(create, resource))
+    ROUTES.add("PUT", f"/{resource}", _bind(update_collection, resource))
+    ROUTES.add("PUT", f"/{resource}/{{id}}", _bind(update, resource))
+
+    if views["delete"] is not None:
+        ROUTES.add("DELETE", f"/{resource}", _bind(delete_collection, resource))
+        ROUTES.add("DELETE", f"/{resource}/{{id}}", _bind(delete, resource))
+    else:
+        ROUTES.add("DELETE", f"/{resource}", delete_not_supported)
+        ROUTES.add("DELETE", f"/{resource}/{{id}}", delete_not_supported)
+
+
+@ROUTES.route("GET", "/locations/{id}/animals", options=EXPAND_OPTIONS, tables=ANIMAL_TABLES)
+def location_animals(request):
+    return _rows_response("animals", request, get_animals_by_location(request.params["id"]))
+
+
+@ROUTES.route("GET", "/locations/{id}/employees", options=EXPAND_OPTIONS, tables=EMPLOYEE_TABLES)
+def location_employees(request):
+    return _rows_response("employees", request, get_employees_by_location(request.params["id"]))
+
+
+@ROUTES.route("GET", "/customers/{id}/animals", options=EXPAND_OPTIONS, tables=ANIMAL_TABLES)
+def customer_animals(request):
+    return _rows_response("animals", request, get_animals_by_customer(request.params["id"]))
+
+
+@ROUTES.route(
+    "GET",
+    "/search",
+    query=("q",),
+    options=SEARCH_OPTIONS,
+    tables=("Animal", "Customer", "Employee"),
+)
+def search_all(request):
+    """GET /search?q=snick finds animals, customers and employees by name,
+    breed, address or email, best matches first
+    """
+    _require_sql("search")
+    (match, resources, limit, offset) = _client_error(parse_search_params, request.query)
+    (results, next_offset) = search(match, resources, limit, offset)
+    metrics.record_rows(len(results))
+
+    headers = {}
+    if next_offset is not None:
+        next_query = {key: values[0] for key, values in request.query.items()}
+        next_query["offset"] = next_offset
+        headers["X-Next-Cursor"] = str(next_offset)
+        headers["Link"] = f'</search?{urlencode(next_query)}>; rel="next"'
+
+    return Response(200, results, headers=headers)
+
+
+def _stats_response(summary):
+    _require_sql("stats")
+    rows = summary()
+    metrics.record_rows(len(rows))
+    return Response(200, rows)
+
+
+@ROUTES.route("GET", "/stats/animals-by-location", tables=("Animal", "Location"))
+def stats_animals_by_location(request):
+    """GET /stats/animals-by-location: animal counts per location and status"""
+    return _stats_response(get_animal_counts_by_location)
+
+
+@ROUTES.route("GET", "/stats/top-customers", options=("limit",), tables=("Animal", "Customer"))
+def stats_top_customers(request):
+    """GET /stats/top-customers?limit=10: the customers with the most animals"""
+    try:
+        limit = int(request.query.get("limit", [10])[0])
+    except ValueError:
+        raise HTTPError(400, "limit must be a whole number") from None
+    if not 1 <= limit <= MAX_TOP_CUSTOMERS:
+        raise HTTPError(400, f"limit must be between 1 and {MAX_TOP_CUSTOMERS}")
+
+    return _stats_response(lambda: get_top_customers(limit))
+
+
+@ROUTES.route("GET", "/stats/staffing", tables=("Animal", "Employee", "Location"))
+def stats_staffing(request):
+    """GET /stats/staffing: animals per employee at each location"""
+    return _stats_response(get_staffing_by_location)
+
+
+@ROUTES.route("GET", "/events", options=EVENT_OPTIONS)
+def events(request):
+    """GET /events: a server-sent events stream of every create, update and
+    delete, so clients can stop polling the collections. ?type=animals
+    narrows it to some resources.
+    """
+    _require_sql("events")
+    (tables, after_id) = _client_error(
+        parse_event_params, request.query, request.headers.get("Last-Event-ID")
+    )
+    try:
+        stream = EventStream(tables, after_id)
+    except StreamLimitError as ex:
+        raise HTTPError(503, str(ex), {"Retry-After": "5"}) from None
+
+    return Response(
+        200,
+        stream=stream,
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@ROUTES.route("GET", "/_metrics")
+def prometheus_metrics(request):
+    return Response(
+        200,
+        metrics.render_prometheus().encode(),
+        content_type="text/plain; version=0.0.4",
+    )
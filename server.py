@@ -0,0 +1,402 @@
+import asyncio
+import io
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+# The concurrency modes main() can start the server in
+SERVER_MODES = ("single", "threaded", "async")
+
+# Sent as-is when the request queue is full. The connection is closed right
+# after, so there is nothing for a keep-alive client to wait on.
+OVERLOADED_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: 44\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b'{"message": "Server busy, try again later."}'
+)
+
+# The keep_alive_slots of a server that closes every connection after one
+# response, because a kept-alive connection would hold its only worker
+NO_KEEP_ALIVE = threading.Semaphore(0)
+
+# Largest request head (request line plus headers) the async front end reads
+MAX_REQUEST_HEAD = 64 * 1024
+
+# Seconds the async front end keeps an idle kept-alive connection open when
+# the handler class doesn't set its own `timeout`
+DEFAULT_KEEP_ALIVE = 5
+
+# Seconds a stopping async server waits for connections it had already
+# accepted to be handed to it, see AsyncHTTPServer._serve()
+ACCEPT_GRACE = 0.05
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """An HTTPServer that hands each connection to a bounded pool of workers.
+
+    At most `workers` requests run at once and at most `queue_size` more wait
+    for a free worker. Anything past that is turned away with a 503 instead
+    of piling up unbounded threads.
+
+    A kept-alive connection holds its worker while it sits idle between
+    requests, so only half the workers' connections are kept alive. The
+    rest are closed after each response, leaving workers free for others.
+    """
+
+    def __init__(self, server_address, handler_class, workers=8, queue_size=64, bind_and_activate=True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.workers = workers
+        self.queue_size = queue_size
+        # Taken by a connection for as long as it is kept alive, see
+        # HandleRequests.handle()
+        self.keep_alive_slots = threading.BoundedSemaphore(workers // 2) if workers > 1 else NO_KEEP_ALIVE
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="kennel-worker"
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self._reject(request)
+            return
+
+        self._executor.submit(self._process_in_worker, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+    def _process_in_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def _reject(self, request):
+        try:
+            request.sendall(OVERLOADED_RESPONSE)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+
+class _LoopWriter(io.RawIOBase):
+    """A file-like wfile that writes to an asyncio stream from a worker thread.
+
+    Each write waits for the event loop to drain the transport, so a slow
+    client applies back pressure to the handler instead of buffering the
+    whole response in memory.
+    """
+
+    def __init__(self, loop, writer):
+        super().__init__()
+        self._loop = loop
+        self._writer = writer
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        asyncio.run_coroutine_threadsafe(self._write(data), self._loop).result()
+        return len(data)
+
+    async def _write(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+
+class AsyncHTTPServer():
+    """An asyncio front end that runs the request handler on an executor.
+
+    The event loop accepts connections and reads each request off the socket,
+    so slow or idle clients never tie up a worker. Only once a full request
+    has arrived is it handed, with the unchanged handler class, to the thread
+    pool where the blocking view functions run.
+    """
+
+    def __init__(self, server_address, handler_class, workers=8, sock=None):
+        self.server_address = server_address
+        self.server_name = server_address[0] or socket.gethostname()
+        self.server_port = server_address[1]
+        self.workers = workers
+        self.socket = sock
+        self._handler_class = _buffered_handler(handler_class)
+        self.keep_alive = getattr(handler_class, "timeout", None) or DEFAULT_KEEP_ALIVE
+        # Bigger bodies are answered without being read, see _read_request()
+        self.max_body_bytes = getattr(handler_class, "max_body_bytes", None)
+        self._executor = None
+        self._loop = None
+        self._stopped = None
+        # The _handle_connection() tasks still running
+        self._connections = set()
+
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    def shutdown(self):
+        """Stops accepting connections. serve_forever() returns once the
+        requests already handed to workers have finished. Safe to call
+        from any thread.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    def server_close(self):
+        if self.socket is not None:
+            self.socket.close()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="kennel-worker"
+        )
+        if self.socket is not None:
+            # Closing the asyncio server closes the socket it was given, so
+            # give it a copy and keep this one to drain, see _drain()
+            server = await asyncio.start_server(
+                self._handle_connection, sock=self.socket.dup(), limit=MAX_REQUEST_HEAD
+            )
+        else:
+            host, port = self.server_address
+            server = await asyncio.start_server(
+                self._handle_connection, host or None, port, limit=MAX_REQUEST_HEAD
+            )
+
+        async with server:
+            await self._stopped.wait()
+
+            # Stop accepting, then let the requests already running on the
+            # workers finish. They write through this loop, so wait for
+            # them from another thread.
+            server.close()
+            # A connection asyncio has just accepted takes a few turns of
+            # the loop to reach _handle_connection(), let those get there
+            await asyncio.sleep(ACCEPT_GRACE)
+            # A socket shared with other processes keeps its queue when
+            # this one stops, so the others answer what is waiting there
+            if self.socket is not None and _has_own_queue(self.socket):
+                await self._drain()
+            # Connections already accepted answer the request they are
+            # reading, then close. Idle ones time out after keep_alive.
+            if self._connections:
+                await asyncio.wait(self._connections)
+            await self._loop.run_in_executor(None, self._executor.shutdown, True)
+
+    async def _drain(self):
+        """Answers the connections still queued on the listening socket
+
+        A SO_REUSEPORT socket (see listening_socket()) has a queue of its
+        own, and closing it resets the connections waiting there instead of
+        passing them to another process, so they are served here first.
+        Only called for those, see _has_own_queue().
+        """
+        self.socket.setblocking(False)
+        while True:
+            connections = []
+            while True:
+                try:
+                    (conn, _) = self.socket.accept()
+                except (BlockingIOError, InterruptedError):
+                    break
+                (reader, writer) = await asyncio.open_connection(sock=conn, limit=MAX_REQUEST_HEAD)
+                connections.append(self._handle_connection(reader, writer))
+            if not connections:
+                break
+            # More may have queued up while these were answered
+            await asyncio.gather(*connections)
+
+        self.socket.close()
+
+    async def _handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        client_address = writer.get_extra_info("peername")
+        wfile = _LoopWriter(loop, writer)
+        task = asyncio.current_task()
+        self._connections.add(task)
+
+        try:
+            while True:
+                try:
+                    read = await asyncio.wait_for(
+                        _read_request(reader, self.max_body_bytes), self.keep_alive
+                    )
+                except asyncio.TimeoutError:
+                    # Idle (or far too slow) client, let the connection go
+                    break
+                if read is None:
+                    break
+                (raw_request, body_read) = read
+
+                close_connection = await loop.run_in_executor(
+                    self._executor,
+                    self._handler_class,
+                    io.BytesIO(raw_request),
+                    wfile,
+                    client_address,
+                    self,
+                )
+                # An unread body is still on the connection, where it would
+                # be taken for the next request
+                if close_connection or not body_read or self._stopped.is_set():
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+
+async def _read_request(reader, max_body_bytes=None):
+    """Reads one complete request (head and body) off an asyncio stream
+
+    The body is only read when its Content-Length is a whole number no
+    bigger than `max_body_bytes`. Otherwise just the head is returned and
+    the handler answers it with the same 400, 411 or 413 the threaded
+    servers send, having never buffered the body.
+
+    Args:
+        reader (StreamReader): the connection to read from
+        max_body_bytes (number): the biggest body to read, None for any size
+
+    Returns:
+        tuple: (the raw request, whether its body was read), or None if
+            the client closed the connection
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as ex:
+        if not ex.partial:
+            return None
+        raise
+
+    content_length = None
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"transfer-encoding":
+            # Chunked bodies aren't supported, the handler answers 411
+            return (head, False)
+        if name == b"content-length" and content_length is None:
+            # Only the first one counts, as in the handler's headers.get()
+            content_length = value.strip()
+
+    if content_length is None:
+        return (head, True)
+    if not content_length.isdigit():
+        return (head, False)
+
+    content_length = int(content_length)
+    if max_body_bytes is not None and content_length > max_body_bytes:
+        return (head, False)
+
+    body = await reader.readexactly(content_length) if content_length else b""
+    return (head + body, True)
+
+
+def _buffered_handler(handler_class):
+    """Wraps a BaseHTTPRequestHandler subclass so it can handle one request
+    that has already been read into memory, keeping all of its routing.
+    """
+
+    def handle(rfile, wfile, client_address, server):
+        handler = handler_class.__new__(handler_class)
+        handler.request = None
+        handler.client_address = client_address
+        handler.server = server
+        handler.rfile = rfile
+        handler.wfile = wfile
+        handler.close_connection = True
+        handler.handle_one_request()
+        return handler.close_connection
+
+    return handle
+
+
+def _has_own_queue(sock):
+    """Whether sock was opened with SO_REUSEPORT, so the connections queued
+    on it are this process's alone
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        return False
+    return bool(sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT))
+
+
+def listening_socket(host="", port=8088, reuse_port=False):
+    """Opens a TCP socket listening on host:port
+
+    Args:
+        host (string): the interface to listen on, "" for all of them
+        port (number): the port to listen on
+        reuse_port (bool): set SO_REUSEPORT, so several processes can each
+            listen on the same port and the kernel spreads connections
+            between them
+
+    Returns:
+        socket: the listening socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(HTTPServer.request_queue_size)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def build_server(handler_class, mode="threaded", host="", port=8088, workers=8, queue_size=64, sock=None):
+    """Builds a server for the given concurrency mode
+
+    Args:
+        handler_class (class): the BaseHTTPRequestHandler that routes requests
+        mode (string): one of SERVER_MODES
+        host (string): the interface to listen on, "" for all of them
+        port (number): the port to listen on
+        workers (number): worker threads for the threaded and async modes
+        queue_size (number): requests allowed to wait for a threaded worker
+        sock (socket): an already listening socket to serve instead of
+            binding host:port, e.g. one from listening_socket()
+
+    Returns:
+        object: a server with serve_forever(), shutdown() and server_close()
+    """
+    address = (host, port)
+
+    if mode == "async":
+        return AsyncHTTPServer(address, handler_class, workers, sock)
+
+    if mode == "single":
+        server = HTTPServer(address, handler_class, bind_and_activate=sock is None)
+        # One idle client would keep everyone else waiting
+        server.keep_alive_slots = NO_KEEP_ALIVE
+    elif mode == "threaded":
+        server = ThreadPoolHTTPServer(
+            address, handler_class, workers, queue_size, bind_and_activate=sock is None
+        )
+    else:
+        raise ValueError(f"Unknown server mode {mode!r}, expected one of {SERVER_MODES}")
+
+    if sock is not None:
+        # Serve the given socket in place of the unbound one the
+        # constructor made, filling in what server_bind() would have
+        server.socket.close()
+        server.socket = sock
+        server.server_address = sock.getsockname()
+        server.server_name = socket.getfqdn(server.server_address[0])
+        server.server_port = server.server_address[1]
+
+    return server
@@ -1,12 +1,23 @@
 from .animal_requests import (
     get_all_animals,
+    iter_all_animals,
+    iter_all_animals_json,
+    get_animals_page,
+    ANIMAL_FIELDS,
     get_single_animal,
     create_animal,
     delete_animal,
     update_animal,
+    get_animals_by_location,
+    get_animals_by_status,
+    get_animals_by_customer,
 )
 from .location_requests import (
     get_all_locations,
+    iter_all_locations,
+    iter_all_locations_json,
+    get_locations_page,
+    LOCATION_FIELDS,
     get_single_location,
     create_location,
     delete_location,
@@ -14,15 +25,45 @@ from .location_requests import (
 )
 from .customer_requests import (
     get_all_customers,
+    iter_all_customers,
+    iter_all_customers_json,
+    get_customers_page,
+    CUSTOMER_FIELDS,
     get_single_customer,
     create_customer,
     delete_customer,
     update_customer,
+    get_customers_by_email,
 )
 from .employee_requests import (
     get_all_employees,
+    iter_all_employees,
+    iter_all_employees_json,
+    get_employees_page,
+    EMPLOYEE_FIELDS,
     get_single_employee,
     create_employee,
     delete_employee,
     update_employee,
+    get_employees_by_location,
+)
+from .stats_requests import (
+    MAX_TOP_CUSTOMERS,
+    get_animal_counts_by_location,
+    get_top_customers,
+    get_staffing_by_location,
+)
+from .json_stream import iter_json_array
+from .pagination import PAGE_PARAMS, parse_page_params, uses_keyset
+from .filters import FILTERABLE, ORDER_PARAM, filter_keys, parse_filters
+from .expand import parse_expand, expand_relations, foreign_keys
+from .search import SEARCH_INDEXES, SEARCH_OPTIONS, parse_search_params, search
+from .bulk import BULK_RESOURCES, BulkError, bulk_create, bulk_update, bulk_delete
+from .change_feed import (
+    EVENT_OPTIONS,
+    EventStream,
+    StreamLimitError,
+    parse_event_params,
+    close_event_streams,
+    event_metrics,
 )
@@ -1,301 +1,188 @@
-from .location_requests import get_single_location
-from .customer_requests import get_single_customer
-import sqlite3
-import json
+from contextlib import closing
+from db import get_storage, cached_entity, entity_cache, register_scan
+from .pagination import fetch_page
 from models import Animal
-from models import Location
-from models import Customer
+from models import RowSerializer
+
+
+# Columns a client can ask for with ?fields= on the animals list
+ANIMAL_FIELDS = ("id", "name", "status", "breed", "customer_id", "location_id")
+
+# The animal columns _iter_all_animals() reads, then the location and
+# customer columns joined to each animal
+ANIMAL_COLUMNS = ("id", "name", "status", "breed", "location_id", "customer_id")
+ANIMAL_JOINS = (
+    ("location_id", "Location", ("name", "address")),
+    ("customer_id", "Customer", ("name", "address", "email")),
+)
+register_scan("Animal", ANIMAL_COLUMNS, ANIMAL_JOINS)
+
+# How those columns are laid out in each animal, with its location and
+# customer nested inside it
+ANIMAL_ROW = RowSerializer(
+    ANIMAL_COLUMNS
+    + (
+        "location_name",
+        "location_address",
+        "customer_name",
+        "customer_address",
+        "customer_email",
+    ),
+    (
+        "id",
+        "name",
+        "status",
+        "breed",
+        "customer_id",
+        "location_id",
+        ("location", (("id", "location_id"), ("name", "location_name"), ("address", "location_address"))),
+        (
+            "customer",
+            (
+                ("id", "customer_id"),
+                ("name", "customer_name"),
+                ("address", "customer_address"),
+                ("email", "customer_email"),
+            ),
+        ),
+    ),
+)
 
 
 def get_all_animals():
-    # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute(
-            """
-        SELECT
-            a.id,
-            a.name,
-            a.status,
-            a.breed,
-            a.location_id,
-            a.customer_id,
-            l.name location_name,
-            l.address location_address,
-	        c.name customer_name,
-	        c.address customer_address,
-	        c.email customer_email
-        FROM Animal a
-        JOIN Location l
-            ON l.id = a.location_id
-        JOIN Customer c 
-	        ON c.id = a.customer_id
-        """
-        )
-
-        # Initialize an empty list to hold all animal representations
-        animals = []
-
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
-
-        # Iterate list of data returned from database
-        for row in dataset:
-
-            # Create an animal instance from the current row
-            animal = Animal(
-                row["id"],
-                row["name"],
-                row["status"],
-                row["breed"],
-                row["customer_id"],
-                row["location_id"],
-            )
-
-            # Create a Location instance from the current row
-            location = Location(
-                row["id"], row["location_name"], row["location_address"]
-            )
-
-            customer = Customer(
-                row["id"],
-                row["customer_name"],
-                row["customer_address"],
-                row["customer_email"],
-            )
-
-            # Add the dictionary representation of the location to the animal
-            animal.location = location.__dict__
-            animal.customer = customer.__dict__
-
-            # Add the dictionary representation of the animal to the list
-            animals.append(animal.__dict__)
-
-    return json.dumps(animals)
+    """Returns every animal as a JSON string"""
+    return "[" + ",".join(iter_all_animals_json()) + "]"
+
+
+def iter_all_animals():
+    """Yields every animal as a dictionary, one cursor row at a time"""
+    return _iter_all_animals(ANIMAL_ROW.to_dict)
+
+
+def iter_all_animals_json():
+    """Yields every animal as a JSON object string, one cursor row at a time.
+    No model or dictionary is built for the rows, which makes this the
+    fast path for streaming the whole collection.
+    """
+    return _iter_all_animals(ANIMAL_ROW.encode)
+
+
+def _iter_all_animals(convert):
+    """Reads every animal with its location and customer, and yields
+    convert(row) for each row tuple
+    """
+    with closing(get_storage().scan("Animal", ANIMAL_COLUMNS, ANIMAL_JOINS)) as rows:
+        for row in rows:
+            yield convert(row)
 
 
 # Function with a single parameter
+@cached_entity("Animal")
 def get_single_animal(id):
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Use a ? parameter to inject a variable's value
-        # into the SQL statement.
-        db_cursor.execute(
-            """
-        SELECT
-            a.id,
-            a.name,
-            a.status,
-            a.breed,
-            a.customer_id,
-            a.location_id
-        FROM Animal a
-        WHERE a.id = ?
-        """,
-            (id,),
-            # This will be done in chapter 7 of book 2.
-            #     """
-            # SELECT
-            #     l.name,
-            # FROM location l
-            # WHERE l.id = ?
-            # """,
-            #     (id,),
-            #     """
-            # SELECT
-            #     c.name,
-            # FROM customer c
-            # WHERE c.id = ?
-            # """,
-            #     (id,),
-        )
-
-        # Load the single result into memory
-        data = db_cursor.fetchone()
-
-        # Create an animal instance from the current row
-        animal = Animal(
-            data["id"],
-            data["name"],
-            data["status"],
-            data["breed"],
-            data["customer_id"],
-            data["location_id"],
-            # This will be done in chapter 7 of book 2.
-            # matching_location = get_single_location(animal["location_id"])
-            # animal["location"] = matching_location
-            # matching_customer = get_single_customer(animal["customer_id"])
-            # animal["customer"] = matching_customer
-            # data.pop("location_Id", None)
-            # data.pop("customer_Id", None)
-        )
-
-        return animal.__dict__
+    data = get_storage().get("Animal", id, ANIMAL_FIELDS)
+
+    # No row with that id
+    if data is None:
+        return None
+
+    # Create an animal instance from the current row
+    animal = _animal(data)
+
+    # The location and customer are embedded with ?_expand=, which
+    # looks them up in one batched query per relation (see expand.py)
+
+    return animal.to_dict()
 
 
 def create_animal(new_animal):
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
-
-        db_cursor.execute(
-            """
-        INSERT INTO Animal
-            ( name, status, breed, customer_id, location_id )
-        VALUES
-            ( ?, ?, ?, ?, ?);
-        """,
-            (
-                new_animal["name"],
-                new_animal["status"],
-                new_animal["breed"],
-                new_animal["customer_id"],
-                new_animal["location_id"],
-            )
-        )
-
-        # The `lastrowid` property on the cursor will return
-        # the primary key of the last thing that got added to
-        # the database.
-        id = db_cursor.lastrowid
-
-        # Add the `id` property to the animal dictionary that
-        # was sent by the client so that the client sees the
-        # primary key in the response.
-        new_animal["id"] = id
+    # The storage hands back the primary key of the new row
+    id = get_storage().insert(
+        "Animal",
+        {
+            "name": new_animal["name"],
+            "status": new_animal["status"],
+            "breed": new_animal["breed"],
+            "customer_id": new_animal["customer_id"],
+            "location_id": new_animal["location_id"],
+        },
+    )
+
+    # Add the `id` property to the animal dictionary that
+    # was sent by the client so that the client sees the
+    # primary key in the response.
+    new_animal["id"] = id
+
+    entity_cache.invalidate("Animal", id)
 
     return new_animal
 
 
 def delete_animal(id):
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
+    get_storage().delete("Animal", id)
 
-        db_cursor.execute(
-            """
-        DELETE FROM Animal
-        WHERE id = ?
-        """,
-            (id,),
-        )
+    entity_cache.invalidate("Animal", id)
 
 
 def update_animal(id, new_animal):
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
-
-        db_cursor.execute(
-            """
-        UPDATE Animal
-            SET
-                name = ?,
-                status = ?,
-                breed = ?,
-                customer_id = ?,
-                location_id = ?
-        WHERE id = ?
-        """,
-            (
-                new_animal["name"],
-                new_animal["status"],
-                new_animal["breed"],
-                new_animal["customerId"],
-                new_animal["locationId"],
-                id,
-            ),
-        )
+    # False when the client sent an `id` that doesn't exist
+    found = get_storage().update(
+        "Animal",
+        id,
+        {
+            "name": new_animal["name"],
+            "status": new_animal["status"],
+            "breed": new_animal["breed"],
+            "customer_id": new_animal["customer_id"],
+            "location_id": new_animal["location_id"],
+        },
+    )
 
-        # Were any rows affected?
-        # Did the client send an `id` that exists?
-        rows_affected = db_cursor.rowcount
+    entity_cache.invalidate("Animal", id)
 
-    if rows_affected == 0:
-        # Forces 404 response by main module
-        return False
-    else:
-        # Forces 204 response by main module
-        return True
+    # False forces a 404 response by the routes, True a 204
+    return found
 
 
 def get_animals_by_location(location):
+    rows = get_storage().find("Animal", "location_id", location, ANIMAL_FIELDS)
+    return [_animal(row).to_dict() for row in rows]
 
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute(
-            """
-        SELECT
-            a.id,
-            a.name,
-            a.status,
-            a.breed,
-            a.customer_id,
-            a.location_id
-        FROM Animal a
-        WHERE a.location_id = ?
-        """,
-            (location,),
-        )
-
-        animals = []
-        dataset = db_cursor.fetchall()
-
-        for row in dataset:
-            animal = Animal(
-                row["id"],
-                row["name"],
-                row["status"],
-                row["breed"],
-                row["customer_id"],
-                row["location_id"],
-            )
-            animals.append(animal.__dict__)
-
-    return animals
 
+def get_animals_by_customer(customer):
+    rows = get_storage().find("Animal", "customer_id", customer, ANIMAL_FIELDS)
+    return [_animal(row).to_dict() for row in rows]
 
-def get_animals_by_status(status):
 
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute(
-            """
-        SELECT
-            a.id,
-            a.name,
-            a.status,
-            a.breed,
-            a.customer_id,
-            a.location_id
-        FROM Animal a
-        WHERE status = ?
-        """,
-            (status,),
-        )
-
-        animals = []
-        dataset = db_cursor.fetchall()
-
-        for row in dataset:
-            animal = Animal(
-                row["id"],
-                row["name"],
-                row["status"],
-                row["breed"],
-                row["customer_id"],
-                row["location_id"],
-            )
-            animals.append(animal.__dict__)
-
-    return animals
+def get_animals_by_status(status):
+    rows = get_storage().find("Animal", "status", status, ANIMAL_FIELDS)
+    return [_animal(row).to_dict() for row in rows]
+
+
+def _animal(row):
+    """Creates an animal instance from a row dictionary"""
+    return Animal(
+        row["id"],
+        row["name"],
+        row["status"],
+        row["breed"],
+        row["customer_id"],
+        row["location_id"],
+    )
+
+
+def get_animals_page(limit, after_id=0, fields=ANIMAL_FIELDS, filters=(), order=(), offset=0):
+    """Returns one page of animals and the cursor for the next page
+
+    Args:
+        limit (number): how many animals to return
+        after_id (number): the id the previous page ended on
+        fields (tuple): which of ANIMAL_FIELDS to include
+        filters (tuple): (field, operator, value) from parse_filters()
+        order (tuple): (field, descending) pairs from parse_filters()
+        offset (number): how many rows earlier pages held, when not
+            sorted by id
+
+    Returns:
+        tuple: (list of animal dictionaries, next after_id (or offset) or None)
+    """
+    return fetch_page("Animal", fields, limit, after_id, filters, order, offset)
@@ -0,0 +1,155 @@
+from db import get_storage, entity_cache
+from models import ANIMAL_SCHEMA, CUSTOMER_SCHEMA, CUSTOMER_UPDATE_SCHEMA, EMPLOYEE_SCHEMA, LOCATION_SCHEMA
+from models import ValidationError, is_whole_number
+
+# The table, the schemas of its writable columns for creates and updates,
+# and the write-only columns that are never sent back, behind each
+# resource that takes bulk writes
+BULK_RESOURCES = {
+    "animals": ("Animal", ANIMAL_SCHEMA, ANIMAL_SCHEMA, ()),
+    "customers": ("Customer", CUSTOMER_SCHEMA, CUSTOMER_UPDATE_SCHEMA, ("password",)),
+    "employees": ("Employee", EMPLOYEE_SCHEMA, EMPLOYEE_SCHEMA, ()),
+    "locations": ("Location", LOCATION_SCHEMA, LOCATION_SCHEMA, ()),
+}
+
+
+class BulkError(Exception):
+    """Raised when any item in a bulk request is invalid. Nothing is written.
+
+    Attributes:
+        errors (list): one {"index": n, "field": name, "message": "..."} per
+            problem, the same as ValidationError's plus the item's index.
+            Problems with a whole item, like it not being an object, have
+            no "field".
+    """
+
+    def __init__(self, errors):
+        failed = len({error["index"] for error in errors})
+        super().__init__(f"{failed} item(s) failed")
+        self.errors = errors
+
+
+def bulk_create(resource, items):
+    """Inserts every item in one transaction
+
+    Args:
+        resource (string): a key of BULK_RESOURCES
+        items (list): dictionaries holding every writable column
+
+    Returns:
+        list: each item's writable columns but the write-only ones, with
+        its new `id` added
+
+    Raises:
+        BulkError: if any item is invalid. Nothing is written.
+    """
+    (table, schema, _, write_only) = BULK_RESOURCES[resource]
+    rows = _validate_items(items, schema, False)
+
+    ids = get_storage().insert_many(table, schema.fields, [tuple(row.values()) for row in rows])
+
+    for row, id in zip(rows, ids):
+        row["id"] = id
+        for column in write_only:
+            del row[column]
+        entity_cache.invalidate(table, id)
+
+    return rows
+
+
+def bulk_update(resource, items):
+    """Updates every item, matched on its `id`, in one transaction
+
+    Raises:
+        BulkError: if an item is invalid or its id doesn't exist. The whole
+            batch is rolled back.
+    """
+    (table, _, schema, _) = BULK_RESOURCES[resource]
+    rows = _validate_items(items, schema, True)
+    ids = [row.pop("id") for row in rows]
+
+    # Optional columns an item leaves out keep their stored values
+    missing = get_storage().update_many(table, list(zip(ids, rows)))
+    _raise_for_missing(ids, missing)
+
+    for id in ids:
+        entity_cache.invalidate(table, id)
+
+    return len(items)
+
+
+def bulk_delete(resource, ids):
+    """Deletes every id in one transaction
+
+    Raises:
+        BulkError: if an id isn't a whole number or doesn't exist. Nothing
+            is deleted.
+    """
+    (table, _, _, _) = BULK_RESOURCES[resource]
+    _raise_for_errors(
+        [
+            None if is_whole_number(id) else {"index": index, "message": "must be a whole number id"}
+            for index, id in enumerate(ids)
+        ]
+    )
+
+    _raise_for_missing(ids, get_storage().delete_many(table, ids))
+
+    for id in ids:
+        entity_cache.invalidate(table, id)
+
+    return len(ids)
+
+
+def _validate_items(items, schema, needs_id):
+    """Checks every item against a schema
+
+    Returns:
+        list: each item's writable columns from Schema.validate(), with
+        its `id` too when needs_id is set
+
+    Raises:
+        BulkError: with an error for each bad item
+    """
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({"index": index, "message": "must be a JSON object"})
+            continue
+
+        problems = []
+        try:
+            row = schema.validate(item)
+        except ValidationError as ex:
+            problems = ex.errors
+        if needs_id and not is_whole_number(item.get("id")):
+            problems = problems + [{"field": "id", "message": "id must be a whole number"}]
+
+        if problems:
+            errors.extend({"index": index, **problem} for problem in problems)
+            continue
+
+        if needs_id:
+            row["id"] = item["id"]
+        rows.append(row)
+
+    _raise_for_errors(errors)
+    return rows
+
+
+def _raise_for_errors(errors):
+    errors = [error for error in errors if error is not None]
+    if errors:
+        raise BulkError(errors)
+
+
+def _raise_for_missing(ids, missing):
+    """Raises BulkError naming every id the storage couldn't find"""
+    missing = set(missing)
+    _raise_for_errors(
+        [
+            {"index": index, "field": "id", "message": f"id {id} not found"} if id in missing else None
+            for index, id in enumerate(ids)
+        ]
+    )
@@ -0,0 +1,267 @@
+import threading
+import time
+from db import get_connection, execute, register_query
+from models import is_whole_number
+
+# Query string keys GET /events accepts
+EVENT_OPTIONS = ("type", "last_event_id")
+
+# The resource each table in the ChangeLog (migration 5) is served as
+EVENT_RESOURCES = {
+    "Animal": "animals",
+    "Customer": "customers",
+    "Employee": "employees",
+    "Location": "locations",
+}
+
+# Seconds between an open stream's checks for new changes
+poll_interval = 0.5
+
+# Seconds without changes before a stream sends a comment line. It keeps
+# proxies from closing the connection and notices clients that went away.
+heartbeat_interval = 15
+
+# Seconds a stream stays open. EventSource reconnects by itself and resumes
+# with Last-Event-ID, so ending streams now and then costs nothing and
+# gives their worker threads back.
+max_stream_seconds = 300
+
+# How many streams can be open at once. Each one holds a worker thread for
+# as long as it is open, so this has to stay below the worker count, which
+# main() makes sure of. 0 turns GET /events off.
+max_streams = 4
+
+# Milliseconds EventSource waits before reconnecting
+RETRY_MS = 1000
+
+# Most changes read from the ChangeLog per query
+BATCH_SIZE = 500
+
+_lock = threading.Lock()
+_open_streams = 0
+_events_sent = 0
+# Set when the server is stopping, so open streams end instead of keeping it
+# waiting for them
+_closing = threading.Event()
+
+
+class StreamLimitError(Exception):
+    """Raised when max_streams streams are already open"""
+
+
+def parse_event_params(query, last_event_id=None):
+    """Reads ?type= and where to resume from
+
+    Args:
+        query (dict): the parse_qs() dictionary
+        last_event_id (string): the Last-Event-ID header, if any. EventSource
+            sends it when it reconnects. ?last_event_id= does the same for
+            the first connection, which can't set headers.
+
+    Returns:
+        tuple: (tables to send changes of, the id to send changes after or
+        None for only changes from now on)
+
+    Raises:
+        ValueError: with a message for the client if a parameter is invalid
+    """
+    tables = tuple(EVENT_RESOURCES)
+    if "type" in query:
+        resources = [
+            resource.strip()
+            for value in query["type"]
+            for resource in value.split(",")
+            if resource.strip()
+        ]
+        by_resource = {resource: table for table, resource in EVENT_RESOURCES.items()}
+        if not resources or any(resource not in by_resource for resource in resources):
+            raise ValueError(f"type must be a comma separated list of {', '.join(by_resource)}")
+        tables = tuple(by_resource[resource] for resource in resources)
+
+    if last_event_id is None and "last_event_id" in query:
+        last_event_id = query["last_event_id"][0]
+
+    after_id = None
+    if last_event_id is not None and last_event_id.strip():
+        try:
+            after_id = int(last_event_id)
+        except ValueError:
+            raise ValueError("Last-Event-ID must be a whole number") from None
+        if not is_whole_number(after_id):
+            raise ValueError("Last-Event-ID must be a whole number")
+
+    return (tables, after_id)
+
+
+# The change log queries, kept in the query catalog (see db/queries.py)
+CHANGE_LOG_BOUNDS = register_query("events.bounds", "SELECT MIN(id), MAX(id) FROM ChangeLog")
+
+CHANGES_AFTER = register_query(
+    "events.changes",
+    """
+    SELECT
+        c.id,
+        c.entity,
+        c.entity_id,
+        c.action,
+        c.data,
+        c.changed_at
+    FROM ChangeLog c
+    WHERE c.id > ?
+    ORDER BY c.id
+    LIMIT ?
+    """,
+)
+
+
+def get_change_log_bounds():
+    """Returns the (oldest, newest) ChangeLog ids, both None when it's empty"""
+    with get_connection() as conn:
+        db_cursor = conn.cursor()
+        execute(db_cursor, CHANGE_LOG_BOUNDS)
+        return db_cursor.fetchone()
+
+
+def get_changes(after_id, limit=BATCH_SIZE):
+    """Returns the changes logged after an id, oldest first
+
+    Args:
+        after_id (number): the last change already seen
+        limit (number): the most changes to return
+
+    Returns:
+        list: (id, entity, entity_id, action, data, changed_at) tuples, where
+        data is the changed row as a JSON string
+    """
+    with get_connection() as conn:
+        db_cursor = conn.cursor()
+        execute(db_cursor, CHANGES_AFTER, (after_id, limit))
+        return db_cursor.fetchall()
+
+
+class EventStream():
+    """The body of a GET /events response, as server-sent events
+
+    Each change is sent as a message whose id is its ChangeLog id:
+
+        id: 42
+        data: {"type": "animals", "action": "update", "id": 2, ...}
+
+    A stream resuming from changes that have already been trimmed off the
+    ChangeLog gets a "reset" event instead, telling the client to reload
+    what it shows, and carries on from the newest change.
+    """
+
+    def __init__(self, tables, after_id=None):
+        """
+        Args:
+            tables (tuple): the tables to send changes of
+            after_id (number): the last change the client saw, or None for
+                only changes from now on
+
+        Raises:
+            StreamLimitError: if max_streams streams are already open
+        """
+        global _open_streams
+
+        with _lock:
+            if max_streams == 0:
+                raise StreamLimitError("Event streams are turned off on this server")
+            if _open_streams >= max_streams:
+                raise StreamLimitError(f"{max_streams} event streams are already open")
+            _open_streams += 1
+
+        self._released = False
+        self._events = self._generate(frozenset(tables), after_id)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._events)
+
+    def close(self):
+        """Ends the stream and frees its place. Safe to call more than once."""
+        global _open_streams
+
+        self._events.close()
+        with _lock:
+            if not self._released:
+                self._released = True
+                _open_streams -= 1
+
+    def _generate(self, tables, after_id):
+        yield f"retry: {RETRY_MS}\n\n".encode()
+
+        (oldest, newest) = get_change_log_bounds()
+        if after_id is None:
+            after_id = newest or 0
+        elif oldest is not None and after_id < oldest - 1:
+            yield _message(newest, "reset", f'{{"oldest_event_id": {oldest}}}')
+            after_id = newest
+
+        started = time.monotonic()
+        last_sent = started
+        while not _closing.is_set() and time.monotonic() - started < max_stream_seconds:
+            changes = get_changes(after_id)
+            if changes:
+                # Move past every change read, even ones of other tables, so
+                # they aren't read again
+                after_id = changes[-1][0]
+                messages = [
+                    _change_message(change) for change in changes if change[1] in tables
+                ]
+                if messages:
+                    _count_events(len(messages))
+                    last_sent = time.monotonic()
+                    yield b"".join(messages)
+                if len(changes) == BATCH_SIZE:
+                    # There may be more waiting, don't sleep
+                    continue
+
+            if time.monotonic() - last_sent >= heartbeat_interval:
+                last_sent = time.monotonic()
+                yield b": keep-alive\n\n"
+
+            _closing.wait(poll_interval)
+
+
+def _change_message(change):
+    (id, entity, entity_id, action, data, changed_at) = change
+    # data is JSON already, so splice it in rather than decoding it
+    return _message(
+        id,
+        None,
+        f'{{"type": "{EVENT_RESOURCES[entity]}", "action": "{action}", '
+        f'"id": {entity_id}, "changed_at": {changed_at}, "data": {data}}}',
+    )
+
+
+def _message(id, event, data):
+    """Formats one server-sent event. data must be a single line."""
+    lines = [] if id is None else [f"id: {id}"]
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {data}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+def _count_events(count):
+    global _events_sent
+
+    with _lock:
+        _events_sent += count
+
+
+def close_event_streams():
+    """Ends every open stream within poll_interval, for a stopping server"""
+    _closing.set()
+
+
+def event_metrics():
+    """Samples of the open streams and events sent, for metrics.add_collector()"""
+    with _lock:
+        return [
+            ("kennel_event_streams", "gauge", "Open GET /events streams", [({}, _open_streams)]),
+            ("kennel_events_sent_total", "counter", "Change events sent to GET /events streams", [({}, _events_sent)]),
+        ]
@@ -1,159 +1,131 @@
-import sqlite3
-import json
+from contextlib import closing
+from db import get_storage, cached_entity, entity_cache, register_scan, register_update
+from .pagination import fetch_page
 from models import Customer
+from models import RowSerializer
 
 
-def get_all_customers():
-    # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
+# The columns any customer response holds, and the ones a client can ask
+# for with ?fields=. The password column is write-only: it is stored but
+# deliberately left out here so it is never read back out.
+CUSTOMER_FIELDS = ("id", "name", "address", "email")
+register_scan("Customer", CUSTOMER_FIELDS)
+# An update without a password keeps the stored one
+register_update("Customer", ("name", "address", "email"))
+
+# How the columns _iter_all_customers() selects are laid out in each customer
+CUSTOMER_ROW = RowSerializer(CUSTOMER_FIELDS, CUSTOMER_FIELDS)
 
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
 
-        # Write the SQL query to get the information you want
-        db_cursor.execute(
-            """
-        SELECT
-            c.id,
-            c.name,
-            c.address,
-            c.email,
-            c.password
-        FROM Customer c
-        """
-        )
+def get_all_customers():
+    """Returns every customer as a JSON string"""
+    return "[" + ",".join(iter_all_customers_json()) + "]"
 
-        # Initialize an empty list to hold all customer representations
-        customers = []
 
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
+def iter_all_customers():
+    """Yields every customer as a dictionary, one cursor row at a time"""
+    return _iter_all_customers(CUSTOMER_ROW.to_dict)
 
-        # Iterate list of data returned from database
-        for row in dataset:
 
-            # Create a customer instance from the current row.
-            # Note that the database fields are specified in
-            # exact order of the parameters defined in the
-            # Customer class above.
-            customer = Customer(
-                row["id"], row["name"], row["address"], row["email"], row["password"]
-            )
+def iter_all_customers_json():
+    """Yields every customer as a JSON object string, one cursor row at a time"""
+    return _iter_all_customers(CUSTOMER_ROW.encode)
 
-            customers.append(customer.__dict__)
 
-    return json.dumps(customers)
+def _iter_all_customers(convert):
+    """Reads every customer and yields convert(row) for each row tuple"""
+    with closing(get_storage().scan("Customer", CUSTOMER_FIELDS)) as rows:
+        for row in rows:
+            yield convert(row)
 
 
 # Function with a single parameter
+@cached_entity("Customer")
 def get_single_customer(id):
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Use a ? parameter to inject a variable's value
-        # into the SQL statement.
-        db_cursor.execute(
-            """
-        SELECT
-            c.id,
-            c.name,
-            c.address,
-            c.email,
-            c.password
-        FROM Customer c
-        WHERE c.id = ?
-        """,
-            (id,),
-        )
-
-        # Load the single result into memory
-        data = db_cursor.fetchone()
-
-        # Create an customer instance from the current row
-        customer = Customer(
-            data["id"],
-            data["name"],
-            data["address"],
-            data["email"],
-            data["password"],
-        )
-
-        return customer.__dict__
-
-
-def create_customer(customer):
-    # Get the id value of the last customer in the list
-    max_id = CUSTOMERS[-1]["id"]
-
-    # Add 1 to whatever that number is
-    new_id = max_id + 1
-
-    # Add an `id` property to the customer dictionary
-    customer["id"] = new_id
-
-    # Add the customer dictionary to the list
-    CUSTOMERS.append(customer)
-
-    # Return the dictionary with `id` property added
-    return customer
+    data = get_storage().get("Customer", id, CUSTOMER_FIELDS)
 
+    # No row with that id
+    if data is None:
+        return None
 
-def delete_customer(id):
-    # Initial -1 value for customer index, in case one isn't found
-    customer_index = -1
+    # Create an customer instance from the current row
+    customer = _customer(data)
+
+    return customer.to_dict()
+
+
+def create_customer(new_customer):
+    # The storage hands back the primary key of the new row
+    id = get_storage().insert(
+        "Customer",
+        {
+            "name": new_customer["name"],
+            "address": new_customer["address"],
+            "email": new_customer["email"],
+            "password": new_customer["password"],
+        },
+    )
+
+    # Add the `id` property to the customer dictionary that
+    # was sent by the client so that the client sees the
+    # primary key in the response. The password isn't sent back.
+    new_customer["id"] = id
+    del new_customer["password"]
+
+    entity_cache.invalidate("Customer", id)
+
+    return new_customer
 
-    # Iterate the CUSTOMERS list, but use enumerate() so that you
-    # can access the index value of each item
-    for index, customer in enumerate(CUSTOMERS):
-        if customer["id"] == id:
-            # Found the customer. Store the current index.
-            customer_index = index
 
-    # If the customer was found, use pop(int) to remove it from list
-    if customer_index >= 0:
-        CUSTOMERS.pop(customer_index)
+def delete_customer(id):
+    get_storage().delete("Customer", id)
+
+    entity_cache.invalidate("Customer", id)
 
 
 def update_customer(id, new_customer):
-    # Iterate the CUSTOMERS list, but use enumerate() so that
-    # you can access the index value of each item.
-    for index, customer in enumerate(CUSTOMERS):
-        if customer["id"] == id:
-            # Found the customer. Update the value.
-            CUSTOMERS[index] = new_customer
-            break
+    values = {
+        "name": new_customer["name"],
+        "address": new_customer["address"],
+        "email": new_customer["email"],
+    }
+    # The password is optional here, since GET never sends it back. Left
+    # out, the stored one is kept.
+    if "password" in new_customer:
+        values["password"] = new_customer["password"]
+
+    # False when the client sent an `id` that doesn't exist
+    found = get_storage().update("Customer", id, values)
+
+    entity_cache.invalidate("Customer", id)
+
+    # False forces a 404 response by the routes, True a 204
+    return found
 
 
 def get_customers_by_email(email):
+    rows = get_storage().find("Customer", "email", email, CUSTOMER_FIELDS)
+    return [_customer(row).to_dict() for row in rows]
+
+
+def _customer(row):
+    """Creates a customer instance from a row dictionary"""
+    return Customer(row["id"], row["name"], row["address"], row["email"])
+
+
+def get_customers_page(limit, after_id=0, fields=CUSTOMER_FIELDS, filters=(), order=(), offset=0):
+    """Returns one page of customers and the cursor for the next page
+
+    Args:
+        limit (number): how many customers to return
+        after_id (number): the id the previous page ended on
+        fields (tuple): which of CUSTOMER_FIELDS to include
+        filters (tuple): (field, operator, value) from parse_filters()
+        order (tuple): (field, descending) pairs from parse_filters()
+        offset (number): how many rows earlier pages held, when not
+            sorted by id
 
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute(
-            """
-        SELECT
-            c.id,
-            c.name,
-            c.address,
-            c.email,
-            c.password
-        FROM Customer c
-        WHERE c.email = ?
-        """,
-            (email,),
-        )
-
-        customers = []
-        dataset = db_cursor.fetchall()
-
-        for row in dataset:
-            customer = Customer(
-                row["id"], row["name"], row["address"], row["email"], row["password"]
-            )
-            customers.append(customer.__dict__)
-
-    return customers
+    Returns:
+        tuple: (list of customer dictionaries, next after_id (or offset) or None)
+    """
+    return fetch_page("Customer", fields, limit, after_id, filters, order, offset)
@@ -1,171 +1,138 @@
-from .location_requests import get_single_location
-import sqlite3
-import json
+from contextlib import closing
+from db import get_storage, cached_entity, entity_cache, register_scan
+from .pagination import fetch_page
 from models import Employee
-from models import Location
+from models import RowSerializer
+
+
+# Columns a client can ask for with ?fields= on the employees list
+EMPLOYEE_FIELDS = ("id", "name", "address", "location_id")
+
+# The location each employee works at, read along with them
+EMPLOYEE_JOINS = (("location_id", "Location", ("name", "address")),)
+register_scan("Employee", EMPLOYEE_FIELDS, EMPLOYEE_JOINS)
+
+# How the columns _iter_all_employees() selects are laid out in each
+# employee, with their location nested inside
+EMPLOYEE_ROW = RowSerializer(
+    ("id", "name", "address", "location_id", "location_name", "location_address"),
+    (
+        "id",
+        "name",
+        "address",
+        "location_id",
+        ("location", (("id", "location_id"), ("name", "location_name"), ("address", "location_address"))),
+    ),
+)
 
 
 def get_all_employees():
-    # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute(
-            """
-        SELECT
-            e.id,
-            e.name,
-            e.address,
-            e.location_id,
-            l.name location_name,
-            l.address location_address
-        FROM Employee e
-        JOIN Location l
-            ON l.id = e.location_id
-        """
-        )
-
-        # Initialize an empty list to hold all employee representations
-        employees = []
-
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
-
-        # Iterate list of data returned from database
-        for row in dataset:
-
-            # Create an employee instance from the current row.
-            # Note that the database fields are specified in
-            # exact order of the parameters defined in the
-            # Employee class above.
-            employee = Employee(
-                row["id"], row["name"], row["address"], row["location_id"]
-            )
-
-            # Create a Location instance from the current row
-            location = Location(
-                row["id"], row["location_name"], row["location_address"]
-            )
-
-            employee.location = location.__dict__
-           
-            employees.append(employee.__dict__)
-
-    return json.dumps(employees)
+    """Returns every employee as a JSON string"""
+    return "[" + ",".join(iter_all_employees_json()) + "]"
 
 
-# Function with a single parameter
-def get_single_employee(id):
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
+def iter_all_employees():
+    """Yields every employee as a dictionary, one cursor row at a time"""
+    return _iter_all_employees(EMPLOYEE_ROW.to_dict)
 
-        # Use a ? parameter to inject a variable's value
-        # into the SQL statement.
-        db_cursor.execute(
-            """
-        SELECT
-            e.id,
-            e.name,
-            e.address,
-            e.location_id
-        FROM Employee e
-        WHERE e.id = ?
-        """,
-            (id,),
-        )
 
-        # Load the single result into memory
-        data = db_cursor.fetchone()
+def iter_all_employees_json():
+    """Yields every employee as a JSON object string, one cursor row at a time"""
+    return _iter_all_employees(EMPLOYEE_ROW.encode)
 
-        # Create an customer instance from the current row
-        employee = Employee(
-            data["id"],
-            data["name"],
-            data["address"],
-            data["location_id"],
-        )
 
-        return employee.__dict__
+def _iter_all_employees(convert):
+    """Reads every employee with their location, and yields convert(row)
+    for each row tuple
+    """
+    with closing(get_storage().scan("Employee", EMPLOYEE_FIELDS, EMPLOYEE_JOINS)) as rows:
+        for row in rows:
+            yield convert(row)
 
 
-def create_employee(employee):
-    # Get the id value of the last employee in the list
-    max_id = EMPLOYEES[-1]["id"]
+# Function with a single parameter
+@cached_entity("Employee")
+def get_single_employee(id):
+    data = get_storage().get("Employee", id, EMPLOYEE_FIELDS)
 
-    # Add 1 to whatever that number is
-    new_id = max_id + 1
+    # No row with that id
+    if data is None:
+        return None
 
-    # Add an `id` property to the employee dictionary
-    employee["id"] = new_id
+    # Create an employee instance from the current row
+    employee = _employee(data)
 
-    # Add the employee dictionary to the list
-    EMPLOYEES.append(employee)
+    return employee.to_dict()
 
-    # Return the dictionary with `id` property added
-    return employee
 
+def create_employee(new_employee):
+    # The storage hands back the primary key of the new row
+    id = get_storage().insert(
+        "Employee",
+        {
+            "name": new_employee["name"],
+            "address": new_employee["address"],
+            "location_id": new_employee["location_id"],
+        },
+    )
 
-def delete_employee(id):
-    # Initial -1 value for employee index, in case one isn't found
-    employee_index = -1
+    # Add the `id` property to the employee dictionary that
+    # was sent by the client so that the client sees the
+    # primary key in the response.
+    new_employee["id"] = id
+
+    entity_cache.invalidate("Employee", id)
 
-    # Iterate the EMPLOYEES list, but use enumerate() so that you
-    # can access the index value of each item
-    for index, employee in enumerate(EMPLOYEES):
-        if employee["id"] == id:
-            # Found the employee. Store the current index.
-            employee_index = index
+    return new_employee
 
-    # If the employee was found, use pop(int) to remove it from list
-    if employee_index >= 0:
-        EMPLOYEES.pop(employee_index)
+
+def delete_employee(id):
+    get_storage().delete("Employee", id)
+
+    entity_cache.invalidate("Employee", id)
 
 
 def update_employee(id, new_employee):
-    # Iterate the EMPLOYEES list, but use enumerate() so that
-    # you can access the index value of each item.
-    for index, employee in enumerate(EMPLOYEES):
-        if employee["id"] == id:
-            # Found the customer. Update the value.
-            EMPLOYEES[index] = new_employee
-            break
+    # False when the client sent an `id` that doesn't exist
+    found = get_storage().update(
+        "Employee",
+        id,
+        {
+            "name": new_employee["name"],
+            "address": new_employee["address"],
+            "location_id": new_employee["location_id"],
+        },
+    )
+
+    entity_cache.invalidate("Employee", id)
+
+    # False forces a 404 response by the routes, True a 204
+    return found
 
 
 def get_employees_by_location(location):
+    rows = get_storage().find("Employee", "location_id", location, EMPLOYEE_FIELDS)
+    return [_employee(row).to_dict() for row in rows]
+
+
+def _employee(row):
+    """Creates an employee instance from a row dictionary"""
+    return Employee(row["id"], row["name"], row["address"], row["location_id"])
+
+
+def get_employees_page(limit, after_id=0, fields=EMPLOYEE_FIELDS, filters=(), order=(), offset=0):
+    """Returns one page of employees and the cursor for the next page
+
+    Args:
+        limit (number): how many employees to return
+        after_id (number): the id the previous page ended on
+        fields (tuple): which of EMPLOYEE_FIELDS to include
+        filters (tuple): (field, operator, value) from parse_filters()
+        order (tuple): (field, descending) pairs from parse_filters()
+        offset (number): how many rows earlier pages held, when not
+            sorted by id
 
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        # Write the SQL query to get the information you want
-        db_cursor.execute(
-            """
-        SELECT
-            e.id,
-            e.name,
-            e.address,
-            e.location_id
-        FROM Employee e
-        WHERE e.location_id = ?
-        """,
-            (location,),
-        )
-
-        employees = []
-        dataset = db_cursor.fetchall()
-
-        for row in dataset:
-            employee = Employee(
-                row["id"],
-                row["name"],
-                row["address"],
-                row["location_id"],
-            )
-            employees.append(employee.__dict__)
-
-    return employees
+    Returns:
+        tuple: (list of employee dictionaries, next after_id (or offset) or None)
+    """
+    return fetch_page("Employee", fields, limit, after_id, filters, order, offset)
@@ -0,0 +1,77 @@
+from db import get_storage
+from .customer_requests import CUSTOMER_FIELDS
+from .location_requests import LOCATION_FIELDS
+
+# The relations each resource can embed with ?_expand=. Each relation maps to
+# (foreign key column, related table, columns to embed).
+RELATIONS = {
+    "animals": {
+        "location": ("location_id", "Location", LOCATION_FIELDS),
+        "customer": ("customer_id", "Customer", CUSTOMER_FIELDS),
+    },
+    "employees": {
+        "location": ("location_id", "Location", LOCATION_FIELDS),
+    },
+}
+
+
+def parse_expand(resource, query):
+    """Reads ?_expand=location,customer out of a parse_qs() dictionary
+
+    Returns:
+        tuple: the relation names to embed, empty if none were asked for
+
+    Raises:
+        ValueError: with a message for the client if a relation is unknown
+    """
+    relations = tuple(
+        relation.strip()
+        for value in query.get("_expand", [])
+        for relation in value.split(",")
+        if relation.strip()
+    )
+
+    allowed = RELATIONS.get(resource, {})
+    unknown = [relation for relation in relations if relation not in allowed]
+    if unknown:
+        if not allowed:
+            raise ValueError(f"{resource} has no relations to expand")
+        raise ValueError(f"_expand must be a comma separated list of {', '.join(allowed)}")
+
+    return relations
+
+
+def foreign_keys(resource, relations):
+    """Returns the columns rows need to have for expand_relations() to work"""
+    return tuple(RELATIONS[resource][relation][0] for relation in relations)
+
+
+def expand_relations(resource, rows, relations):
+    """Embeds related rows into each row, in place
+
+    Each relation costs one get_many() lookup for the whole list, however
+    many rows there are, instead of one lookup per row.
+
+    Args:
+        resource (string): a key of RELATIONS, e.g. "animals"
+        rows (list): row dictionaries that include the relations' foreign keys
+        relations (tuple): relation names from parse_expand()
+
+    Returns:
+        list: the same rows
+    """
+    for relation in relations:
+        (foreign_key, table, columns) = RELATIONS[resource][relation]
+
+        ids = list({row[foreign_key] for row in rows if row[foreign_key] is not None})
+        related = fetch_by_ids(table, columns, ids)
+
+        for row in rows:
+            row[relation] = related.get(row[foreign_key])
+
+    return rows
+
+
+def fetch_by_ids(table, columns, ids):
+    """Returns {id: row dictionary} for every id that exists in the table"""
+    return get_storage().get_many(table, ids, columns)
@@ -0,0 +1,108 @@
+from models import is_whole_number
+
+# Comparisons a filter key can end in, e.g. ?location_id__in=1,2. A key
+# without one of these suffixes is an equality test. Each storage engine
+# knows how to apply them (see db/sqlite_storage.py for the SQL).
+FILTER_OPERATORS = ("eq", "in", "lt", "gt")
+
+# The query key that sorts a collection, e.g. ?order_by=-status,name
+ORDER_PARAM = "order_by"
+
+# The columns each resource can be filtered and sorted on, and the type
+# their values are converted to. Anything not listed here (like a
+# customer's password) can't be filtered on.
+FILTERABLE = {
+    "animals": {
+        "id": int,
+        "name": str,
+        "status": str,
+        "breed": str,
+        "customer_id": int,
+        "location_id": int,
+    },
+    "customers": {"id": int, "name": str, "address": str, "email": str},
+    "employees": {"id": int, "name": str, "address": str, "location_id": int},
+    "locations": {"id": int, "name": str, "address": str},
+}
+
+
+def filter_keys(resource):
+    """Every query key that filters a resource, for the router
+
+    Returns:
+        tuple: e.g. ("name", "name__in", "name__lt", "name__gt", ...)
+    """
+    return tuple(
+        field if operator == "eq" else f"{field}__{operator}"
+        for field in FILTERABLE[resource]
+        for operator in FILTER_OPERATORS
+    )
+
+
+def parse_filters(resource, query):
+    """Reads the filter and ?order_by= keys out of a parse_qs() dictionary
+
+    Args:
+        resource (string): a key of FILTERABLE
+        query (dict): the parsed query string. Keys that aren't filters,
+            like ?limit=, are skipped.
+
+    Returns:
+        tuple: (filters, order) where filters is a tuple of
+        (field, operator, value) sorted by field and operator, and order is
+        a tuple of (field, descending)
+
+    Raises:
+        ValueError: with a message for the client if a value is invalid
+    """
+    fields = FILTERABLE[resource]
+    filters = []
+
+    for key, values in query.items():
+        (field, _, operator) = key.partition("__")
+        operator = operator or "eq"
+        if field not in fields or operator not in FILTER_OPERATORS:
+            continue
+
+        kind = fields[field]
+        try:
+            if operator == "in":
+                value = [
+                    _convert(kind, item.strip())
+                    for value in values
+                    for item in value.split(",")
+                    if item.strip()
+                ]
+            else:
+                value = _convert(kind, values[0])
+        except ValueError:
+            raise ValueError(f"{key} must be a whole number") from None
+
+        filters.append((field, operator, value))
+
+    order = []
+    for value in query.get(ORDER_PARAM, []):
+        for item in value.split(","):
+            item = item.strip()
+            field = item.lstrip("-")
+            if field not in fields:
+                raise ValueError(
+                    f"{ORDER_PARAM} must be a comma separated list of {', '.join(fields)}, "
+                    "each optionally starting with - to sort descending"
+                )
+            order.append((field, item.startswith("-")))
+
+    return (tuple(sorted(filters, key=lambda item: item[:2])), tuple(order))
+
+
+def _convert(kind, text):
+    """Converts a filter value to its column's type
+
+    Raises:
+        ValueError: if it isn't a whole number, for an int column, or is
+            too big for SQLite to compare against
+    """
+    value = kind(text)
+    if kind is int and not is_whole_number(value):
+        raise ValueError(text)
+    return value
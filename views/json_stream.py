@@ -0,0 +1,43 @@
+from models import dumps
+
+# Rows are buffered into chunks of about this many bytes before being handed
+# to the socket, so a big collection isn't sent as thousands of tiny writes
+CHUNK_SIZE = 16 * 1024
+
+
+def iter_json_array(items, chunk_size=CHUNK_SIZE, encoded=False):
+    """Encodes an iterable as a JSON array a few rows at a time
+
+    Args:
+        items (iterable): the JSON-serializable rows, e.g. from iter_all_animals()
+        chunk_size (number): roughly how many bytes to buffer per chunk
+        encoded (bool): whether the rows are already JSON strings, e.g.
+            from iter_all_animals_json()
+
+    Yields:
+        bytes: consecutive pieces of the array. Joined together they are the
+        array of all the items.
+    """
+    buffer = ["["]
+    buffered = 1
+    separator = ""
+
+    try:
+        for item in items:
+            piece = separator + (item if encoded else dumps(item))
+            separator = ","
+            buffer.append(piece)
+            buffered += len(piece)
+
+            if buffered >= chunk_size:
+                yield "".join(buffer).encode()
+                buffer = []
+                buffered = 0
+    finally:
+        # If the client goes away mid-stream, close the row generator right
+        # away so its database connection goes back to the pool
+        if hasattr(items, "close"):
+            items.close()
+
+    buffer.append("]")
+    yield "".join(buffer).encode()
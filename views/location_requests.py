@@ -1,114 +1,111 @@
-import sqlite3
-import json
+from contextlib import closing
+from db import get_storage, cached_entity, entity_cache, register_scan
+from .pagination import fetch_page
 from models import Location
+from models import RowSerializer
 
 
-def get_all_locations():
-    # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
+# Columns a client can ask for with ?fields= on the locations list
+LOCATION_FIELDS = ("id", "name", "address")
+register_scan("Location", LOCATION_FIELDS)
+
+# How the columns _iter_all_locations() selects are laid out in each location
+LOCATION_ROW = RowSerializer(LOCATION_FIELDS, LOCATION_FIELDS)
 
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
 
-        # Write the SQL query to get the information you want
-        db_cursor.execute(
-            """
-        SELECT
-            l.id,
-            l.name,
-            l.address
-        FROM Location l
-        """
-        )
+def get_all_locations():
+    """Returns every location as a JSON string"""
+    return "[" + ",".join(iter_all_locations_json()) + "]"
 
-        # Initialize an empty list to hold all location representations
-        locations = []
 
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
+def iter_all_locations():
+    """Yields every location as a dictionary, one cursor row at a time"""
+    return _iter_all_locations(LOCATION_ROW.to_dict)
 
-        # Iterate list of data returned from database
-        for row in dataset:
 
-            # Create an location instance from the current row.
-            # Note that the database fields are specified in
-            # exact order of the parameters defined in the
-            # Location class above.
-            location = Location(row["id"], row["name"], row["address"])
+def iter_all_locations_json():
+    """Yields every location as a JSON object string, one cursor row at a time"""
+    return _iter_all_locations(LOCATION_ROW.encode)
 
-            locations.append(location.__dict__)
 
-    return json.dumps(locations)
+def _iter_all_locations(convert):
+    """Reads every location and yields convert(row) for each row tuple"""
+    with closing(get_storage().scan("Location", LOCATION_FIELDS)) as rows:
+        for row in rows:
+            yield convert(row)
 
 
 # Function with a single parameter
+@cached_entity("Location")
 def get_single_location(id):
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
+    data = get_storage().get("Location", id, LOCATION_FIELDS)
 
-        # Use a ? parameter to inject a variable's value
-        # into the SQL statement.
-        db_cursor.execute(
-            """
-        SELECT
-            l.id,
-            l.name,
-            l.address
-        FROM Location l
-        WHERE l.id = ?
-        """,
-            (id,),
-        )
+    # No row with that id
+    if data is None:
+        return None
 
-        # Load the single result into memory
-        data = db_cursor.fetchone()
+    # Create a location instance from the current row
+    location = Location(data["id"], data["name"], data["address"])
 
-        # Create an customer instance from the current row
-        location = Location(data["id"], data["name"], data["address"])
+    return location.to_dict()
 
-        return location.__dict__
 
+def create_location(new_location):
+    # The storage hands back the primary key of the new row
+    id = get_storage().insert(
+        "Location",
+        {
+            "name": new_location["name"],
+            "address": new_location["address"],
+        },
+    )
 
-def create_location(location):
-    # Get the id value of the last location in the list
-    max_id = LOCATIONS[-1]["id"]
+    # Add the `id` property to the location dictionary that
+    # was sent by the client so that the client sees the
+    # primary key in the response.
+    new_location["id"] = id
 
-    # Add 1 to whatever that number is
-    new_id = max_id + 1
+    entity_cache.invalidate("Location", id)
 
-    # Add an `id` property to the location dictionary
-    location["id"] = new_id
-
-    # Add the location dictionary to the list
-    LOCATIONS.append(location)
-
-    # Return the dictionary with `id` property added
-    return location
+    return new_location
 
 
 def delete_location(id):
-    # Initial -1 value for location index, in case one isn't found
-    location_index = -1
-
-    # Iterate the LOCATIONS list, but use enumerate() so that you
-    # can access the index value of each item
-    for index, location in enumerate(LOCATIONS):
-        if location["id"] == id:
-            # Found the location. Store the current index.
-            location_index = index
+    get_storage().delete("Location", id)
 
-    # If the location was found, use pop(int) to remove it from list
-    if location_index >= 0:
-        LOCATIONS.pop(location_index)
+    entity_cache.invalidate("Location", id)
 
 
 def update_location(id, new_location):
-    # Iterate the LOCATIONS list, but use enumerate() so that
-    # you can access the index value of each item.
-    for index, location in enumerate(LOCATIONS):
-        if location["id"] == id:
-            # Found the location. Update the value.
-            LOCATIONS[index] = new_location
-            break
+    # False when the client sent an `id` that doesn't exist
+    found = get_storage().update(
+        "Location",
+        id,
+        {
+            "name": new_location["name"],
+            "address": new_location["address"],
+        },
+    )
+
+    entity_cache.invalidate("Location", id)
+
+    # False forces a 404 response by the routes, True a 204
+    return found
+
+
+def get_locations_page(limit, after_id=0, fields=LOCATION_FIELDS, filters=(), order=(), offset=0):
+    """Returns one page of locations and the cursor for the next page
+
+    Args:
+        limit (number): how many locations to return
+        after_id (number): the id the previous page ended on
+        fields (tuple): which of LOCATION_FIELDS to include
+        filters (tuple): (field, operator, value) from parse_filters()
+        order (tuple): (field, descending) pairs from parse_filters()
+        offset (number): how many rows earlier pages held, when not
+            sorted by id
+
+    Returns:
+        tuple: (list of location dictionaries, next after_id (or offset) or None)
+    """
+    return fetch_page("Location", fields, limit, after_id, filters, order, offset)
@@ -0,0 +1,95 @@
+from db import get_storage, uses_keyset
+from models import MAX_INTEGER, is_whole_number
+from .filters import ORDER_PARAM
+
+# Query string keys that switch a collection GET over to paged results
+PAGE_PARAMS = ("limit", "after_id", "offset", "fields", ORDER_PARAM)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def parse_page_params(query, allowed_fields):
+    """Reads ?limit=, ?after_id=, ?offset= and ?fields= out of a parse_qs()
+    dictionary
+
+    Args:
+        query (dict): the parsed query string
+        allowed_fields (tuple): the columns a client may ask for
+
+    Returns:
+        tuple: (limit, after_id, offset, fields)
+
+    Raises:
+        ValueError: with a message for the client if a parameter is invalid
+    """
+    try:
+        limit = int(query.get("limit", [DEFAULT_PAGE_SIZE])[0])
+        after_id = int(query.get("after_id", [0])[0])
+        offset = int(query.get("offset", [0])[0])
+    except ValueError:
+        raise ValueError("limit, after_id and offset must be whole numbers") from None
+
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if after_id < 0 or offset < 0:
+        raise ValueError("after_id and offset can't be negative")
+    # SQLite can't compare against or skip past more than this
+    if not (is_whole_number(after_id) and is_whole_number(offset)):
+        raise ValueError(f"after_id and offset can't be over {MAX_INTEGER}")
+
+    fields = allowed_fields
+    if "fields" in query:
+        fields = tuple(
+            field.strip()
+            for value in query["fields"]
+            for field in value.split(",")
+            if field.strip()
+        )
+        unknown = [field for field in fields if field not in allowed_fields]
+        if unknown or not fields:
+            raise ValueError(
+                f"fields must be a comma separated list of {', '.join(allowed_fields)}"
+            )
+
+    return (limit, after_id, offset, fields)
+
+
+def fetch_page(table, fields, limit, after_id=0, filters=(), order=(), offset=0):
+    """Fetches one page of a table, filtered and sorted
+
+    Sorted by id, the page is found with a keyset cursor. Seeking past an
+    id (`WHERE id > ?` in SQLite) goes straight to the first row of the
+    page, so page 1000 costs the same as page 1. An offset has to step over
+    every row before it, so it is only used for other orders, where there
+    is no single column to seek on.
+
+    Args:
+        table (string): the table to read
+        fields (tuple): the columns to select, already checked by
+            parse_page_params()
+        limit (number): the page size
+        after_id (number): the last id of the previous page, 0 for the first
+        filters (tuple): (field, operator, value) from parse_filters()
+        order (tuple): (field, descending) pairs from parse_filters()
+        offset (number): rows to skip when not sorted by id alone
+
+    Returns:
+        tuple: (rows, next_cursor) where rows is a list of dictionaries and
+        next_cursor is the after_id (or offset) for the next page, or None
+        on the last page
+    """
+    # The cursor needs each row's id even if the client didn't ask for it
+    columns = fields if "id" in fields else ("id",) + tuple(fields)
+
+    # Ask for one row more than the page holds to learn if there is a next page
+    dataset = get_storage().page(table, columns, limit + 1, after_id, filters, order, offset)
+
+    next_cursor = None
+    if len(dataset) > limit:
+        dataset = dataset[:limit]
+        next_cursor = dataset[-1]["id"] if uses_keyset(order) else offset + limit
+
+    rows = [{field: row[field] for field in fields} for row in dataset]
+
+    return (rows, next_cursor)
@@ -0,0 +1,162 @@
+from itertools import combinations
+from db import get_connection, execute, register_query
+from models import MAX_INTEGER, is_whole_number
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from .expand import fetch_by_ids
+from .animal_requests import ANIMAL_FIELDS
+from .customer_requests import CUSTOMER_FIELDS
+from .employee_requests import EMPLOYEE_FIELDS
+
+# Query string keys GET /search accepts besides ?q=
+SEARCH_OPTIONS = ("type", "limit", "offset")
+
+# Maps the ASCII control characters to spaces, for str.translate()
+CONTROL_CHARACTERS = {code: " " for code in (*range(32), 127)}
+
+# The resources /search looks through. Each one maps to (table, FTS5 index
+# from migration 3, column weights for ranking, columns sent back).
+# A match in a name counts for more than one in a breed or address.
+SEARCH_INDEXES = {
+    "animals": ("Animal", "AnimalSearch", (4.0, 1.0), ANIMAL_FIELDS),
+    "customers": ("Customer", "CustomerSearch", (4.0, 1.0, 2.0), CUSTOMER_FIELDS),
+    "employees": ("Employee", "EmployeeSearch", (4.0, 1.0), EMPLOYEE_FIELDS),
+}
+
+
+def parse_search_params(query):
+    """Reads ?q=, ?type=, ?limit= and ?offset= out of a parse_qs() dictionary
+
+    Returns:
+        tuple: (FTS5 match expression, resources to search, limit, offset)
+
+    Raises:
+        ValueError: with a message for the client if a parameter is invalid
+    """
+    # Control characters like NUL end the quoted FTS5 string early, so they
+    # separate words just like spaces do
+    terms = " ".join(query.get("q", [])).translate(CONTROL_CHARACTERS).split()
+    if not terms:
+        raise ValueError("q must have at least one word to search for")
+
+    # Quote every word so characters like - or : are searched for rather
+    # than read as FTS5 syntax, and make each one a prefix so "snick"
+    # finds Snickers. Every word has to match.
+    match = " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+    resources = tuple(SEARCH_INDEXES)
+    if "type" in query:
+        resources = tuple(
+            resource.strip()
+            for value in query["type"]
+            for resource in value.split(",")
+            if resource.strip()
+        )
+        unknown = [resource for resource in resources if resource not in SEARCH_INDEXES]
+        if unknown or not resources:
+            raise ValueError(f"type must be a comma separated list of {', '.join(SEARCH_INDEXES)}")
+
+    try:
+        limit = int(query.get("limit", [DEFAULT_PAGE_SIZE])[0])
+        offset = int(query.get("offset", [0])[0])
+    except ValueError:
+        raise ValueError("limit and offset must be whole numbers") from None
+
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if offset < 0:
+        raise ValueError("offset can't be negative")
+    if not is_whole_number(offset):
+        raise ValueError(f"offset can't be over {MAX_INTEGER}")
+
+    return (match, resources, limit, offset)
+
+
+def search(match, resources, limit, offset=0):
+    """Finds the best matches for a search across several resources
+
+    Each index ranks its matches with bm25(), which is lower for better
+    matches, so the results of all of them can be merged into one order.
+    Ranked results have no stable id order to hang a keyset cursor on,
+    so pages are taken by offset.
+
+    Args:
+        match (string): the FTS5 match expression from parse_search_params()
+        resources (tuple): keys of SEARCH_INDEXES to look through
+        limit (number): the page size
+        offset (number): how many results earlier pages held
+
+    Returns:
+        tuple: (results, next_offset) where each result is a dictionary of
+        type, id, rank and the matching row, and next_offset is None on the
+        last page
+    """
+    # The same resources in the order of SEARCH_INDEXES, which is the
+    # order their statement was registered with
+    resources = tuple(resource for resource in SEARCH_INDEXES if resource in resources)
+
+    with get_connection() as conn:
+        db_cursor = conn.cursor()
+
+        # Ask for one result more than the page holds to learn if there is a next page
+        execute(
+            db_cursor,
+            _search_query(resources),
+            [match] * len(resources) + [limit + 1, offset],
+        )
+        dataset = db_cursor.fetchall()
+
+        next_offset = None
+        if len(dataset) > limit:
+            dataset = dataset[:limit]
+            next_offset = offset + limit
+
+        # Load the matching rows with one IN query per resource
+        rows = {}
+        for resource in resources:
+            (table, index, weights, fields) = SEARCH_INDEXES[resource]
+            ids = [id for (type, id, rank) in dataset if type == resource]
+            rows[resource] = fetch_by_ids(table, fields, ids)
+
+    results = [
+        {"type": type, "id": id, "rank": rank, "item": rows[type].get(id)}
+        for (type, id, rank) in dataset
+    ]
+
+    return (results, next_offset)
+
+
+def _search_query(resources):
+    """The catalog name of the statement that searches these resources,
+    e.g. "search.animals+customers"
+    """
+    return "search." + "+".join(resources)
+
+
+def _register_search_queries():
+    """Adds a statement to the query catalog for every combination of
+    resources ?type= can ask for
+    """
+    for count in range(1, len(SEARCH_INDEXES) + 1):
+        for resources in combinations(SEARCH_INDEXES, count):
+            selects = []
+            for resource in resources:
+                (table, index, weights, fields) = SEARCH_INDEXES[resource]
+                selects.append(
+                    f"""
+            SELECT '{resource}' type, rowid id, bm25({index}, {", ".join(map(str, weights))}) rank
+            FROM {index}
+            WHERE {index} MATCH ?
+            """
+                )
+
+            register_query(
+                _search_query(resources),
+                " UNION ALL ".join(selects)
+                + """
+            ORDER BY rank, type, id
+            LIMIT ? OFFSET ?
+            """,
+            )
+
+
+_register_search_queries()
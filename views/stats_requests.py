@@ -0,0 +1,139 @@
+import sqlite3
+from db import get_connection, execute, register_query
+
+# The most customers GET /stats/top-customers sends back
+MAX_TOP_CUSTOMERS = 100
+
+# The summary queries, kept in the query catalog (see db/queries.py)
+ANIMALS_BY_LOCATION = register_query(
+    "stats.animals_by_location",
+    """
+    SELECT
+        l.id location_id,
+        l.name location_name,
+        s.status,
+        s.count
+    FROM Location l
+    LEFT JOIN AnimalCountByLocationStatus s
+        ON s.location_id = l.id
+    ORDER BY l.id, s.status
+    """,
+)
+
+TOP_CUSTOMERS = register_query(
+    "stats.top_customers",
+    """
+    SELECT
+        s.customer_id,
+        c.name,
+        s.count animals
+    FROM AnimalCountByCustomer s
+    JOIN Customer c
+        ON c.id = s.customer_id
+    ORDER BY s.count DESC, s.customer_id
+    LIMIT ?
+    """,
+)
+
+STAFFING = register_query(
+    "stats.staffing",
+    """
+    SELECT
+        l.id location_id,
+        l.name location_name,
+        COALESCE(a.animals, 0) animals,
+        COALESCE(e.count, 0) employees
+    FROM Location l
+    LEFT JOIN (
+        SELECT location_id, SUM(count) animals
+        FROM AnimalCountByLocationStatus
+        GROUP BY location_id
+    ) a
+        ON a.location_id = l.id
+    LEFT JOIN EmployeeCountByLocation e
+        ON e.location_id = l.id
+    ORDER BY l.id
+    """,
+)
+
+
+def get_animal_counts_by_location():
+    """Counts the animals at each location, in total and per status
+
+    Reads the AnimalCountByLocationStatus summary (migration 4), which has
+    one row per location and status, so this costs the same however many
+    animals there are.
+
+    Returns:
+        list: {location_id, location_name, animals, by_status} dictionaries,
+        where by_status maps each status to its count
+    """
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        db_cursor = conn.cursor()
+
+        execute(db_cursor, ANIMALS_BY_LOCATION)
+
+        locations = {}
+        for row in db_cursor:
+            location = locations.get(row["location_id"])
+            if location is None:
+                location = locations[row["location_id"]] = {
+                    "location_id": row["location_id"],
+                    "location_name": row["location_name"],
+                    "animals": 0,
+                    "by_status": {},
+                }
+
+            # A location with no animals has one row with a NULL status
+            if row["status"] is not None:
+                location["animals"] += row["count"]
+                location["by_status"][row["status"]] = row["count"]
+
+    return list(locations.values())
+
+
+def get_top_customers(limit):
+    """Returns the customers with the most animals, most first
+
+    The AnimalCountByCustomer summary is indexed on its count, so this
+    reads `limit` index entries rather than grouping every animal.
+
+    Args:
+        limit (number): how many customers to return
+
+    Returns:
+        list: {customer_id, name, animals} dictionaries
+    """
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        db_cursor = conn.cursor()
+
+        execute(db_cursor, TOP_CUSTOMERS, (limit,))
+
+        return [dict(row) for row in db_cursor]
+
+
+def get_staffing_by_location():
+    """Compares the animals at each location with the employees there
+
+    Returns:
+        list: {location_id, location_name, animals, employees,
+        animals_per_employee} dictionaries. animals_per_employee is None
+        for a location without employees.
+    """
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        db_cursor = conn.cursor()
+
+        execute(db_cursor, STAFFING)
+
+        locations = []
+        for row in db_cursor:
+            location = dict(row)
+            location["animals_per_employee"] = (
+                round(row["animals"] / row["employees"], 2) if row["employees"] else None
+            )
+            locations.append(location)
+
+    return locations